@@ -0,0 +1,182 @@
+"""
+Benchmark whole builds of a synthetic site (see sitegen.py), stage by stage, and compare the results of two runs.
+
+    python benchmarks/bench_build.py run --pages 200 --repeat 3 --output results.json
+    python benchmarks/bench_build.py compare baseline.json results.json --threshold 0.1
+
+Each build runs `compost build` in a fresh process with --trace, and the time of each stage of the build is read back
+from the trace.  The scenarios are:
+
+* cold - no build directory or output, so everything is built from scratch
+* warm - nothing has changed since the last build
+* edit-page - one page has changed
+* edit-data - one row of the glossary CSV, which every page uses, has changed
+
+The median of the repeats is reported.  compare exits with status 1 if any scenario or stage has got slower by more
+than the threshold, so that it can be used to gate upgrades.
+"""
+import os, sys, json, time, shutil, platform, tempfile, argparse, statistics, subprocess
+from datetime import datetime
+
+import sitegen
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["cold", "warm", "edit-page", "edit-data"]
+
+
+def _build(config, jobs, trace_file):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = REPO + os.pathsep + env.get("PYTHONPATH", "")
+    cmd = [sys.executable, "-m", "compost.core", "build", config, "--trace", trace_file, "--jobs", str(jobs)]
+    start = time.perf_counter()
+    subprocess.run(cmd, env=env, check=True, stdout=subprocess.DEVNULL)
+    wall = time.perf_counter() - start
+
+    with open(trace_file, encoding="utf-8") as f:
+        events = json.load(f)["traceEvents"]
+    stages = {}
+    for e in events:
+        if e.get("cat") == "build" and e.get("ph") == "X":
+            stages[e["name"]] = stages.get(e["name"], 0.0) + e["dur"] / 1e6
+
+    with open(os.path.join(os.path.dirname(config), "build", "report.json"), encoding="utf-8") as f:
+        rendered = len(json.load(f)["pages"])
+
+    return {"wall" : wall, "stages" : stages, "pages_rendered" : rendered}
+
+
+def _prepare(scenario, base, run):
+    """Make whatever change the scenario calls for, before it is built"""
+    if scenario == "cold":
+        for d in ["build", "output"]:
+            shutil.rmtree(os.path.join(base, d), ignore_errors=True)
+    elif scenario == "edit-page":
+        with open(os.path.join(base, "source", "content", "pages", "page0.html"), "a", encoding="utf-8") as f:
+            f.write("<!-- edit {x} -->\n".format(x=run))
+    elif scenario == "edit-data":
+        path = os.path.join(base, "source", "data", "glossary.csv")
+        with open(path, encoding="utf-8") as f:
+            lines = f.readlines()
+        lines[-1] = lines[-1].rstrip("\n") + " edit" + str(run) + "\n"
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+
+
+def _summarise(samples):
+    stages = {}
+    for s in samples:
+        for name in s["stages"]:
+            stages[name] = statistics.median([x["stages"].get(name, 0.0) for x in samples])
+    return {
+        "wall" : statistics.median([s["wall"] for s in samples]),
+        "stages" : stages,
+        "pages_rendered" : samples[-1]["pages_rendered"],
+        "samples" : samples
+    }
+
+
+def run(args):
+    params = sitegen.params_from(args)
+    base = args.site or tempfile.mkdtemp(prefix="compost-bench-")
+    try:
+        config = sitegen.generate(base, **params)
+        trace_file = os.path.join(base, "trace.json")
+        results = {}
+        for scenario in args.scenarios:
+            samples = []
+            for i in range(args.repeat):
+                if scenario != "cold":
+                    # start each warm sample from an up to date build
+                    _build(config, args.jobs, trace_file)
+                _prepare(scenario, base, i)
+                samples.append(_build(config, args.jobs, trace_file))
+            results[scenario] = _summarise(samples)
+            print("{s:<10} {w:>8.3f} s  ({p} pages rendered)".format(s=scenario, w=results[scenario]["wall"],
+                                                                     p=results[scenario]["pages_rendered"]))
+    finally:
+        if args.site is None:
+            shutil.rmtree(base, ignore_errors=True)
+
+    p = dict(sitegen.DEFAULTS)
+    p.update(params)
+    out = {
+        "created" : datetime.now().isoformat(),
+        "python" : platform.python_version(),
+        "platform" : platform.platform(),
+        "params" : p,
+        "jobs" : args.jobs,
+        "repeat" : args.repeat,
+        "scenarios" : results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(json.dumps(out, indent=2, sort_keys=True))
+    print("Results written to " + args.output)
+
+
+def compare(args):
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.results, encoding="utf-8") as f:
+        results = json.load(f)
+
+    if baseline.get("params") != results.get("params") or baseline.get("jobs") != results.get("jobs"):
+        print("Warning: the two runs built different sites, so the comparison may not be meaningful")
+
+    regressions = 0
+    print("{s:<10} {m:<24} {b:>10} {n:>10} {c:>8}".format(s="scenario", m="measure", b="baseline", n="new", c="change"))
+    # results from bench_import.py have scenarios of their own
+    for scenario in SCENARIOS + sorted(set(baseline["scenarios"].keys()) - set(SCENARIOS)):
+        if scenario not in baseline["scenarios"] or scenario not in results["scenarios"]:
+            continue
+        old = baseline["scenarios"][scenario]
+        new = results["scenarios"][scenario]
+        measures = [("wall", old["wall"], new["wall"])]
+        for name in sorted(old["stages"].keys()):
+            if name in new["stages"]:
+                measures.append((name, old["stages"][name], new["stages"][name]))
+
+        for name, b, n in measures:
+            change = (n - b) / b if b > 0 else 0.0
+            # very short stages are all noise, so a regression has to be a real amount of time as well as a ratio
+            flag = ""
+            if change > args.threshold and n - b > args.min_delta:
+                flag = "  REGRESSION"
+                regressions += 1
+            print("{s:<10} {m:<24} {b:>10.4f} {n:>10.4f} {c:>+7.1%}{f}".format(s=scenario, m=name, b=b, n=n, c=change,
+                                                                              f=flag))
+
+    if regressions > 0:
+        print("{x} regressions".format(x=regressions))
+        sys.exit(1)
+    print("No regressions")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    r = sub.add_parser("run", help="generate a site and benchmark building it")
+    sitegen.add_arguments(r)
+    r.add_argument("--repeat", type=int, default=3, help="number of times to build each scenario")
+    r.add_argument("--jobs", type=int, default=1, help="number of processes to render pages with")
+    r.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    r.add_argument("--site", help="generate the site here, and keep it, rather than in a temporary directory")
+    r.add_argument("--output", default="benchmark.json", help="file to write the results to")
+
+    c = sub.add_parser("compare", help="compare two sets of results, and fail if the second is slower")
+    c.add_argument("baseline")
+    c.add_argument("results")
+    c.add_argument("--threshold", type=float, default=0.10, help="fractional slowdown that counts as a regression")
+    c.add_argument("--min-delta", type=float, default=0.01,
+                   help="slowdowns of less than this many seconds are ignored")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
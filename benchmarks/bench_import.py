@@ -0,0 +1,90 @@
+"""
+Benchmark how long compost takes to start: importing compost.core, and running `compost --help`.
+
+    python benchmarks/bench_import.py --repeat 20 --output startup.json
+
+Each measurement is taken in a fresh process.  The median of the repeats is reported, along with the modules which
+took longest to import (from python -X importtime), so that anything which starts being imported eagerly shows up.
+Results can be compared with `bench_build.py compare`, as they are written in the same form.
+"""
+import os, sys, json, platform, argparse, statistics, subprocess
+from datetime import datetime
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    "import" : ["-c", "import compost.core"],
+    "help" : ["-m", "compost.core", "--help"]
+}
+
+
+def _run(args):
+    """Run python with the args, and return the total time spent importing, and the cumulative time of each module"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = REPO + os.pathsep + env.get("PYTHONPATH", "")
+    cmd = [sys.executable, "-X", "importtime"] + args
+    proc = subprocess.run(cmd, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+    modules = {}
+    total = 0.0
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:"):
+            continue
+        bits = line[len("import time:"):].split("|")
+        if len(bits) != 3 or not bits[1].strip().isdigit():
+            continue
+        cumulative = int(bits[1].strip()) / 1e6
+        # nested imports are indented under the one which imported them, so the top level ones between them
+        # account for all the time spent importing
+        if not bits[2].startswith("  "):
+            total += cumulative
+        modules[bits[2].strip()] = cumulative
+    return total, modules
+
+
+def run(args):
+    results = {}
+    for name in args.scenarios:
+        totals = []
+        modules = {}
+        for i in range(args.repeat):
+            total, mods = _run(SCENARIOS[name])
+            totals.append(total)
+            for k, v in mods.items():
+                modules.setdefault(k, []).append(v)
+        medians = dict([(k, statistics.median(v)) for k, v in modules.items()])
+        results[name] = {
+            "wall" : statistics.median(totals),
+            "stages" : dict([(k, medians[k]) for k in sorted(medians, key=medians.get, reverse=True)[:args.top]]),
+            "modules" : len(medians)
+        }
+        print("{s:<8} {w:>8.1f} ms importing ({m} modules)".format(s=name, w=results[name]["wall"] * 1000,
+                                                                 m=len(medians)))
+        for k, v in list(results[name]["stages"].items())[:5]:
+            print("         {w:>8.1f} ms  {k}".format(w=v * 1000, k=k))
+
+    out = {
+        "created" : datetime.now().isoformat(),
+        "python" : platform.python_version(),
+        "platform" : platform.platform(),
+        "repeat" : args.repeat,
+        "scenarios" : results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(json.dumps(out, indent=2, sort_keys=True))
+    print("Results written to " + args.output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10, help="number of times to start each scenario")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS.keys()), default=sorted(SCENARIOS.keys()))
+    parser.add_argument("--top", type=int, default=20, help="number of slowest modules to record")
+    parser.add_argument("--output", default="startup.json", help="file to write the results to")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Compare keyed lookups against a data source by linear scan (as define() and ref() used to do) with lookups through
+the source's hash index, for a glossary of increasing size.
+
+    python benchmarks/bench_index.py --calls 300 --rows 100 1000 10000
+"""
+import os, sys, csv, time, tempfile, argparse
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from compost import models, utils
+from compost.context import context
+
+
+def _make_glossary(path, rows):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Term", "Definition"])
+        for i in range(rows):
+            writer.writerow(["term-" + str(i), "The definition of term " + str(i)])
+
+
+def _linear_define(source, id):
+    rows = context.data.get(source).shape("table")
+    rows.next()
+    for row in rows:
+        if row[0] == id:
+            return id
+    raise Exception("Unable to find definition for " + id)
+
+
+def _time_calls(fn, source, ids):
+    start = time.perf_counter()
+    for id in ids:
+        fn(source, id)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=300, help="number of define() calls per page")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000, 100000], help="glossary sizes")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as base:
+        data_dir = os.path.join(base, "source", "data")
+        os.makedirs(data_dir)
+        context.config = models.Config({"base_dir" : base})
+
+        print("{a:>8} {b:>12} {c:>12} {d:>8}".format(a="rows", b="linear (s)", c="indexed (s)", d="speedup"))
+        for rows in args.rows:
+            path = os.path.join(data_dir, "glossary.csv")
+            _make_glossary(path, rows)
+            data = models.Data(context.config)
+            data.add_ref(path)
+            context.data = data
+
+            # look up terms spread evenly through the file, so the scan covers half of it on average
+            ids = ["term-" + str((i * 7919) % rows) for i in range(args.calls)]
+            context.start_page("bench")
+            linear = _time_calls(_linear_define, "glossary", ids)
+            indexed = _time_calls(utils.define, "glossary", ids)
+            context.end_page()
+
+            print("{a:>8} {b:>12.4f} {c:>12.4f} {d:>7.1f}x".format(a=rows, b=linear, c=indexed, d=linear / indexed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark the memory and time taken to read every record of a large JSON array, and of the same records as JSON
+lines, with the dict shape (which parses the whole file) and with the streaming shape.
+
+    python benchmarks/bench_json_memory.py --records 200000 --output json_memory.json
+
+Peak memory is measured with tracemalloc, so it counts what Python allocates while the records are read (the file's
+text and the parsed objects), not the size of the process.  Tracing slows down the code which allocates the most
+objects, so the times are only good for comparing runs of this benchmark with each other.
+"""
+import os, sys, json, time, random, shutil, tempfile, argparse, platform, tracemalloc
+from datetime import datetime
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from compost.datasources import jsonsources
+
+
+def _generate(base, records, seed):
+    rand = random.Random(seed)
+    array_path = os.path.join(base, "records.json")
+    lines_path = os.path.join(base, "records.jsonl")
+    with open(array_path, "w", encoding="utf-8") as a, open(lines_path, "w", encoding="utf-8") as l:
+        a.write("[\n")
+        for i in range(records):
+            record = json.dumps({
+                "id" : i,
+                "title" : "Record " + str(i),
+                "score" : rand.random(),
+                "tags" : [rand.choice(["red", "green", "blue"]) for t in range(3)],
+                "description" : " ".join([rand.choice(["lorem", "ipsum", "dolor", "sit", "amet"]) for w in range(20)])
+            })
+            a.write(("  " if i == 0 else ",\n  ") + record)
+            l.write(record + "\n")
+        a.write("\n]\n")
+    return array_path, lines_path
+
+
+def _whole(path):
+    # what the dict shape does: parse the whole file, then iterate over the records
+    return jsonsources.parse_json(path)
+
+
+def _measure(fn, path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = 0
+    for record in fn(path):
+        count += 1
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds" : elapsed, "peak_bytes" : peak, "records" : count}
+
+
+def run(args):
+    base = tempfile.mkdtemp(prefix="compost-json-")
+    try:
+        array_path, lines_path = _generate(base, args.records, args.seed)
+        results = {
+            "array/dict" : _measure(_whole, array_path),
+            "array/stream" : _measure(jsonsources.stream_records, array_path),
+            "lines/stream" : _measure(lambda path: jsonsources.stream_records(path, lines=True), lines_path)
+        }
+        size = os.path.getsize(array_path)
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+    print("{r} records, {s:.1f} MB as a JSON array".format(r=args.records, s=size / 1048576.0))
+    for name, r in results.items():
+        print("{n:<14} {p:>10.1f} MB peak {t:>8.3f} s".format(n=name, p=r["peak_bytes"] / 1048576.0, t=r["seconds"]))
+
+    out = {
+        "created" : datetime.now().isoformat(),
+        "python" : platform.python_version(),
+        "platform" : platform.platform(),
+        "records" : args.records,
+        "file_bytes" : size,
+        "results" : results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(json.dumps(out, indent=2, sort_keys=True))
+    print("Results written to " + args.output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=100000, help="number of records to generate")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the generated records")
+    parser.add_argument("--output", default="json_memory.json", help="file to write the results to")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Generate a synthetic compost site, for benchmarking builds at a given scale.
+
+    python benchmarks/sitegen.py /tmp/site --pages 200 --include-depth 3 --csv-rows 5000
+
+Every page extends a base template, includes a chain of fragments include-depth deep, has a table of contents and
+headers-per-page headers, defines-per-page calls to define() against the glossary CSV, a dl() over part of the
+glossary, and a few lookups into the JSON data file.  The content is generated from a fixed seed, so that the same
+parameters always give the same site.
+"""
+import os, csv, json, random, argparse
+
+DEFAULTS = {
+    "pages" : 50,
+    "include_depth" : 3,
+    "csv_rows" : 1000,
+    "csv_columns" : 4,
+    "json_items" : 500,
+    "headers_per_page" : 10,
+    "defines_per_page" : 20,
+    "seed" : 1
+}
+
+WORDS = ["compost", "widget", "gadget", "sprocket", "template", "render", "fragment", "record", "schema", "table",
+         "header", "section", "data", "source", "build", "page", "markdown", "link", "index", "value"]
+
+
+def generate(base, **params):
+    """Write the site to base, and return the path to its config file"""
+    p = dict(DEFAULTS)
+    p.update(dict([(k, v) for k, v in params.items() if v is not None]))
+    rand = random.Random(p["seed"])
+
+    src = os.path.join(base, "source")
+    for d in ["assets", "content/pages", "content/fragments", "data", "templates"]:
+        os.makedirs(os.path.join(src, d), exist_ok=True)
+
+    config = os.path.join(base, "config.json")
+    _write(config, json.dumps({"src_dir" : "source", "out_dir" : "output", "build_dir" : "build"}, indent=2))
+
+    _write(os.path.join(src, "templates", "base.html"),
+           "<html><head><title>{% block title %}{% endblock %}</title></head>\n"
+           "<body>\n{% block content %}{% endblock %}\n</body></html>\n")
+    _write(os.path.join(src, "assets", "site.css"), "body { font-family: sans-serif; }\n")
+
+    _glossary(os.path.join(src, "data", "glossary.csv"), p, rand)
+    _records(os.path.join(src, "data", "records.json"), p, rand)
+
+    for level in range(p["include_depth"]):
+        text = "### Fragment level {x}\n\n{y}\n".format(x=level, y=_sentence(rand, 40))
+        if level + 1 < p["include_depth"]:
+            text += '\n{{% include "fragments/level{x}.md" %}}\n'.format(x=level + 1)
+        _write(os.path.join(src, "content", "fragments", "level{x}.md".format(x=level)), text)
+
+    for n in range(p["pages"]):
+        _write(os.path.join(src, "content", "pages", "page{x}.html".format(x=n)), _page(n, p, rand))
+
+    return config
+
+
+def _page(n, p, rand):
+    lines = [
+        '{% extends "base.html" %}',
+        "{{% block title %}}Page {x}{{% endblock %}}".format(x=n),
+        "{% block content %}",
+        "{{ toc() }}"
+    ]
+    headers = max(p["headers_per_page"], 1)
+    defines = [p["defines_per_page"] // headers + (1 if i < p["defines_per_page"] % headers else 0)
+               for i in range(headers)]
+    for h in range(p["headers_per_page"]):
+        level = 1 if h % 3 == 0 else 2
+        lines.append('<h{l}>{{{{ header("Section {x}", {l}) }}}}</h{l}>'.format(l=level, x=h))
+        lines.append("{% markdown %}")
+        text = _sentence(rand, 30)
+        for d in range(defines[h]):
+            term = "term-" + str(rand.randrange(p["csv_rows"]))
+            text += ' {{{{ define("glossary", "{t}") }}}} {s}'.format(t=term, s=_sentence(rand, 5))
+        lines.append(text)
+        lines.append("{% endmarkdown %}")
+    if p["include_depth"] > 0:
+        lines.append('{% include "fragments/level0.md" %}')
+    lines.append('{{{{ dl("glossary", "Term", "Definition", size=10, offset={x}) }}}}'.format(
+        x=rand.randrange(max(p["csv_rows"] - 10, 1))))
+    lines.append("<ul>")
+    for i in range(5):
+        lines.append('<li>{{{{ data.get("records").get("items")[{x}].title }}}}</li>'.format(
+            x=rand.randrange(p["json_items"])))
+    lines.append("</ul>")
+    lines.append("{% endblock %}")
+    return "\n".join(lines) + "\n"
+
+
+def _glossary(path, p, rand):
+    headers = ["Term", "Definition"] + ["Column " + str(i) for i in range(2, p["csv_columns"])]
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        for i in range(p["csv_rows"]):
+            row = ["term-" + str(i), _sentence(rand, 12)]
+            row += [rand.choice(WORDS) for c in range(2, p["csv_columns"])]
+            writer.writerow(row)
+
+
+def _records(path, p, rand):
+    items = []
+    for i in range(p["json_items"]):
+        items.append({
+            "id" : i,
+            "title" : _sentence(rand, 4),
+            "tags" : [rand.choice(WORDS) for t in range(3)],
+            "description" : _sentence(rand, 20)
+        })
+    _write(path, json.dumps({"items" : items}, indent=2))
+
+
+def _sentence(rand, words):
+    return " ".join([rand.choice(WORDS) for i in range(words)]).capitalize() + "."
+
+
+def _write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def add_arguments(parser):
+    parser.add_argument("--pages", type=int, help="number of pages (default {x})".format(x=DEFAULTS["pages"]))
+    parser.add_argument("--include-depth", type=int,
+                        help="depth of the chain of included fragments (default {x})".format(x=DEFAULTS["include_depth"]))
+    parser.add_argument("--csv-rows", type=int, help="rows in the glossary CSV (default {x})".format(x=DEFAULTS["csv_rows"]))
+    parser.add_argument("--csv-columns", type=int,
+                        help="columns in the glossary CSV (default {x})".format(x=DEFAULTS["csv_columns"]))
+    parser.add_argument("--json-items", type=int,
+                        help="items in the JSON data file (default {x})".format(x=DEFAULTS["json_items"]))
+    parser.add_argument("--headers-per-page", type=int,
+                        help="header() calls per page (default {x})".format(x=DEFAULTS["headers_per_page"]))
+    parser.add_argument("--defines-per-page", type=int,
+                        help="define() calls per page (default {x})".format(x=DEFAULTS["defines_per_page"]))
+    parser.add_argument("--seed", type=int, help="seed for the generated content (default {x})".format(x=DEFAULTS["seed"]))
+
+
+def params_from(args):
+    return dict([(k, getattr(args, k)) for k in DEFAULTS.keys() if getattr(args, k, None) is not None])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base", help="directory to generate the site in")
+    add_arguments(parser)
+    args = parser.parse_args()
+    config = generate(args.base, **params_from(args))
+    print("Generated site; build it with: compost build " + config)
+
+
+if __name__ == "__main__":
+    main()
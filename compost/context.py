@@ -1,8 +1,18 @@
+class PageContext(object):
+    """Runtime state which belongs to the rendering of a single page"""
+    def __init__(self, page):
+        self.page = page
+        self.store = {}
+        self.dependencies = set()
+        self.deferred = []
+
+
 class Context(object):
     def __init__(self):
         self._config = None
         self._data = None
         self._runtime_store = {}
+        self._page = None
 
     @property
     def config(self):
@@ -20,10 +30,32 @@ class Context(object):
     def data(self, data):
         self._data = data
 
+    @property
+    def page(self):
+        return self._page
+
+    def start_page(self, page):
+        self._page = PageContext(page)
+        return self._page
+
+    def end_page(self):
+        page = self._page
+        self._page = None
+        return page
+
+    def _store(self):
+        if self._page is not None:
+            return self._page.store
+        return self._runtime_store
+
     def remember(self, key, value):
-        self._runtime_store[key] = value
+        self._store()[key] = value
 
     def recall(self, key, default=None):
-        return self._runtime_store.get(key, default)
+        return self._store().get(key, default)
+
+    def add_dependency(self, path):
+        if self._page is not None and path is not None:
+            self._page.dependencies.add(path)
 
 context = Context()
\ No newline at end of file
@@ -1,24 +1,127 @@
 import os, shutil, codecs, json, re
-from jinja2 import Environment, select_autoescape, FileSystemLoader
 from compost import models
-from compost import utils
-from compost import watcher
 from compost.context import context
 from datetime import datetime
 import traceback
 from compost import plugin
-from compost.jinja2_extensions import MarkupWrapperLoader
-
+from compost import manifest
+from compost import deps
+from compost import deferred
+from compost import exceptions
+from compost import trace
+from compost import profiler
+
+# jinja2, markdown and the template functions are imported when a build first needs them, rather than here, so that
+# the command line starts quickly
+
+
+def build(full=False, jobs=1, trace_file=None, trace_top=10, profile_file=None):
+    if trace_file is not None:
+        trace.start()
+    if profile_file is not None:
+        profiler.start()
+    try:
+        with trace.span("build"):
+            _build(full, jobs)
+    finally:
+        if trace_file is not None:
+            tracer = trace.stop()
+            trace.write(tracer.events, trace_file)
+            print(trace.summary(tracer.events, trace_top))
+        if profile_file is not None:
+            prof = profiler.stop()
+            prof.write(profile_file)
+            print(prof.summary(trace_top))
+
+
+def _build(full=False, jobs=1, session=None, paths=None, render=True):
+    config = context.config
+    bd = config.build_dir()
 
-def build():
-    _clean_directories()
-    _load_data()
-    _generate_stage()
-    _copy_assets()
-    _exports()
-    _compile_templates()
-    # _render_sections()
-    _finish()
+    # work out what has changed since the last build.  Without a usable manifest from a previous build (or if the
+    # config has changed, or we were asked for a full build) we start again from clean directories
+    with trace.span("scan"):
+        previous = None
+        if session is not None and session.manifest is not None and paths is not None:
+            # the session already knows which files have changed, so there is no need to look at the rest
+            previous = session.manifest
+            current = manifest.Manifest.update(config, previous, paths)
+        else:
+            if not full:
+                previous = manifest.Manifest.load(bd)
+            current = manifest.Manifest.scan(config, previous)
+
+    changed = None
+    if previous is None or previous.config != current.config:
+        with trace.span("clean_directories"):
+            _clean_directories()
+        previous = None
+    else:
+        changed = current.changed_files(previous)
+
+    with trace.span("load_data"):
+        _load_data(session.data_cache if session is not None else None)
+    with trace.span("generate_stage"):
+        _generate_stage()
+    with trace.span("copy_assets"):
+        _copy_assets(current, changed)
+    with trace.span("exports"):
+        _exports(current, changed)
+
+    if previous is None:
+        graph = deps.DependencyGraph()
+    elif session is not None and session.graph is not None:
+        graph = session.graph
+    else:
+        graph = deps.DependencyGraph.load(bd)
+    all_pages = _list_pages(current)
+    for page in list(graph.pages()):
+        if page not in all_pages:
+            graph.forget(page)
+
+    pages = _pages_to_render(all_pages, current, previous, graph, changed)
+
+    if render:
+        # a session renders in this process with the environment it keeps, which it builds once, so that
+        # rebuilds stay warm.  Only its first, cold, build is shared out between worker processes
+        env = None
+        if session is not None and len(pages) > 0 and (jobs <= 1 or session.env is not None or previous is not None):
+            env = session.environment()
+
+        with trace.span("compile_templates", pages=len(pages)):
+            _compile_templates(pages, graph, jobs, env)
+        # _render_sections()
+    else:
+        # the pages will be rendered by the session as they are asked for.  Until then their old output is out of
+        # date, and removing it means that the next build renders them if nothing else has
+        with trace.span("discard_stale"):
+            _discard_outputs(pages)
+
+    with trace.span("finish"):
+        if render:
+            _finish(pages)
+        if previous is not None:
+            _remove_orphans(current, previous)
+        graph.save(bd)
+        current.save(bd)
+        from compost.renderers import md
+        md.cache.trim()
+
+    if session is not None:
+        session.manifest = current
+        session.graph = graph
+        session.pages = set(all_pages)
+        if render:
+            session.stale.difference_update(pages)
+        else:
+            session.stale.intersection_update(session.pages)
+            session.stale.update(pages)
+
+    return changed
+
+
+# caches in build_dir/cache which survive a clean build
+KEPT_CACHES = ["data", "markdown"]
 
 
 def _clean_directories():
@@ -26,8 +129,28 @@ def _clean_directories():
     bd = config.build_dir()
     od = config.out_dir()
     if os.path.exists(bd):
-        shutil.rmtree(bd)
-    os.mkdir(bd)
+        for the_file in os.listdir(bd):
+            if the_file == "cache":
+                continue
+            file_path = os.path.join(bd, the_file)
+            if os.path.isdir(file_path):
+                shutil.rmtree(file_path)
+            else:
+                os.unlink(file_path)
+        # the data and markdown caches are keyed by content, so they are still good after a clean, and are kept;
+        # anything else (e.g. compiled templates) may depend on the config, so goes
+        cd = os.path.join(bd, "cache")
+        if os.path.exists(cd):
+            for the_file in os.listdir(cd):
+                if the_file in KEPT_CACHES:
+                    continue
+                file_path = os.path.join(cd, the_file)
+                if os.path.isdir(file_path):
+                    shutil.rmtree(file_path)
+                else:
+                    os.unlink(file_path)
+    else:
+        os.mkdir(bd)
 
     if os.path.exists(od):
         for the_file in os.listdir(od):
@@ -56,13 +179,13 @@ def _clean_directories():
         os.mkdir(post_markup_dir)
 
 
-def _load_data():
+def _load_data(cache=None):
     config = context.config
     dd = os.path.join(config.src_dir(), "data")
     if not os.path.exists(dd):
         return
 
-    data = models.Data(config)
+    data = models.Data(config, cache)
 
     for dirpath, dirnames, filenames in os.walk(dd):
         for fn in filenames:
@@ -77,88 +200,142 @@ def _generate_stage():
     pass
 
 
-def _copy_assets():
+def _copy_assets(current, changed=None):
     config = context.config
     src_dir = config.src_dir()
-    source = os.path.join(src_dir, "assets")
-    if not os.path.exists(source):
-        return
     od = config.out_dir()
-    target = os.path.join(od, "assets")
-    shutil.copytree(source, target)
+    prefix = "assets" + os.sep
+    for rel in current.files():
+        if not rel.startswith(prefix):
+            continue
+        current.add_output(rel, rel)
+        target = os.path.join(od, rel)
+        if changed is not None and rel not in changed and os.path.exists(target):
+            continue
+        outdir = os.path.dirname(target)
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+        shutil.copy2(os.path.join(src_dir, rel), target)
 
 
-def _exports():
+def _exports(current, changed=None):
     config = context.config
     src_dir = config.src_dir()
     od = config.out_dir()
     for ex in config.exports:
-        source = os.path.join(src_dir, ex.get("source"))
+        current.add_output(ex.get("source"), ex.get("target"))
         target = os.path.join(od, ex.get("target"))
+        if changed is not None and os.path.normpath(ex.get("source")) not in changed and os.path.exists(target):
+            continue
+        source = os.path.join(src_dir, ex.get("source"))
         shutil.copyfile(source, target)
 
 
-def _compile_templates():
+def _list_pages(current):
+    pages_prefix = os.path.join("content", "pages") + os.sep
+    pages = []
+    for rel in current.files():
+        if rel.startswith(pages_prefix):
+            pages.append(rel[len(pages_prefix):])
+            current.add_output(rel, rel[len(pages_prefix):])
+    pages.sort()
+    return pages
+
+
+def _pages_to_render(pages, current, previous=None, graph=None, changed=None):
     config = context.config
-    bd = config.build_dir()
-    post_template_dir = os.path.join(bd, "post_template")
-    post_markup_dir = os.path.join(bd, "post_markup")
-    src_dir = config.src_dir()
-    content_path = os.path.join(src_dir, "content")
-    templates_path = os.path.join(src_dir, "templates")
+    od = config.out_dir()
+    pages_prefix = os.path.join("content", "pages") + os.sep
+    assets_prefix = "assets" + os.sep
 
-    # prep the extensions
-    extensions = []
-    for k, v in config.renderers().items():
-        if "jinja2_extension" in v:
-            ext_klazz = plugin.load_class(v["jinja2_extension"])
-            extensions.append(ext_klazz)
+    if changed is None or previous is None or graph is None:
+        return pages
 
-    # set up the initial environment with the essential globals
-    env = Environment(
-        loader=MarkupWrapperLoader(FileSystemLoader([content_path, templates_path]), config),
-        autoescape=False,# select_autoescape(['html'], default_for_string=False),
-        extensions=extensions
-    )
-    env.globals.update(
-        config=context.config,
-        data=context.data
-    )
+    # adding or removing a template, fragment or data file can change which file a page resolves a
+    # name to, so the recorded dependencies can't be relied on, and every page has to be rebuilt
+    for rel in changed:
+        if rel.startswith(pages_prefix) or rel.startswith(assets_prefix):
+            continue
+        if current.fingerprint(rel) is None or previous.fingerprint(rel) is None:
+            return pages
 
-    # add any additional globals that will be available
-    globals_def = {}
-    util_defs = config.utils()
-    for k, v in util_defs.items():
-        fn = plugin.load_function(v.get("function"))
-        globals_def[k] = fn
-    env.globals.update(**globals_def)
+    affected = graph.affected_pages(changed)
+    return [p for p in pages
+            if p in affected
+            or graph.deps(p) is None
+            or os.path.join(pages_prefix, p) in changed
+            or not os.path.exists(os.path.join(od, p))]
 
-    pages = []
-    pages_path = os.path.join(content_path, "pages")
-    for dirpath, dirnames, filenames in os.walk(pages_path):
-        for fn in filenames:
-            sub_path = dirpath[len(pages_path) + 1:]
-            pages.append(os.path.join(sub_path, fn))
 
+def _remove_orphans(current, previous):
+    config = context.config
+    od = config.out_dir()
+    post_template_dir = os.path.join(config.build_dir(), "post_template")
+    for target in current.orphaned_outputs(previous):
+        for root in [od, post_template_dir]:
+            path = os.path.join(root, target)
+            if os.path.isfile(path):
+                os.unlink(path)
+            # tidy up any directories that the removal has left empty
+            parent = os.path.dirname(path)
+            while parent != root and os.path.isdir(parent) and len(os.listdir(parent)) == 0:
+                os.rmdir(parent)
+                parent = os.path.dirname(parent)
+
+
+def _discard_outputs(pages):
+    config = context.config
+    post_template_dir = os.path.join(config.build_dir(), "post_template")
     for page in pages:
-        # render the template from file the first time
-        template = env.get_template(os.path.join("pages", page))
-        two = template.render()
-        one = ""
+        for root in [config.out_dir(), post_template_dir]:
+            path = os.path.join(root, page)
+            if os.path.isfile(path):
+                os.unlink(path)
 
-        # now keep rendering until we have rendered everything renderable
-        # FIXME: we should record each iteration of the template for review in the build dir
-        while one != two:
-            one = two
-            template = env.from_string(one)
-            two = template.render()
 
-        outfile = os.path.join(post_template_dir, page)
-        outdir = os.path.dirname(outfile)
-        if not os.path.exists(outdir):
-            os.makedirs(outdir)
-        with codecs.open(outfile, "wb", "utf-8") as f:
-            f.write(two)
+def _compile_templates(pages, graph, jobs=1, env=None):
+    config = context.config
+    bd = config.build_dir()
+    post_template_dir = os.path.join(bd, "post_template")
+    post_markup_dir = os.path.join(bd, "post_markup")
+
+    results = []
+    if len(pages) == 0:
+        # nothing to render, so there is no need for an environment either
+        _report(results)
+        return
+
+    if env is None and jobs > 1 and len(pages) > 1:
+        # each worker process builds its own environment and loads its own data once, and then renders
+        # whichever pages it is given.  Results are written out here, in page order.
+        from concurrent.futures import ProcessPoolExecutor
+        from compost.renderers import md
+        workers = min(jobs, len(pages))
+        chunksize = max(1, len(pages) // (workers * 4))
+        tracing = trace.active() is not None
+        profiling = profiler.active() is not None
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(config, tracing, profiling)) as executor:
+            for result in executor.map(_render_page_in_worker, pages, chunksize=chunksize):
+                if tracing:
+                    trace.active().events.extend(result["trace"])
+                if profiling:
+                    profiler.active().merge(result["profile"])
+                # each of the worker's misses was written to the markdown cache, which may need trimming
+                md.cache.written += result["markdown_cache"]["misses"]
+                _write_page(post_template_dir, result["page"], result["text"])
+                graph.record(result["page"], [_src_relative(d) for d in result["dependencies"]])
+                results.append(result)
+    else:
+        if env is None:
+            env = _build_environment()
+        for page in pages:
+            result = _render_page(env, page)
+            _write_page(post_template_dir, page, result["text"])
+            graph.record(page, [_src_relative(d) for d in result["dependencies"]])
+            results.append(result)
+
+    _report(results)
 
     # now we want to reinit the jinja environment, this time with extensions enabled
     # set up the new environment with the essential globals and extensions
@@ -196,18 +373,214 @@ def _compile_templates():
                 g.write(final)
     """
 
-def _finish():
+def _build_environment():
+    from jinja2 import FileSystemLoader
+    from compost.jinja2_extensions import MarkupWrapperLoader, DependencyTrackingEnvironment, \
+        AtomicFileSystemBytecodeCache, CompiledTemplateCache
+
+    config = context.config
+    src_dir = config.src_dir()
+    content_path = os.path.join(src_dir, "content")
+    templates_path = os.path.join(src_dir, "templates")
+
+    # prep the extensions
+    extensions = []
+    for k, v in config.renderers().items():
+        if "jinja2_extension" in v:
+            ext_klazz = config.registry.load_class(v["jinja2_extension"])
+            extensions.append(ext_klazz)
+
+    # compiled file templates are kept between builds in the build directory.  Several workers may be making the
+    # directory at once
+    bytecode_dir = os.path.join(config.build_dir(), "cache", "templates")
+    os.makedirs(bytecode_dir, exist_ok=True)
+
+    # set up the initial environment with the essential globals
+    env = DependencyTrackingEnvironment(
+        loader=MarkupWrapperLoader(FileSystemLoader([content_path, templates_path]), config),
+        autoescape=False,# select_autoescape(['html'], default_for_string=False),
+        extensions=extensions,
+        bytecode_cache=AtomicFileSystemBytecodeCache(bytecode_dir, extensions)
+    )
+    env.compiled_templates = CompiledTemplateCache(env)
+    env.globals.update(
+        config=context.config,
+        data=context.data
+    )
+
+    # add any additional globals that will be available.  Each is imported the first time it is called
+    used = _used_names(env) if config.prune_unused_utils() else None
+    globals_def = {}
+    util_defs = config.utils()
+    for k, v in util_defs.items():
+        if used is not None and k not in used:
+            continue
+        fn = plugin.LazyFunction(v.get("function"))
+        if trace.active() is not None:
+            fn = trace.traced(k, fn)
+        if profiler.active() is not None:
+            fn = profiler.profiled(k, fn)
+        globals_def[k] = fn
+    env.globals.update(**globals_def)
+
+    return env
+
+
+def _used_names(env):
+    """
+    Every name which a template in the environment uses without defining it, or None if they cannot all be parsed
+    (in which case nothing can safely be left out)
+    """
+    from jinja2 import meta, TemplateSyntaxError
+    names = set()
+    with trace.span("find used utils"):
+        for name in env.loader.list_templates():
+            try:
+                source = env.loader.get_source(env, name)[0]
+                names |= meta.find_undeclared_variables(env.parse(source))
+            except TemplateSyntaxError:
+                return None
+    return names
+
+
+def _render_page(env, page):
+    # everything the template functions remember while rendering (headers, tocs, figures) and the
+    # dependencies recorded belong to this page alone, so that the page renders the same regardless of
+    # which other pages are rendered alongside it, or in which process
+    from compost.renderers import md
+    cache = context.data.cache if context.data is not None else None
+    data_before = cache.stats() if cache is not None else models.DataCache().stats()
+    markdown_before = md.cache.stats()
+
+    context.start_page(page)
+    try:
+        with trace.span(page, "page"):
+            text, passes = _render_to_fixed_point(env, page)
+    finally:
+        page_context = context.end_page()
+    data_after = cache.stats() if cache is not None else data_before
+    markdown_after = md.cache.stats()
+
+    return {
+        "page" : page,
+        "text" : text,
+        "dependencies" : page_context.dependencies,
+        "passes" : passes,
+        "data_cache" : dict([(k, data_after[k] - data_before[k]) for k in data_after]),
+        "markdown_cache" : dict([(k, markdown_after[k] - markdown_before[k]) for k in markdown_after])
+    }
+
+
+def _render_to_fixed_point(env, page):
+    from compost.jinja2_extensions import has_template_syntax, settle
+    max_passes = context.config.max_render_passes()
+
+    # render the template from file the first time
+    with trace.span("pass 1", "pass"):
+        template = env.get_template(os.path.join("pages", page))
+        two = template.render()
+    one = None
+    passes = 1
+
+    # now keep rendering until we have rendered everything renderable.  Once there is no template
+    # syntax left we know what further passes would produce without compiling anything
+    # FIXME: we should record each iteration of the template for review in the build dir
+    while one != two:
+        if not has_template_syntax(env, two):
+            two = settle(env, two)
+            break
+        if passes >= max_passes:
+            raise exceptions.RenderException(
+                "Page {x} was still changing after {y} render passes".format(x=page, y=passes))
+        one = two
+        passes += 1
+        with trace.span("pass " + str(passes), "pass"):
+            template = env.compiled_templates.from_string(one)
+            two = template.render()
+
+    # fill in the parts of the page which could only be produced once it had all been rendered
+    with trace.span("resolve deferred", "pass"):
+        two = deferred.resolve(two)
+
+    return two, passes
+
+
+def _write_page(post_template_dir, page, text):
+    outfile = os.path.join(post_template_dir, page)
+    outdir = os.path.dirname(outfile)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    with codecs.open(outfile, "wb", "utf-8") as f:
+        f.write(text)
+
+
+_worker_env = None
+
+def _init_worker(config, tracing=False, profiling=False):
+    global _worker_env
+    if tracing:
+        trace.start()
+    if profiling:
+        profiler.start()
+    context.config = config
+    with trace.span("worker load_data"):
+        _load_data()
+    with trace.span("worker build_environment"):
+        _worker_env = _build_environment()
+
+
+def _render_page_in_worker(page):
+    result = _render_page(_worker_env, page)
+    if trace.active() is not None:
+        # hand back everything recorded in this process since the last page
+        result["trace"] = trace.active().take()
+    if profiler.active() is not None:
+        result["profile"] = profiler.active().take()
+    return result
+
+
+def _report(results):
+    config = context.config
+    report = {
+        "pages" : {},
+        "data_cache" : {"hits" : 0, "disk_hits" : 0, "misses" : 0},
+        "markdown_cache" : {"memory_hits" : 0, "disk_hits" : 0, "misses" : 0}
+    }
+    for result in results:
+        report["pages"][result["page"]] = {
+            "passes" : result["passes"],
+            "data_cache" : result["data_cache"],
+            "markdown_cache" : result["markdown_cache"]
+        }
+        for k in report["data_cache"]:
+            report["data_cache"][k] += result["data_cache"][k]
+        for k in report["markdown_cache"]:
+            report["markdown_cache"][k] += result["markdown_cache"][k]
+
+    with codecs.open(os.path.join(config.build_dir(), "report.json"), "w", "utf-8") as f:
+        f.write(json.dumps(report, indent=2, sort_keys=True))
+
+    if len(results) == 0:
+        print("No pages to render")
+        return
+    most = max(results, key=lambda r: r["passes"])
+    print("Rendered {x} pages; most render passes {y} ({z})".format(x=len(results), y=most["passes"], z=most["page"]))
+    dc = report["data_cache"]
+    print("Data cache: {x} hits ({y} from disk), {z} misses".format(x=dc["hits"] + dc["disk_hits"], y=dc["disk_hits"],
+                                                                    z=dc["misses"]))
+    mc = report["markdown_cache"]
+    lookups = mc["memory_hits"] + mc["disk_hits"] + mc["misses"]
+    if lookups > 0:
+        print("Markdown cache: {x} hits ({y} from disk), {z} misses, {r:.0%} hit rate".format(
+            x=mc["memory_hits"] + mc["disk_hits"], y=mc["disk_hits"], z=mc["misses"],
+            r=float(mc["memory_hits"] + mc["disk_hits"]) / lookups))
+
+
+def _finish(pages):
     config = context.config
     bd = config.build_dir()
     final_dir = os.path.join(bd, "post_template")
 
-    pages = []
-    pages_path = os.path.join(final_dir)
-    for dirpath, dirnames, filenames in os.walk(pages_path):
-        for fn in filenames:
-            sub_path = dirpath[len(pages_path) + 1:]
-            pages.append(os.path.join(sub_path, fn))
-
     for page in pages:
         outpath = os.path.join(config.out_dir(), page)
         outdir = os.path.dirname(outpath)
@@ -216,6 +589,35 @@ def _finish():
         shutil.copyfile(os.path.join(final_dir, page), outpath)
 
 
+def _src_relative(path):
+    src_dir = context.config.src_dir()
+    return os.path.relpath(os.path.abspath(path), os.path.abspath(src_dir))
+
+
+def show_deps(page):
+    config = context.config
+    graph = deps.DependencyGraph.load(config.build_dir())
+    pages_prefix = os.path.join("content", "pages") + os.sep
+    page = os.path.normpath(page)
+    if page.startswith(pages_prefix):
+        page = page[len(pages_prefix):]
+    inputs = graph.deps(page)
+    if inputs is None:
+        print("No dependency information for {x}; has the site been built?".format(x=page))
+        return
+    for i in inputs:
+        print(i)
+
+
+def show_rdeps(path):
+    config = context.config
+    graph = deps.DependencyGraph.load(config.build_dir())
+    if os.path.exists(path):
+        path = _src_relative(path)
+    for page in graph.rdeps(os.path.normpath(path)):
+        print(page)
+
+
 """
 def _render_sections():
     config = context.config
@@ -311,37 +713,153 @@ def __is_next_tag_open_or_close(current_tag, open_tag_rx, content):
         return "close"
 """
 
-def build_closure():
+class BuildSession(object):
+    """
+    Build state which is kept between builds by integrate mode: the template environment (and the templates it has
+    compiled), the parsed data, the manifest and the dependency graph.  Each change reported by the watcher then
+    only costs fingerprinting the changed files and re-rendering the pages which depend on them.
+    """
+    def __init__(self, config_file=None, jobs=1):
+        self.config_file = config_file
+        self.jobs = jobs
+        self.env = None
+        self.data_cache = models.DataCache()
+        self.manifest = None
+        self.graph = None
+        self.pages = set()
+        self.stale = set()
+
+    def reset(self):
+        self.env = None
+        self.data_cache = models.DataCache()
+        self.manifest = None
+        self.graph = None
+        self.pages = set()
+        self.stale = set()
+
+    def environment(self):
+        if self.env is None:
+            self.env = _build_environment()
+        # the data is re-listed on each build (sharing this session's cache), so the global has to follow it
+        self.env.globals.update(
+            config=context.config,
+            data=context.data
+        )
+        return self.env
+
+    def build(self, report=None, render=True):
+        """
+        Bring the site up to date with the changes in the watcher's report (or with whatever has changed since the
+        last build, if there is no report).  If render is False, the affected pages are not rendered, but are
+        marked as stale, to be rendered later by render().  Returns the source files which changed, or None if
+        everything was rebuilt.
+        """
+        if self.config_file is not None:
+            config = load_config(self.config_file)
+            if config.fingerprint() != context.config.fingerprint():
+                # everything may be different under the new config, so start again from cold.  The manifest
+                # records the config too, so the build itself will be a full one
+                print("Config has changed; rebuilding everything")
+                context.config = config
+                self.reset()
+
+        paths = None
+        if report is not None and self.manifest is not None:
+            paths = set()
+            for key in ["new", "removed", "modified"]:
+                paths.update([_src_relative(p) for p in report.get(key, [])])
+            for p in report.get("removed", []):
+                self.data_cache.forget(p)
+
+        try:
+            with trace.span("build"):
+                return _build(jobs=self.jobs, session=self, paths=paths, render=render)
+        except:
+            # the changes from this report have not all been built, so the next build has to work out what has
+            # changed against the manifest of the last build that succeeded
+            self.manifest = None
+            self.graph = None
+            raise
+
+    def render(self, page):
+        """Render a single stale page, and write it to the output directory"""
+        if self.manifest is None:
+            self.build(render=False)
+        if page not in self.stale:
+            return
+        _compile_templates([page], self.graph, 1, self.environment())
+        _finish([page])
+        self.graph.save(context.config.build_dir())
+        self.stale.discard(page)
+
+
+def build_closure(session=None):
+    if session is None:
+        session = BuildSession()
+
     def build_callback(report):
         print(datetime.now())
         print(report)
         try:
-            build()
+            session.build(report)
         except Exception as e:
             print(e)
             traceback.print_exc()
     return build_callback
 
+
+def load_config(path):
+    baseDir = os.path.dirname(path)
+
+    with codecs.open(path) as f:
+        config = json.loads(f.read())
+
+    config["base_dir"] = baseDir
+    return models.Config(config)
+
 def main():
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument("mode", help="operational mode for compost: build, integrate, serve")
+    parser.add_argument("mode", help="operational mode for compost: build, integrate, serve, deps, rdeps")
     parser.add_argument("config", help="config file for this run")
+    parser.add_argument("target", nargs="?",
+                        help="for deps, the page to list the inputs of; for rdeps, the file to list the dependent pages of")
+    parser.add_argument("--full", action="store_true",
+                        help="ignore the results of any previous build and rebuild everything from clean")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of processes to render pages with")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="record timings of every build stage, page, render pass and template function to FILE, "
+                             "in Chrome trace format")
+    parser.add_argument("--trace-top", type=int, default=10,
+                        help="number of slowest pages and functions to list in the trace and profile summaries")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="record the calls, times, arguments and output sizes of every template function, in "
+                             "total and per page, to FILE")
+    parser.add_argument("--host", default="127.0.0.1", help="for serve, the address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="for serve, the port to listen on")
+    parser.add_argument("--no-live-reload", action="store_true",
+                        help="for serve, do not reload pages in the browser when the site changes")
     args = parser.parse_args()
 
-    baseDir = os.path.dirname(args.config)
-
-    with codecs.open(args.config) as f:
-        config = json.loads(f.read())
-
-    config["base_dir"] = baseDir
-    config = models.Config(config)
+    config = load_config(args.config)
     context.config = config
 
     if args.mode == "build":
-        build()
+        build(args.full, args.jobs, args.trace, args.trace_top, args.profile)
     elif args.mode == "integrate":
-        watcher.watch(config.src_dir(), build_closure())
+        from compost import watcher
+        session = BuildSession(args.config, args.jobs)
+        watcher.watch(config.src_dir(), build_closure(session))
+    elif args.mode == "serve":
+        from compost import server
+        server.serve(BuildSession(args.config, args.jobs), args.host, args.port, not args.no_live_reload)
+    elif args.mode in ["deps", "rdeps"] and args.target is None:
+        print("{x} mode requires a target".format(x=args.mode))
+    elif args.mode == "deps":
+        show_deps(args.target)
+    elif args.mode == "rdeps":
+        show_rdeps(args.target)
     else:
         print("Unrecognised mode")
 
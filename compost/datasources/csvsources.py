@@ -1,107 +1,148 @@
-import codecs
+import os, csv
 from compost import models, utf8csv
+from compost.datasources.tabular import Table, RowView, RecordIndexView
+
+# identifies parse_csv's output in the data cache, which keeps it between builds: change the version whenever what
+# parse_csv produces changes
+PARSER_ID = "csv/1"
+
+# files larger than this are streamed by TableCSVDataSource.stream() rather than parsed and cached, unless the data
+# cache's stream_size says otherwise
+STREAM_SIZE = 16777216
+
+
+def parse_csv(path):
+    """Parse a CSV file into a compact, immutable Table"""
+    with utf8csv.open_csv(path) as f:
+        return Table.from_rows(csv.reader(f))
+
 
 class TableCSVDataSource(models.TableDataSource):
     def __init__(self, info, config):
         super(TableCSVDataSource, self).__init__(info, config)
-        if "shapes" not in self._info:
-            self._info["shapes"] = {}
-        self._info["shapes"]["table"] = {}
+        self._table = None
+        self._position = 0
 
     def __iter__(self):
-        self._load_raw()
-        local_data = self._info["shapes"]["table"]
-        if "idx" not in local_data:
-            local_data["idx"] = 0
-        return self
+        # every iteration gets its own cursor, starting from wherever next() has read up to (so that the
+        # headers can be read with next() and the rest of the rows iterated over)
+        return models.Cursor(self._load_raw(), self._position)
 
     def __next__(self):
         return self.next()
 
     def reset(self):
-        local_data = self._info["shapes"]["table"]
-        local_data["idx"] = 0
+        self._position = 0
 
     def next(self):
-        self._load_raw()
-        local_data = self._info["shapes"]["table"]
-        if "idx" not in local_data:
-            local_data["idx"] = 0
-        idx = local_data["idx"]
-        if len(local_data["data"]) > idx:
-            record = local_data["data"][idx]
-            local_data["idx"] = idx + 1
+        rows = self._load_raw()
+        if self._position < len(rows):
+            record = rows[self._position]
+            self._position += 1
             return record
-        else:
-            local_data["idx"] = 0
-            raise StopIteration()
+        raise StopIteration()
+
+    def stream(self, force=False):
+        """
+        Iterate over all the rows, the headers first, in a single pass.  The rows come from the parsed file, as for
+        any other use of the source, unless the file is larger than the data cache's stream_size, or force is True:
+        then, if the file has not already been parsed, they are read straight from it and not kept, so that a large
+        file is never held in memory as a whole
+        """
+        path = self._info.get("path")
+        if self._table is None:
+            if not force and os.path.getsize(path) <= self._config.data_cache().get("stream_size", STREAM_SIZE):
+                self._load_table()
+            else:
+                cache = self._info.get("cache")
+                self._table = cache.peek(path, PARSER_ID) if cache is not None else None
+        if self._table is not None:
+            return iter(self._table.rows)
+        return utf8csv.stream_rows(path)
+
+    def headers(self):
+        return self._load_table().headers
+
+    def column(self, name):
+        """The index of the named column, or None if there is no such column"""
+        return self._load_table().column(name)
+
+    def index(self, field, unique=False):
+        """Hash index of the rows (after the headers) by the column given by name or by position"""
+        table = self._load_table()
+        column = field if isinstance(field, int) else table.column(field)
+        if column is None:
+            return {}
+        return table.index(column, unique)
+
+    def _load_table(self):
+        if self._table is None:
+            self._table = self._parsed(PARSER_ID, parse_csv)
+        return self._table
 
     def _load_raw(self):
-        local_data = self._info["shapes"]["table"]
-        if "data" in local_data:
-            return
-
-        with open(self._info.get("path"), "r", encoding="utf-8") as f:
-            reader = utf8csv.UnicodeReader(f)
-            local_data["data"] = []
-            for row in reader:
-                local_data["data"].append(row)
-        return
+        return self._load_table().rows
 
 
 class DictCSVDataSource(models.DictDataSource):
     def __init__(self, info, config):
         super(DictCSVDataSource, self).__init__(info, config)
-        if "shapes" not in self._info:
-            self._info["shapes"] = {}
-        self._info["shapes"]["dict"] = {}
+        self._records = None
+        self._position = 0
 
     def __iter__(self):
-        self._prep_iterator()
-        return self
+        return models.Cursor(self._prep_iterator(), self._position)
 
     def __next__(self):
         return self.next()
 
     def reset(self):
-        local_data = self._info["shapes"]["dict"]
-        local_data["idx"] = 0
+        self._position = 0
+
+    def index(self, field, unique=False):
+        """Hash index of all the records (regardless of any filter or sort) by the named field"""
+        table = self._parsed(PARSER_ID, parse_csv)
+        column = table.column(field)
+        if column is None:
+            return {}
+        return RecordIndexView(table, table.index(column, unique), unique)
+
+    def filter(self, filter_settings):
+        super(DictCSVDataSource, self).filter(filter_settings)
+        self._records = None
+        return self
 
-    def next(self):
-        self._prep_iterator()
-        local_data = self._info["shapes"]["dict"]
-
-        def get_next_record():
-            idx = local_data["idx"]
-            local_data["idx"] = idx + 1
-            if len(local_data["data"]) > idx:
-                record = local_data["data"][idx]
-                if not self.include_record(record):
-                    return False
-                return record
-            else:
-                raise StopIteration()
+    def sort(self, sort_settings):
+        super(DictCSVDataSource, self).sort(sort_settings)
+        self._records = None
+        return self
 
-        while True:
-            rec = get_next_record()
-            if rec != False:
-                return rec
+    def next(self):
+        records = self._prep_iterator()
+        if self._position < len(records):
+            record = records[self._position]
+            self._position += 1
+            return record
+        raise StopIteration()
 
     def _prep_iterator(self):
-        local_data = self._info["shapes"]["dict"]
-        if "data" in local_data:
-            return
-
-        local_data["idx"] = 0
-        with codecs.open(self._info.get("path"), "rb", "utf-8") as f:
-            reader = utf8csv.UnicodeReader(f)
-            headers = reader.next()
-            local_data["data"] = []
-            for row in reader:
-                obj = {}
-                for i in range(len(headers)):
-                    obj[headers[i]] = row[i]
-                local_data["data"].append(obj)
-
-        if self._sort is not None:
-            local_data["data"].sort(key=self._sort_fn_dir[0], reverse=self._sort_fn_dir[1])
\ No newline at end of file
+        if self._records is None:
+            # the filter and sort are applied once, not on every iteration
+            self._records = self._select()
+        return self._records
+
+    def _query_target(self):
+        return self._parsed(PARSER_ID, parse_csv)
+
+    def _query_records(self, target):
+        # the records are views over the shared table, rather than a dict per row
+        return target.records()
+
+    def _query_lookup(self, target):
+        def lookup(field, value):
+            column = target.column(field)
+            if column is None:
+                return None
+            rows = target.index(column).get(value, ())
+            return [RowView(target.columns, row) for row in rows]
+        return lookup
@@ -1,45 +1,240 @@
 from compost import models
-import json
+from compost.context import context
+import re, json
+
+# identifies parse_json's output in the data cache, which keeps it between builds: change the version whenever what
+# parse_json produces changes
+PARSER_ID = "json/1"
+
+
+# files are read this much at a time by the streaming source
+STREAM_CHUNK_SIZE = 65536
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+# suffixes of files which are always read as JSON lines by the streaming source
+LINES_SUFFIXES = ["jsonl"]
+# characters which may carry a number on, after a part of it which is a number in its own right (e.g. "1." or "1e")
+NUMBER_TAIL = re.compile(r"[0-9.eE+\-]*")
+
+# memoised selections from, and serialisations of, parsed documents, for this many documents at most
+MAX_MEMO_DOCUMENTS = 64
+_memo = {}
+
+
+def parse_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.loads(f.read())
+
+
+def load_document(path):
+    """
+    The parsed JSON file at the path, from the build's data cache, which the JSON data sources share, so that the
+    file is parsed once however it is used.  The document must not be modified
+    """
+    cache = context.data.cache if context.data is not None else None
+    if cache is None:
+        return parse_json(path)
+    return cache.load(path, PARSER_ID, parse_json)
+
+
+def memoised(document, key, fn):
+    """
+    fn(), which must depend only on the document, computed once per key for as long as the document is unchanged
+    (i.e. until its file changes and it is parsed again)
+    """
+    entry = _memo.get(id(document))
+    if entry is None or entry[0] is not document:
+        if len(_memo) >= MAX_MEMO_DOCUMENTS:
+            _memo.clear()
+        # the document is held on to, so that its id cannot be reused by another while it is in the memo
+        entry = (document, {})
+        _memo[id(document)] = entry
+    results = entry[1]
+    if key not in results:
+        results[key] = fn()
+    return results[key]
+
+
+def select(document, path):
+    """
+    The part of the document at the path, which is either a JSON Pointer (e.g. "/paths/~1pets/get") or dotted
+    (e.g. "info.title"), in which list items are given by their position.  Raises KeyError if there is no such part
+    """
+    return memoised(document, ("select", path), lambda: _resolve(document, path))
+
+
+def stream_records(path, chunk_size=STREAM_CHUNK_SIZE, lines=False):
+    """
+    Yield the records in a JSON file one at a time: if lines is True, each of the values in the file, one after
+    another, as in JSON lines; otherwise the items of a top level array, or the values one after another if the file
+    is not an array.  Only a chunk of the file and the record being decoded are held in memory at once.  Raises
+    ValueError if the file is not valid
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        buf = ""
+        pos = 0
+        eof = False
+        in_array = False if lines else None
+        # in an array, what may come next: "first" (an item, or the end), "item", "separator" (, or the end), or
+        # "end", once the array has been closed
+        expect = None
+
+        while True:
+            # skip to the next value (or, in an array, the next separator), reading more if we run out
+            pos = WHITESPACE.match(buf, pos).end()
+            if pos == len(buf):
+                if not eof:
+                    buf, pos, eof = _read_more(f, buf, pos, chunk_size)
+                    continue
+                if in_array and expect != "end":
+                    raise ValueError("{x}: the array is not closed".format(x=path))
+                break
+
+            if in_array is None:
+                in_array = buf[pos] == "["
+                if in_array:
+                    pos += 1
+                    expect = "first"
+                    continue
+            elif in_array:
+                c = buf[pos]
+                if expect == "end":
+                    raise ValueError("{x}: unexpected {y} after the end of the array".format(x=path, y=c))
+                if c == "]" and expect in ["first", "separator"]:
+                    pos += 1
+                    expect = "end"
+                    continue
+                if expect == "separator":
+                    if c != ",":
+                        raise ValueError("{x}: expected , or ] but found {y}".format(x=path, y=c))
+                    pos += 1
+                    expect = "item"
+                    continue
+                if c in ",]":
+                    raise ValueError("{x}: expected an item but found {y}".format(x=path, y=c))
+
+            try:
+                record, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                buf, pos, eof = _read_more(f, buf, pos, chunk_size)
+                continue
+            if not eof and NUMBER_TAIL.match(buf, end).end() == len(buf):
+                # a number (or literal) at the end of the buffer may carry on in the next chunk, even if what
+                # follows it so far does not (e.g. 1.5 from 1.5e, when the next chunk starts 10)
+                buf, pos, eof = _read_more(f, buf, pos, chunk_size)
+                continue
+            pos = end
+            if in_array:
+                expect = "separator"
+            yield record
+
+
+def _read_more(f, buf, pos, chunk_size):
+    """Drop what has been decoded from the buffer, and add the next chunk of the file to it"""
+    buf = buf[pos:]
+    # a value larger than a chunk is read in ever larger pieces, so that it is not decoded again too many times
+    more = f.read(max(chunk_size, len(buf)))
+    return buf + more, 0, more == ""
+
+
+def _resolve(document, path):
+    if path == "":
+        return document
+    if path.startswith("/"):
+        tokens = [t.replace("~1", "/").replace("~0", "~") for t in path[1:].split("/")]
+    else:
+        tokens = path.split(".")
+
+    node = document
+    for token in tokens:
+        if isinstance(node, list):
+            try:
+                node = node[int(token)]
+            except (ValueError, IndexError):
+                raise KeyError(path)
+        elif isinstance(node, dict):
+            if token not in node:
+                raise KeyError(path)
+            node = node[token]
+        else:
+            raise KeyError(path)
+    return node
+
 
 class DictJSONDataSource(models.DictDataSource):
     def __init__(self, info, config):
         super(DictJSONDataSource, self).__init__(info, config)
-        if "shapes" not in self._info:
-            self._info["shapes"] = {}
-        self._info["shapes"]["dict"] = {}
+        self._data = None
 
     def __iter__(self):
-        local_data = self._info["shapes"]["dict"]
-        if "data" in local_data:
-            return self
+        data = self._load_raw()
+        if isinstance(data, list):
+            return models.Cursor(self._select(), 0)
+        return iter(data)
 
-        self._load_raw()
+    def _query_target(self):
+        return self._load_raw()
 
-        return self
+    def _query_records(self, target):
+        # a document which is not a list of records has no records to query
+        return target if isinstance(target, list) else []
 
-    def __next__(self):
-        return self.next()
+    def index(self, field, unique=False):
+        """
+        Hash index of all the records (regardless of any filter or sort) by the named field, kept with the parsed
+        document, so that it is built once however many times the source is looked up
+        """
+        document = self._load_raw()
+        return memoised(document, ("index", field, unique),
+                        lambda: models.build_index(self._query_records(document), field, unique))
+
+    def select(self, path):
+        """The part of the document at the path (a JSON Pointer or dotted path), which must not be modified"""
+        return select(self._load_raw(), path)
+
+    def _document(self):
+        return self._load_raw()
 
-    def get(self, key, default=None):
-        self._load_raw()
-        return super(DictJSONDataSource, self).get(key, default)
+    def _load_raw(self):
+        if self._data is None:
+            self._data = self._parsed(PARSER_ID, parse_json)
+        return self._data
 
-    def items(self):
-        self._load_raw()
-        return super(DictJSONDataSource, self).items()
 
-    def __getitem__(self, item):
-        self._load_raw()
-        return super(DictJSONDataSource, self).items()
+class StreamJSONDataSource(models.DictDataSource):
+    """
+    Records read incrementally from a JSON file which is one large array, or from JSON lines, for files too large to
+    parse into memory all at once.  Nothing is kept: every iteration reads the file again, so this is best used
+    once or twice per build.  The filter is applied as the records are read; a sort needs all the matching records,
+    so it is done in memory
+    """
+    def __init__(self, info, config):
+        super(StreamJSONDataSource, self).__init__(info, config)
+        self._iterator = None
+
+    def __iter__(self):
+        if self._sort is not None:
+            return iter(self._select())
+        if self._filter is not None:
+            return (r for r in self._stream() if self.include_record(r))
+        return self._stream()
+
+    def __next__(self):
+        return self.next()
+
+    def reset(self):
+        self._iterator = None
 
     def next(self):
-        pass
+        if self._iterator is None:
+            self._iterator = self.__iter__()
+        return next(self._iterator)
 
-    def _load_raw(self):
-        local_data = self._info["shapes"]["dict"]
-        if "data" in local_data:
-            return
+    def _query_records(self, target):
+        return self._stream()
 
-        with open(self._info.get("path"), "r", encoding="utf-8") as f:
-            raw = json.loads(f.read())
-            local_data["data"] = raw
\ No newline at end of file
+    def _stream(self):
+        # JSON lines may hold arrays as records, so a .jsonl file is never read as a single array
+        return stream_records(self._info.get("path"), lines=self._info.get("type") in LINES_SUFFIXES)
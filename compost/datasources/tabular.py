@@ -0,0 +1,153 @@
+import sys
+from collections.abc import Mapping, Sequence
+
+
+class Table(object):
+    """
+    Compact, immutable storage for tabular data.
+
+    Rows (including the header row, which is row 0) are held as tuples, and identical cell values are stored once
+    and shared between rows.  The headers are interned, and indexed by name, so that columns can be found in O(1).
+    Dict-shaped access to the rows is provided by lightweight views over the same storage, rather than by a dict
+    per row.
+    """
+    __slots__ = ["rows", "headers", "columns", "_indexes"]
+
+    def __init__(self, rows):
+        self.rows = rows
+        self._indexes = {}
+        self.headers = rows[0] if len(rows) > 0 else ()
+        # as with a dict built from a row, if a header is repeated the last column of that name wins
+        self.columns = {}
+        for i, h in enumerate(self.headers):
+            self.columns[h] = i
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a table from an iterable of rows (the first being the headers), de-duplicating cell values as we go"""
+        cells = {}
+        share = cells.setdefault
+        it = iter(rows)
+        stored = []
+        for headers in it:
+            stored.append(tuple([sys.intern(h) for h in headers]))
+            break
+        for row in it:
+            stored.append(tuple([share(c, c) for c in row]))
+        return cls(tuple(stored))
+
+    def __reduce__(self):
+        # only the rows are pickled (in which shared cell values stay shared); the rest is rebuilt from them
+        return (Table, (self.rows,))
+
+    def column(self, name):
+        return self.columns.get(name)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def index(self, column, unique=False):
+        """
+        Hash index of the data rows by the value in the given column (by position).  A unique index maps each value
+        to the first row which has it; otherwise each value maps to a tuple of all the rows which have it, in order.
+        Indexes are built once, and kept with the table.
+        """
+        key = (column, unique)
+        idx = self._indexes.get(key)
+        if idx is not None:
+            return idx
+
+        idx = {}
+        for row in self.rows[1:]:
+            if column >= len(row):
+                continue
+            if unique:
+                if row[column] not in idx:
+                    idx[row[column]] = row
+            else:
+                idx.setdefault(row[column], []).append(row)
+        if not unique:
+            for k in idx:
+                idx[k] = tuple(idx[k])
+
+        self._indexes[key] = idx
+        return idx
+
+    def records(self):
+        """The rows after the headers, as dict-like views"""
+        return RecordsView(self)
+
+
+class RecordsView(Sequence):
+    """Sequence of RowViews over the data rows of a table, created on access"""
+    __slots__ = ["_table"]
+
+    def __init__(self, table):
+        self._table = table
+
+    def __len__(self):
+        return max(len(self._table.rows) - 1, 0)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError(idx)
+        return RowView(self._table.columns, self._table.rows[idx + 1])
+
+
+class RowView(Mapping):
+    """Read-only, dict-like view of a single row, keyed by the table's headers"""
+    __slots__ = ["_columns", "_row"]
+
+    def __init__(self, columns, row):
+        self._columns = columns
+        self._row = row
+
+    def __getitem__(self, key):
+        idx = self._columns.get(key)
+        if idx is None or idx >= len(self._row):
+            raise KeyError(key)
+        return self._row[idx]
+
+    def __iter__(self):
+        for key, idx in self._columns.items():
+            if idx < len(self._row):
+                yield key
+
+    def __len__(self):
+        return len([1 for idx in self._columns.values() if idx < len(self._row)])
+
+    def __contains__(self, key):
+        idx = self._columns.get(key)
+        return idx is not None and idx < len(self._row)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class RecordIndexView(Mapping):
+    """Read-only view of one of a table's indexes, which gives RowViews rather than row tuples"""
+    __slots__ = ["_table", "_index", "_unique"]
+
+    def __init__(self, table, index, unique):
+        self._table = table
+        self._index = index
+        self._unique = unique
+
+    def __getitem__(self, key):
+        rows = self._index[key]
+        if self._unique:
+            return RowView(self._table.columns, rows)
+        return tuple([RowView(self._table.columns, row) for row in rows])
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
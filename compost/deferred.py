@@ -0,0 +1,38 @@
+import re
+from compost.context import context
+from compost import exceptions
+
+# placeholders are plain alphanumerics, so that they pass unchanged through further render passes and
+# through markdown conversion
+TOKEN_PREFIX = "COMPOSTDEFERRED"
+TOKEN_SUFFIX = "END"
+TOKEN_RX = re.compile(TOKEN_PREFIX + r"(\d+)" + TOKEN_SUFFIX)
+
+
+def defer(resolver):
+    """
+    Register a function which will produce part of the current page once the whole page has been rendered
+    (e.g. once every header() call has been made), and return the placeholder to put in the page in its place.
+    Raises RenderException if no page is being rendered, as there is nothing to resolve the placeholder
+    """
+    page = context.page
+    if page is None:
+        raise exceptions.RenderException("Deferred output can only be used while a page is being rendered")
+    page.deferred.append(resolver)
+    return TOKEN_PREFIX + str(len(page.deferred) - 1) + TOKEN_SUFFIX
+
+
+def resolve(text):
+    """Replace all the placeholders in the text with the output of their resolvers, in a single pass"""
+    page = context.page
+    if page is None or len(page.deferred) == 0:
+        return text
+
+    resolved = {}
+    def substitute(match):
+        idx = int(match.group(1))
+        if idx not in resolved:
+            resolved[idx] = page.deferred[idx]()
+        return resolved[idx]
+
+    return TOKEN_RX.sub(substitute, text)
@@ -0,0 +1,52 @@
+import os, json, codecs
+
+DEPS_FILE = "deps.json"
+
+
+class DependencyGraph(object):
+    """
+    Record of the input files (relative to the source directory) which each page (relative to content/pages)
+    used when it was last rendered
+    """
+    def __init__(self, raw=None):
+        if raw is None:
+            raw = {}
+        self._raw = raw
+        if "pages" not in self._raw:
+            self._raw["pages"] = {}
+
+    @classmethod
+    def load(cls, build_dir):
+        path = os.path.join(build_dir, DEPS_FILE)
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with codecs.open(path, "r", "utf-8") as f:
+                return cls(json.loads(f.read()))
+        except ValueError:
+            return cls()
+
+    def save(self, build_dir):
+        path = os.path.join(build_dir, DEPS_FILE)
+        with codecs.open(path, "w", "utf-8") as f:
+            f.write(json.dumps(self._raw, indent=2, sort_keys=True))
+
+    def pages(self):
+        return self._raw["pages"].keys()
+
+    def record(self, page, inputs):
+        self._raw["pages"][page] = sorted(set(inputs))
+
+    def forget(self, page):
+        if page in self._raw["pages"]:
+            del self._raw["pages"][page]
+
+    def deps(self, page):
+        return self._raw["pages"].get(page)
+
+    def rdeps(self, path):
+        return sorted([page for page, inputs in self._raw["pages"].items() if path in inputs])
+
+    def affected_pages(self, paths):
+        paths = set(paths)
+        return set([page for page, inputs in self._raw["pages"].items() if not paths.isdisjoint(inputs)])
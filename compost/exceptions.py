@@ -5,4 +5,10 @@ class ConfigurationException(Exception):
     pass
 
 class InconsistentStructureException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class RenderException(Exception):
+    pass
+
+class QueryException(Exception):
+    pass
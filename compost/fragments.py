@@ -0,0 +1,44 @@
+class FragmentWriter(object):
+    """
+    Builds up the text produced by a template function as a list of chunks.
+
+    Growing a string with repeated += copies everything written so far on each append, which is quadratic in the
+    size of the output; here each chunk is kept as it is, and they are joined once, when the text is needed.  Writers
+    are only used inside the template functions, which still return str.  Writing one writer into another adds its
+    chunks, rather than its text.
+
+    append() adds a single str as cheaply as possible, for use in loops; write() takes any number of strs or
+    writers, and checks them.
+    """
+    __slots__ = ["_chunks", "append"]
+
+    def __init__(self, *chunks):
+        self._chunks = []
+        # appending a single str is by far the most common case, so it goes straight to the list
+        self.append = self._chunks.append
+        self.write(*chunks)
+
+    def write(self, *chunks):
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                self._chunks.append(chunk)
+            elif isinstance(chunk, FragmentWriter):
+                self._chunks.extend(chunk._chunks)
+            else:
+                raise TypeError("can only write str or FragmentWriter, not {x}".format(x=type(chunk).__name__))
+        return self
+
+    def getvalue(self):
+        if len(self._chunks) > 1:
+            # keep the joined text, so that asking again costs nothing, and further writes still work
+            self._chunks[:] = ["".join(self._chunks)]
+        return self._chunks[0] if len(self._chunks) > 0 else ""
+
+    def __len__(self):
+        return sum([len(c) for c in self._chunks])
+
+    def __str__(self):
+        return self.getvalue()
+
+    def __repr__(self):
+        return "FragmentWriter({x} chunks, {y} characters)".format(x=len(self._chunks), y=len(self))
@@ -1,4 +1,21 @@
-from jinja2 import BaseLoader
+import os, re, hashlib, tempfile
+from collections import OrderedDict
+from jinja2 import BaseLoader, Environment, FileSystemBytecodeCache
+from compost.context import context
+
+
+class DependencyTrackingEnvironment(Environment):
+    """
+    Environment which reports every file template used during rendering to the context's dependency tracker.
+
+    This is done when the template is looked up rather than in the loader, so that templates served from the
+    environment's cache on the second and subsequent pages are recorded too.
+    """
+    def _load_template(self, name, globals):
+        template = super(DependencyTrackingEnvironment, self)._load_template(name, globals)
+        context.add_dependency(template.filename)
+        return template
+
 
 class MarkupWrapperLoader(BaseLoader):
     def __init__(self, inner, config):
@@ -17,4 +34,86 @@ class MarkupWrapperLoader(BaseLoader):
         return contents, filename, uptodate
 
     def list_templates(self):
-        return self.inner.list_templates()
\ No newline at end of file
+        return self.inner.list_templates()
+
+
+class AtomicFileSystemBytecodeCache(FileSystemBytecodeCache):
+    """
+    Bytecode cache which is safe to share between several worker processes, as each cache file is written in
+    full before it is moved into place.
+
+    Jinja keys bytecode only by the template's name and source, but what a template compiles to also depends on
+    the extensions the environment has, so they are part of the key here too
+    """
+    def __init__(self, directory, extensions=()):
+        super(AtomicFileSystemBytecodeCache, self).__init__(directory)
+        paths = sorted([e.__module__ + "." + e.__qualname__ for e in extensions])
+        self.environment_key = hashlib.sha1("\n".join(paths).encode("utf-8")).hexdigest()
+
+    def get_cache_key(self, name, filename=None):
+        key = super(AtomicFileSystemBytecodeCache, self).get_cache_key(name, filename)
+        return hashlib.sha1((self.environment_key + key).encode("utf-8")).hexdigest()
+
+    def dump_bytecode(self, bucket):
+        filename = self._get_cache_filename(bucket)
+        # the directory may have been cleaned away since the environment was made
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                bucket.write_bytecode(f)
+            os.replace(tmp, filename)
+        except:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+
+class CompiledTemplateCache(object):
+    """
+    LRU cache of templates compiled from strings, keyed by a hash of their source, so that text which is
+    re-rendered (e.g. the same fragment on many pages) is only lexed, parsed and compiled once
+    """
+    def __init__(self, environment, size=256):
+        self._environment = environment
+        self._size = size
+        self._templates = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def from_string(self, source):
+        key = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        template = self._templates.get(key)
+        if template is not None:
+            self._templates.move_to_end(key)
+            self.hits += 1
+            return template
+
+        self.misses += 1
+        template = self._environment.from_string(source)
+        self._templates[key] = template
+        if len(self._templates) > self._size:
+            self._templates.popitem(last=False)
+        return template
+
+
+def has_template_syntax(environment, text):
+    if environment.line_statement_prefix is not None or environment.line_comment_prefix is not None:
+        return True
+    for marker in [environment.block_start_string, environment.variable_start_string, environment.comment_start_string]:
+        if marker in text:
+            return True
+    return False
+
+
+def settle(environment, text):
+    """
+    Produce the text that repeatedly rendering text with no template syntax in it would settle on, without
+    compiling it: Jinja normalises the newlines, and removes one trailing newline on each pass
+    """
+    nl = environment.newline_sequence
+    text = re.sub(r"\r\n|\r|\n", nl, text)
+    if not environment.keep_trailing_newline:
+        while text.endswith(nl):
+            text = text[:-len(nl)]
+    return text
@@ -0,0 +1,113 @@
+import os, json, codecs, hashlib
+
+MANIFEST_FILE = "manifest.json"
+
+
+def fingerprint(path, previous=None):
+    """
+    Fingerprint a file by size, mtime and content hash.  If the size and mtime are unchanged from the
+    previous fingerprint, the previous content hash is trusted rather than re-reading the file.
+    """
+    st = os.stat(path)
+    if previous is not None and previous.get("mtime") == st.st_mtime_ns and previous.get("size") == st.st_size:
+        return previous
+
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return {
+        "mtime" : st.st_mtime_ns,
+        "size" : st.st_size,
+        "sha1" : h.hexdigest()
+    }
+
+
+class Manifest(object):
+    def __init__(self, raw=None):
+        if raw is None:
+            raw = {}
+        self._raw = raw
+        if "files" not in self._raw:
+            self._raw["files"] = {}
+        if "outputs" not in self._raw:
+            self._raw["outputs"] = {}
+
+    @classmethod
+    def load(cls, build_dir):
+        path = os.path.join(build_dir, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        try:
+            with codecs.open(path, "r", "utf-8") as f:
+                return cls(json.loads(f.read()))
+        except ValueError:
+            # a corrupt manifest is treated as no manifest, which forces a full build
+            return None
+
+    @classmethod
+    def scan(cls, config, previous=None):
+        """Fingerprint every file in the source directory, re-using unchanged fingerprints from the previous manifest"""
+        manifest = cls({"config" : config.fingerprint()})
+        src_dir = config.src_dir()
+        for dirpath, dirnames, filenames in os.walk(src_dir):
+            for fn in filenames:
+                path = os.path.join(dirpath, fn)
+                rel = os.path.relpath(path, src_dir)
+                prev = previous.fingerprint(rel) if previous is not None else None
+                manifest._raw["files"][rel] = fingerprint(path, prev)
+        return manifest
+
+    @classmethod
+    def update(cls, config, previous, paths):
+        """
+        Make a manifest from the previous one, re-fingerprinting only the given source files (relative to the source
+        directory), which may have been added, modified or removed since.  For when the caller already knows which
+        files have changed, so that the whole source directory need not be walked.
+        """
+        manifest = cls({"config" : config.fingerprint(), "files" : dict(previous._raw["files"])})
+        src_dir = config.src_dir()
+        for rel in paths:
+            path = os.path.join(src_dir, rel)
+            if os.path.isfile(path):
+                manifest._raw["files"][rel] = fingerprint(path, previous.fingerprint(rel))
+            else:
+                manifest._raw["files"].pop(rel, None)
+        return manifest
+
+    def save(self, build_dir):
+        path = os.path.join(build_dir, MANIFEST_FILE)
+        with codecs.open(path, "w", "utf-8") as f:
+            f.write(json.dumps(self._raw, indent=2, sort_keys=True))
+
+    @property
+    def config(self):
+        return self._raw.get("config")
+
+    def files(self):
+        return self._raw["files"].keys()
+
+    def fingerprint(self, rel):
+        return self._raw["files"].get(rel)
+
+    def changed_files(self, previous):
+        """List the source files which are new, modified or removed since the previous manifest"""
+        changed = set()
+        for rel, fp in self._raw["files"].items():
+            prev = previous.fingerprint(rel)
+            if prev is None or prev.get("sha1") != fp.get("sha1"):
+                changed.add(rel)
+        for rel in previous.files():
+            if rel not in self._raw["files"]:
+                changed.add(rel)
+        return changed
+
+    def add_output(self, source, target):
+        self._raw["outputs"][target] = source
+
+    def outputs(self):
+        return self._raw["outputs"]
+
+    def orphaned_outputs(self, previous):
+        """List the outputs of the previous build which are not produced by this one"""
+        return [t for t in previous.outputs().keys() if t not in self._raw["outputs"]]
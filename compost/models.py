@@ -1,16 +1,27 @@
-import os, json, codecs
-from compost import exceptions, plugin, functions, utils
+import os, json, copy, codecs, pickle, hashlib, tempfile
+from compost import exceptions, plugin, functions, utils, query
+from compost.context import context
 
 class Config(object):
     def __init__(self, local=None):
         baseconfig = utils.rel2abs(__file__, "baseconfig.json")
         with codecs.open(baseconfig, "r", "utf-8") as f:
             base = json.loads(f.read())
+        # plugins from installed packages are configured as if they were in the base config, so the local
+        # config can still override them (but they may not override the built in ones, or each other)
+        for name, cfg in plugin.discover():
+            plugin.check_discovered(name, cfg, base)
+            base = utils.merge_dicts(base, copy.deepcopy(cfg))
         if local is not None:
             raw = utils.merge_dicts(base, local)
             self._raw = raw
         else:
             self._raw = base
+        self._registry = plugin.PluginRegistry(self._raw)
+
+    def fingerprint(self):
+        serialised = json.dumps(self._raw, sort_keys=True)
+        return hashlib.sha1(serialised.encode("utf-8")).hexdigest()
 
     def build_dir(self):
         return os.path.join(self._raw.get("base_dir"), self._raw.get("build_dir"))
@@ -24,6 +35,18 @@ class Config(object):
     def base_url(self):
         return self._raw.get("base_url")
 
+    def max_render_passes(self):
+        return self._raw.get("max_render_passes", 10)
+
+    def prune_unused_utils(self):
+        return self._raw.get("prune_unused_utils", False)
+
+    def data_cache(self):
+        return self._raw.get("data_cache", {})
+
+    def markdown_cache(self):
+        return self._raw.get("markdown_cache", {})
+
     @property
     def exports(self):
         return self._raw.get("exports", [])
@@ -34,11 +57,15 @@ class Config(object):
                 return row.get("target")
         return None
 
+    @property
+    def registry(self):
+        return self._registry
+
     def _data_plugin_by_suffix(self, suffix):
-        for k, v in self._raw.get("plugins", {}).get("data", {}).items():
-            if suffix in v.get("file_suffixes"):
-                return v
-        return None
+        typecfg = self._registry.data_plugin(suffix)
+        if typecfg is None:
+            raise exceptions.ConfigurationException("No data plugin for files of type '{x}'".format(x=suffix))
+        return typecfg
 
     def default_data_plugin(self, type):
         typecfg = self._data_plugin_by_suffix(type)
@@ -46,42 +73,38 @@ class Config(object):
         if default is None:
             raise exceptions.ConfigurationException("No default provided for '{x}'".format(x=type))
         classpath = typecfg.get("shapes", {}).get(default)
-        return plugin.load_class(classpath)
+        return self._registry.load_class(classpath)
 
     def data_plugin(self, type, shape):
         typecfg = self._data_plugin_by_suffix(type)
         classpath = typecfg.get("shapes", {}).get(shape)
         if classpath is None:
             raise exceptions.ConfigurationException("No shape '{x}' for type '{y}'".format(x=shape, y=type))
-        return plugin.load_class(classpath)
+        return self._registry.load_class(classpath)
 
     def renderer_for_file_suffix(self, suffix):
-        for k, v in self._raw.get("plugins", {}).get("renderer", {}).items():
-            if suffix in v.get("file_suffixes", []):
-                classpath = v.get("class")
-                klazz = plugin.load_class(classpath)
-                return klazz(k)
-        return None
+        entry = self._registry.renderer_for_suffix(suffix)
+        if entry is None:
+            return None
+        k, v = entry
+        klazz = self._registry.load_class(v.get("class"))
+        return klazz(k)
 
     def renderer_for_inline_tag(self, inline_tag):
-        for k, v in self._raw.get("plugins", {}).get("renderer", {}).items():
-            if inline_tag == v.get("inline_tag"):
-                classpath = v.get("class")
-                klazz = plugin.load_class(classpath)
-                return klazz(k)
-        return None
+        entry = self._registry.renderer_for_inline_tag(inline_tag)
+        if entry is None:
+            return None
+        k, v = entry
+        klazz = self._registry.load_class(v.get("class"))
+        return klazz(k)
 
     def settings_for_file_suffix(self, suffix):
-        for k, v in self._raw.get("plugins", {}).get("renderer", {}).items():
-            if suffix in v.get("file_suffixes", []):
-                return v
-        return None
+        entry = self._registry.renderer_for_suffix(suffix)
+        return entry[1] if entry is not None else None
 
     def settings_for_tag(self, tag):
-        for k, v in self._raw.get("plugins", {}).get("renderer", {}).items():
-            if tag == v.get("jinja2_tag"):
-                return v
-        return None
+        entry = self._registry.renderer_for_tag(tag)
+        return entry[1] if entry is not None else None
 
     def renderer_settings(self, cfg_id):
         return self._raw.get("plugins", {}).get("renderer", {}).get(cfg_id, {}).get("settings", {})
@@ -96,10 +119,126 @@ class Config(object):
         return self._raw.get("utils", {})
 
 
+class DataCache(object):
+    """
+    Parsed data files, shared by every data source (and every shape of it) for the duration of a build.  Each
+    file is parsed once, and parsed again only if its mtime or size change.
+
+    What is parsed is also pickled to the build directory, keyed by the file's content and the parser (whose id
+    should change whenever its output does), so that later builds, and worker processes, load it from there
+    rather than parsing the file again.
+    """
+    def __init__(self):
+        self._entries = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def load(self, path, parser_id, parser):
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        # the same file may be asked for by different paths (e.g. by a data source and by json_extract)
+        key = (os.path.abspath(path), parser_id)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            self.hits += 1
+            return entry[1]
+
+        cache_file = None
+        directory = self.directory()
+        if directory is not None:
+            name = hashlib.sha1((key[0] + "\0" + parser_id).encode("utf-8")).hexdigest()
+            cache_file = os.path.join(directory, name[:2], name)
+            content_key = self._content_key(path, parser_id)
+            parsed = self._read(cache_file, content_key)
+            if parsed is not None:
+                self.disk_hits += 1
+                self._entries[key] = (stamp, parsed)
+                return parsed
+
+        self.misses += 1
+        parsed = parser(path)
+        self._entries[key] = (stamp, parsed)
+        if cache_file is not None:
+            self._write(cache_file, content_key, parsed)
+        return parsed
+
+    def directory(self):
+        if context.config is None or not context.config.data_cache().get("disk", True):
+            return None
+        return os.path.join(context.config.build_dir(), "cache", "data")
+
+    def peek(self, path, parser_id):
+        """What has already been parsed from the file, if it is up to date, or None.  Nothing is parsed"""
+        entry = self._entries.get((os.path.abspath(path), parser_id))
+        if entry is None:
+            return None
+        st = os.stat(path)
+        if entry[0] != (st.st_mtime_ns, st.st_size):
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def forget(self, path):
+        """Drop everything parsed from the given file, e.g. because it has been removed"""
+        path = os.path.abspath(path)
+        for key in [k for k in self._entries if k[0] == path]:
+            del self._entries[key]
+
+    def stats(self):
+        return {
+            "hits" : self.hits,
+            "disk_hits" : self.disk_hits,
+            "misses" : self.misses
+        }
+
+    def _content_key(self, path, parser_id):
+        h = hashlib.sha1()
+        h.update(parser_id.encode("utf-8"))
+        h.update(b"\0")
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1048576), b""):
+                h.update(chunk)
+        return h.hexdigest().encode("ascii")
+
+    def _read(self, cache_file, content_key):
+        # each file holds the latest parse of one data file, headed by the key of the content it was parsed from
+        try:
+            with open(cache_file, "rb") as f:
+                if f.readline().rstrip(b"\n") != content_key:
+                    return None
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # a damaged or out of date cache file is just a miss
+            return None
+
+    def _write(self, cache_file, content_key, parsed):
+        # the cache is only an optimisation, so failing to write to it is not an error
+        directory = os.path.dirname(cache_file)
+        tmp = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, "wb") as f:
+                f.write(content_key + b"\n")
+                pickle.dump(parsed, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, cache_file)
+        except (OSError, pickle.PicklingError):
+            if tmp is not None and os.path.exists(tmp):
+                os.unlink(tmp)
+
+
 class Data(object):
-    def __init__(self, config):
+    def __init__(self, config, cache=None):
         self._config = config
         self._data_sources = {}
+        self._cache = cache if cache is not None else DataCache()
+
+    @property
+    def cache(self):
+        return self._cache
 
     def add_ref(self, data_path):
         dd = os.path.join(self._config.src_dir(), "data")
@@ -111,7 +250,8 @@ class Data(object):
 
         self._data_sources[data_name] = {
             "type" : type,
-            "path": data_path
+            "path": data_path,
+            "cache" : self._cache
         }
 
     def get(self, data_name):
@@ -119,6 +259,7 @@ class Data(object):
         if info is None:
             raise exceptions.NoSuchDataSourceException("{x} is not a known data source".format(x=data_name))
 
+        context.add_dependency(info.get("path"))
         type = info.get("type")
         klazz = self._config.default_data_plugin(type)
         return klazz(info, self._config)
@@ -137,6 +278,13 @@ class DataSource(object):
     def __next__(self):
         pass
 
+    def _parsed(self, parser_id, parser):
+        """Get the parsed contents of this source's file, from the build's data cache if there is one"""
+        cache = self._info.get("cache")
+        if cache is None:
+            return parser(self._info.get("path"))
+        return cache.load(self._info.get("path"), parser_id, parser)
+
     def shape(self, form):
         klazz = self._config.data_plugin(self._info.get("type"), form)
         if isinstance(self, klazz):
@@ -154,6 +302,41 @@ class DataSource(object):
         self._sort = sort_settings
         return self
 
+    def index(self, field, unique=False):
+        """
+        Hash index of the source's records by the value of the given field.  A unique index maps each value to the
+        first record which has it; otherwise each value maps to a tuple of all the records which have it.
+
+        This implementation builds the index by iterating over the source, and keeps it for the life of this object;
+        data sources which can do better (e.g. keep the index with their parsed data for the whole build) should
+        override it.
+        """
+        if not hasattr(self, "_indexes"):
+            self._indexes = {}
+        key = (field, unique)
+        if key not in self._indexes:
+            self._indexes[key] = build_index(self, field, unique)
+        return self._indexes[key]
+
+
+def build_index(records, field, unique=False):
+    """Hash index of the records by the value of the given field, as described for DataSource.index"""
+    idx = {}
+    for record in records:
+        try:
+            value = record[field]
+        except (KeyError, IndexError, TypeError):
+            continue
+        if unique:
+            if value not in idx:
+                idx[value] = record
+        else:
+            idx.setdefault(value, []).append(record)
+    if not unique:
+        for k in idx:
+            idx[k] = tuple(idx[k])
+    return idx
+
 
 class TableDataSource(DataSource):
     pass
@@ -189,14 +372,91 @@ class DictDataSource(DataSource):
             return self._filter_fn(record)
         return True
 
+    def query(self, where=None, order_by=None, offset=0, limit=None, fields=None):
+        """
+        The records which match where, sorted by order_by, from offset, at most limit of them, optionally with only
+        the given fields, as a tuple.  See query.Plan for the forms these take.  The source's own filter and sort
+        are not applied.
+
+        Results are kept for as long as the source's parsed data is unchanged, and shared by every data source
+        object (and shape) over the same file, so asking the same question twice in a build costs nothing.
+        """
+        plan = query.plan(where, order_by, offset, limit, fields)
+        target = self._query_target()
+        memo = self._info.setdefault("queries", {})
+        entry = memo.get(plan.key)
+        if entry is not None and entry[0] is target:
+            return entry[1]
+        result = plan.execute(self._query_records(target), self._query_lookup(target))
+        memo[plan.key] = (target, result)
+        return result
+
+    def _select(self):
+        """The records after the source's own filter and sort"""
+        if not callable(self._filter) and not callable(self._sort):
+            order_by = self._sort
+            if isinstance(order_by, dict) and len(order_by) > 1:
+                # a source's own sort has only ever been by its first field
+                first = [*order_by][0]
+                order_by = {first : order_by[first]}
+            return self.query(where=self._filter, order_by=order_by)
+        records = [r for r in self._query_records(self._query_target()) if self.include_record(r)]
+        if self._sort is not None:
+            records.sort(key=self._sort_fn_dir[0], reverse=self._sort_fn_dir[1])
+        return records
+
+    def _query_target(self):
+        """The parsed data which queries run over, which is the same object for as long as it is unchanged"""
+        return None
+
+    def _query_records(self, target):
+        """All the records in the target, in order"""
+        return []
+
+    def _query_lookup(self, target):
+        """A function to find the records with a given value in a field from an index, if the source has one"""
+        return None
+
+    def _document(self):
+        """The whole of the source as a single dict, for sources which support keyed access"""
+        return {}
+
     def get(self, key, default=None):
-        return self._info.get("shapes", {}).get("dict", {}).get("data", {}).get(key, default)
+        return self._document().get(key, default)
 
     def items(self):
-        return self._info.get("data", {}).items()
+        return self._document().items()
 
     def __getitem__(self, item):
-        return self._info.get("data", {})[item]
+        return self._document()[item]
+
+
+class Cursor(object):
+    """
+    Iterator with its own position over an immutable sequence of records.  Any number of cursors can be open over
+    the same records at once (e.g. in nested loops) without affecting one another, and without copying the records.
+    """
+    __slots__ = ["_records", "_idx", "_include"]
+
+    def __init__(self, records, start=0, include=None):
+        self._records = records
+        self._idx = start
+        self._include = include
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        records = self._records
+        while self._idx < len(records):
+            record = records[self._idx]
+            self._idx += 1
+            if self._include is None or self._include(record):
+                return record
+        raise StopIteration()
+
+    def next(self):
+        return self.__next__()
 
 
 class Renderer(object):
@@ -21,8 +21,8 @@ def load_class_raw(classpath):
     return klazz
 
 def load_class(classpath, cache_class_ref=True):
-    global COMPOST_PLUGIN_FUNCTION_REFS
-    klazz = COMPOST_PLUGIN_CLASS_REFS.get("PLUGIN_CLASS_REFS", {}).get(classpath)
+    global COMPOST_PLUGIN_CLASS_REFS
+    klazz = COMPOST_PLUGIN_CLASS_REFS.get(classpath)
     if klazz is not None:
         return klazz
 
@@ -62,3 +62,180 @@ def load_function(fnpath, cache_fn_ref=True):
         COMPOST_PLUGIN_FUNCTION_REFS[fnpath] = fn
 
     return fn
+
+
+# attributes by which Jinja recognises functions which want to be passed the context, eval context or environment
+# (contextfunction and friends in Jinja 2, pass_context and friends in Jinja 3)
+JINJA_MARKERS = ["contextfunction", "evalcontextfunction", "environmentfunction", "jinja_pass_arg"]
+
+
+def copy_jinja_markers(fn, wrapper):
+    """
+    Give a wrapper the same Jinja markers as the function it wraps.  functools.wraps can't do this for a
+    LazyFunction, whose attributes are only found by importing the function, which this therefore does
+    """
+    for marker in JINJA_MARKERS:
+        value = getattr(fn, marker, None)
+        if value is not None:
+            setattr(wrapper, marker, value)
+    return wrapper
+
+
+class LazyFunction(object):
+    """
+    Stands in for a function named by its dotted path, and only imports it when it is first called, so that the
+    modules of functions which a build never uses are never imported.
+    """
+    __slots__ = ["functionpath", "_fn"]
+
+    def __init__(self, functionpath):
+        self.functionpath = functionpath
+        self._fn = None
+
+    def resolve(self):
+        if self._fn is None:
+            self._fn = load_function(self.functionpath)
+        return self._fn
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        # what Jinja looks for on a function it calls (e.g. contextfunction) comes from the real function, but
+        # private and special names do not, so that wrapping or copying the proxy does not import it
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
+
+    def __repr__(self):
+        return "LazyFunction({x})".format(x=self.functionpath)
+
+
+ENTRY_POINT_GROUP = "compost.plugins"
+_discovered = None
+
+def discover():
+    """
+    Configuration contributed by installed packages, through the "compost.plugins" entry point group.  Each entry
+    point refers to a dict (or a function which returns one) in the same form as the config file, e.g.
+
+        {"plugins" : {"data" : {"yaml" : {...}}}, "utils" : {"my_util" : {"function" : "mypackage.my_util"}}}
+
+    Returns (entry point name, config) for each, in order of name.  Entry points are only looked for once per process.
+    """
+    global _discovered
+    if _discovered is not None:
+        return _discovered
+
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        _discovered = []
+        return _discovered
+
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        eps = eps.select(group=ENTRY_POINT_GROUP)
+    else:
+        eps = eps.get(ENTRY_POINT_GROUP, [])
+
+    found = []
+    for ep in sorted(eps, key=lambda e: e.name):
+        try:
+            cfg = ep.load()
+        except Exception as e:
+            raise PluginException("Could not load plugin {x} ({y}): {z}".format(x=ep.name, y=ep.value, z=e))
+        if callable(cfg):
+            cfg = cfg()
+        if not isinstance(cfg, dict):
+            raise PluginException("Plugin {x} ({y}) did not provide a dict of configuration".format(x=ep.name, y=ep.value))
+        found.append((ep.name, cfg))
+
+    _discovered = found
+    return _discovered
+
+
+def check_discovered(name, cfg, existing):
+    """
+    Raise PluginException if the configuration from the named entry point would replace a plugin or util which is
+    already configured (built in, or from another package), or claim a file suffix or template tag which one already
+    has, rather than let it do so silently.  Only the local config may override what is already there
+    """
+    clashes = []
+    plugins = existing.get("plugins", {})
+    for kind, theirs in cfg.get("plugins", {}).items():
+        mine = plugins.get(kind, {})
+        claimed = {}
+        for k, v in mine.items():
+            for suffix in v.get("file_suffixes", []):
+                claimed.setdefault("file suffix " + suffix, k)
+            for tag in ["jinja2_tag", "inline_tag"]:
+                if v.get(tag) is not None:
+                    claimed.setdefault("tag " + v.get(tag), k)
+
+        for k, v in theirs.items():
+            if k in mine:
+                clashes.append("{x} plugin {y}".format(x=kind, y=k))
+                continue
+            wanted = ["file suffix " + suffix for suffix in v.get("file_suffixes", [])]
+            wanted += ["tag " + v.get(tag) for tag in ["jinja2_tag", "inline_tag"] if v.get(tag) is not None]
+            for w in wanted:
+                if w in claimed:
+                    clashes.append("{x} (of {y} plugin {z})".format(x=w, y=kind, z=claimed[w]))
+
+    for k in cfg.get("utils", {}):
+        if k in existing.get("utils", {}):
+            clashes.append("util " + k)
+
+    if len(clashes) > 0:
+        raise PluginException("Plugin {x} would replace what is already configured: {y}".format(
+            x=name, y=", ".join(clashes)))
+
+
+class PluginRegistry(object):
+    """
+    Lookups from file suffixes and template tags to the plugins configured for them, built once from the config,
+    rather than by searching the config on every call.  Classes are resolved when they are first asked for (a
+    configured class which is never used need not exist), and kept.
+    """
+    def __init__(self, raw):
+        plugins = raw.get("plugins", {})
+
+        # where more than one plugin claims a suffix or a tag, the first one in the config wins
+        self._data_by_suffix = {}
+        for k, v in plugins.get("data", {}).items():
+            for suffix in v.get("file_suffixes", []):
+                self._data_by_suffix.setdefault(suffix, v)
+
+        self._renderer_by_suffix = {}
+        self._renderer_by_tag = {}
+        self._renderer_by_inline_tag = {}
+        for k, v in plugins.get("renderer", {}).items():
+            for suffix in v.get("file_suffixes", []):
+                self._renderer_by_suffix.setdefault(suffix, (k, v))
+            if v.get("jinja2_tag") is not None:
+                self._renderer_by_tag.setdefault(v.get("jinja2_tag"), (k, v))
+            if v.get("inline_tag") is not None:
+                self._renderer_by_inline_tag.setdefault(v.get("inline_tag"), (k, v))
+
+        self._classes = {}
+
+    def data_plugin(self, suffix):
+        return self._data_by_suffix.get(suffix)
+
+    def renderer_for_suffix(self, suffix):
+        """(renderer id, renderer config) for files with the suffix, or None"""
+        return self._renderer_by_suffix.get(suffix)
+
+    def renderer_for_tag(self, tag):
+        return self._renderer_by_tag.get(tag)
+
+    def renderer_for_inline_tag(self, tag):
+        return self._renderer_by_inline_tag.get(tag)
+
+    def load_class(self, classpath):
+        klazz = self._classes.get(classpath)
+        if klazz is None:
+            klazz = load_class(classpath)
+            self._classes[classpath] = klazz
+        return klazz
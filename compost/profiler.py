@@ -0,0 +1,165 @@
+import time, json, codecs, functools
+from compost.context import context
+from compost import plugin
+
+# the active profiler, if the build is being profiled.  When it is None the wrappers just call through.
+_profiler = None
+
+# beyond this many distinct argument signatures for one function, further ones are counted together
+MAX_SIGNATURES = 500
+SIGNATURE_LENGTH = 200
+OTHER_SIGNATURES = "(other)"
+
+
+class Profiler(object):
+    """
+    Call counts, times and output sizes for the functions made available to templates, in total and per page.
+
+    The cumulative time of a call includes the time spent in any other profiled functions it called (e.g. through a
+    template it rendered); its self time does not.
+    """
+    def __init__(self):
+        self.functions = {}
+        self.pages = {}
+        self._stack = []
+
+    def call(self, name, fn, args, kwargs):
+        # each frame on the stack collects the cumulative time of the profiled calls made beneath it
+        self._stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self._stack.pop()
+            if len(self._stack) > 0:
+                self._stack[-1] += elapsed
+        self._record(name, args, kwargs, elapsed, elapsed - children, result)
+        return result
+
+    def _record(self, name, args, kwargs, elapsed, own, result):
+        try:
+            size = len(result)
+        except TypeError:
+            size = 0
+
+        stats = self.functions.setdefault(name, _empty())
+        _add(stats, elapsed, own, size)
+
+        sig = _signature(args, kwargs)
+        signatures = stats.setdefault("signatures", {})
+        if sig not in signatures and len(signatures) >= MAX_SIGNATURES:
+            sig = OTHER_SIGNATURES
+        sigstats = signatures.setdefault(sig, {"calls" : 0, "total" : 0.0})
+        sigstats["calls"] += 1
+        sigstats["total"] += elapsed
+
+        page = context.page.page if context.page is not None else None
+        if page is not None:
+            _add(self.pages.setdefault(page, {}).setdefault(name, _empty()), elapsed, own, size)
+
+    def take(self):
+        """Remove and return everything recorded so far"""
+        snapshot = {"functions" : self.functions, "pages" : self.pages}
+        self.functions = {}
+        self.pages = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add in what was recorded by another profiler (e.g. in a worker process)"""
+        for name, stats in snapshot["functions"].items():
+            mine = self.functions.setdefault(name, _empty())
+            _add(mine, stats["total"], stats["self"], stats["output_chars"], stats["calls"])
+            signatures = mine.setdefault("signatures", {})
+            for sig, sigstats in stats.get("signatures", {}).items():
+                if sig not in signatures and len(signatures) >= MAX_SIGNATURES:
+                    sig = OTHER_SIGNATURES
+                s = signatures.setdefault(sig, {"calls" : 0, "total" : 0.0})
+                s["calls"] += sigstats["calls"]
+                s["total"] += sigstats["total"]
+        for page, functions in snapshot["pages"].items():
+            for name, stats in functions.items():
+                mine = self.pages.setdefault(page, {}).setdefault(name, _empty())
+                _add(mine, stats["total"], stats["self"], stats["output_chars"], stats["calls"])
+
+    def write(self, path):
+        with codecs.open(path, "w", "utf-8") as f:
+            f.write(json.dumps({"functions" : self.functions, "pages" : self.pages}, indent=2, sort_keys=True))
+
+    def summary(self, top=10):
+        if len(self.functions) == 0:
+            return "No template functions were called"
+        ranked = sorted(self.functions.items(), key=lambda kv: kv[1]["self"], reverse=True)
+        lines = ["Template functions by self time:",
+                 "  {a:>10} {b:>10} {c:>8} {d:>12}  {e}".format(a="self ms", b="total ms", c="calls", d="output",
+                                                                e="function")]
+        for name, stats in ranked[:top]:
+            lines.append("  {a:>10.1f} {b:>10.1f} {c:>8} {d:>12}  {e}".format(
+                a=stats["self"] * 1000, b=stats["total"] * 1000, c=stats["calls"], d=stats["output_chars"], e=name))
+
+            # the most expensive ways it was called
+            sigs = sorted(stats.get("signatures", {}).items(), key=lambda kv: kv[1]["total"], reverse=True)
+            for sig, sigstats in sigs[:3]:
+                lines.append("  {a:>10} {b:>10.1f} {c:>8}      {d}".format(a="", b=sigstats["total"] * 1000,
+                                                                           c=sigstats["calls"], d=sig))
+        return "\n".join(lines)
+
+
+def _empty():
+    return {"calls" : 0, "total" : 0.0, "self" : 0.0, "output_chars" : 0}
+
+
+def _add(stats, total, own, size, calls=1):
+    stats["calls"] += calls
+    stats["total"] += total
+    stats["self"] += own
+    stats["output_chars"] += size
+
+
+def _signature(args, kwargs):
+    bits = [_describe(a) for a in args] + [k + "=" + _describe(v) for k, v in sorted(kwargs.items())]
+    sig = "(" + ", ".join(bits) + ")"
+    if len(sig) > SIGNATURE_LENGTH:
+        sig = sig[:SIGNATURE_LENGTH - 3] + "..."
+    return sig
+
+
+def _describe(value):
+    # only plain values tell calls apart; anything else (e.g. the Jinja context given to context functions, whose
+    # repr holds all its variables) is given by its type, so that it neither splits the signatures nor costs much
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        inner = ", ".join([_describe(v) for v in value])
+        return "[" + inner + "]" if isinstance(value, list) else "(" + inner + ")"
+    if isinstance(value, dict):
+        return "{" + ", ".join([_describe(k) + ": " + _describe(v) for k, v in value.items()]) + "}"
+    return "<" + type(value).__name__ + ">"
+
+
+def start():
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def stop():
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    return profiler
+
+
+def active():
+    return _profiler
+
+
+def profiled(name, fn):
+    """Wrap a function (e.g. a template global) so that every call to it is profiled"""
+    @functools.wraps(fn)
+    def profiled_fn(*args, **kwargs):
+        profiler = _profiler
+        if profiler is None:
+            return fn(*args, **kwargs)
+        return profiler.call(name, fn, args, kwargs)
+    return plugin.copy_jinja_markers(fn, profiled_fn)
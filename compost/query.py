@@ -0,0 +1,209 @@
+import re
+from itertools import islice
+from collections.abc import Mapping
+from compost import exceptions
+
+# conditions on a field, other than plain equality, are given as a dict of these, e.g. {"Year" : {"gte" : 2000}}
+OPERATORS = ["eq", "in", "gt", "gte", "lt", "lte", "regex"]
+
+# compiled plans are kept by their query, up to this many
+MAX_PLANS = 1024
+_plans = {}
+
+
+def plan(where=None, order_by=None, offset=0, limit=None, fields=None):
+    """The compiled plan for a query, compiled the first time the query is seen"""
+    key = (_normalise_where(where), _normalise_order(order_by), int(offset),
+           int(limit) if limit is not None else None, tuple(fields) if fields is not None else None)
+    p = _plans.get(key)
+    if p is None:
+        if len(_plans) >= MAX_PLANS:
+            _plans.clear()
+        p = Plan(key)
+        _plans[key] = p
+    return p
+
+
+class Plan(object):
+    """
+    A query over a sequence of dict-like records, compiled once:
+
+    * where - the records must match on every field.  A plain value must be equal to the record's; a dict gives
+    operators: eq, in (a list of values), gt/gte/lt/lte (compared as numbers if the bound is a number, otherwise as
+    strings) and regex (searched for in the record's value)
+    * order_by - a field name, or a list of them, each of which may be prefixed with "-" to sort descending; or a
+    dict of field names to "asc" or "desc" (anything else is taken as "asc").  Every field is sorted on, the first
+    most significant.  Values which look like numbers sort as numbers, before any others
+    * offset, limit - which of the matching records to return
+    * fields - return dicts with only these fields, rather than the records themselves
+    """
+    def __init__(self, key):
+        self.key = key
+        self.where, self.order_by, self.offset, self.limit, self.fields = key
+        self._predicates = [(field, op, value, _predicate(field, op, value)) for field, op, value in self.where]
+
+    def execute(self, records, lookup=None):
+        """
+        Run the query over the records, and return a tuple of the results.  lookup(field, value), if given, returns
+        the records (in order) whose field has the value, or None if it cannot, so that an equality condition can
+        use an index rather than a scan
+        """
+        predicates = self._predicates
+        if lookup is not None:
+            for i, (field, op, value, fn) in enumerate(predicates):
+                if op == "eq":
+                    candidates = lookup(field, value)
+                    if candidates is not None:
+                        records = candidates
+                        predicates = predicates[:i] + predicates[i + 1:]
+                        break
+
+        matched = records
+        if len(predicates) > 0:
+            fns = [p[3] for p in predicates]
+            matched = (r for r in records if _all(fns, r))
+
+        end = self.offset + self.limit if self.limit is not None else None
+        if len(self.order_by) == 0:
+            # without a sort, we can stop as soon as we have enough
+            selected = list(islice(matched, self.offset, end))
+        else:
+            selected = list(matched)
+            # stable sorts, from the least significant field to the most, each key worked out once per record
+            for field, reverse in reversed(self.order_by):
+                selected.sort(key=sort_key(field), reverse=reverse)
+            selected = selected[self.offset:end]
+
+        if self.fields is not None:
+            selected = [dict([(f, r[f]) for f in self.fields if f in r]) for r in selected]
+        return tuple(selected)
+
+
+def sort_key(field):
+    """Key function for sorting records by a field, numbers (and empty values, as 0) first, then strings"""
+    def key(record):
+        v = record.get(field)
+        if v is None or v == "":
+            return (0, 0.0)
+        if isinstance(v, (int, float)):
+            return (0, float(v))
+        try:
+            return (0, float(v))
+        except (TypeError, ValueError):
+            return (1, str(v))
+    return key
+
+
+def match(where):
+    """A function which tells whether a record matches the where clause of a query"""
+    fns = [_predicate(field, op, value) for field, op, value in _normalise_where(where)]
+    return lambda record: _all(fns, record)
+
+
+def _all(fns, record):
+    for fn in fns:
+        if not fn(record):
+            return False
+    return True
+
+
+def _predicate(field, op, value):
+    if op == "eq":
+        if isinstance(value, tuple):
+            # lists and dicts in the query were made hashable, so the record's value has to be too
+            return lambda r: _hashable(r.get(field)) == value
+        return lambda r: r.get(field) == value
+
+    if op == "in":
+        try:
+            values = frozenset(value)
+        except TypeError:
+            values = value
+        def among(r):
+            v = r.get(field)
+            if isinstance(v, (list, dict)):
+                v = _hashable(v)
+            return v in values
+        return among
+
+    if op == "regex":
+        try:
+            rx = re.compile(value)
+        except (re.error, TypeError) as e:
+            raise exceptions.QueryException("Invalid regex for {x}: {y}".format(x=field, y=e))
+        def regex(r):
+            v = r.get(field)
+            return isinstance(v, str) and rx.search(v) is not None
+        return regex
+
+    # a range bound
+    numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+    compare = {
+        "gt" : lambda a, b: a > b,
+        "gte" : lambda a, b: a >= b,
+        "lt" : lambda a, b: a < b,
+        "lte" : lambda a, b: a <= b
+    }[op]
+    def bound(r):
+        v = r.get(field)
+        if v is None:
+            return False
+        if numeric:
+            try:
+                v = float(v)
+            except (TypeError, ValueError):
+                return False
+        elif not isinstance(v, str):
+            v = str(v)
+        return compare(v, value)
+    return bound
+
+
+def _normalise_where(where):
+    if where is None:
+        return ()
+    if not isinstance(where, Mapping):
+        raise exceptions.QueryException("where must be a dict of fields to conditions, not {x}".format(x=where))
+    conditions = []
+    for field, cond in where.items():
+        if isinstance(cond, Mapping) and len(cond) > 0 and all([k in OPERATORS for k in cond.keys()]):
+            for op, value in cond.items():
+                if op == "in":
+                    if value is None or isinstance(value, (str, Mapping)):
+                        raise exceptions.QueryException("in for {x} must be a list of values".format(x=field))
+                    value = tuple([_hashable(v) for v in value])
+                else:
+                    value = _hashable(value)
+                conditions.append((field, op, value))
+        else:
+            conditions.append((field, "eq", _hashable(cond)))
+    return tuple(sorted(conditions, key=repr))
+
+
+def _normalise_order(order_by):
+    if order_by is None:
+        return ()
+    if isinstance(order_by, Mapping):
+        order_by = [(k, v) for k, v in order_by.items()]
+    elif isinstance(order_by, str):
+        order_by = [order_by]
+    normalised = []
+    for o in order_by:
+        if isinstance(o, str):
+            if o.startswith("-"):
+                normalised.append((o[1:], True))
+            else:
+                normalised.append((o, False))
+        else:
+            # as data source sort settings always have, anything other than "desc" sorts ascending
+            field, direction = o
+            normalised.append((field, direction == "desc"))
+    return tuple(normalised)
+
+
+def _hashable(value):
+    if isinstance(value, Mapping):
+        return tuple(sorted([(k, _hashable(v)) for k, v in value.items()]))
+    if isinstance(value, (list, tuple)):
+        return tuple([_hashable(v) for v in value])
+    return value
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import os, json, hashlib, tempfile, threading
+from collections import OrderedDict
 import markdown
 
 from compost.models import Renderer
 from compost.context import context
+from compost import trace
 
 from jinja2.nodes import CallBlock
 from jinja2.ext import Extension
@@ -17,9 +20,14 @@ class MarkdownExtension(Extension):
         self._settings = None
         self._end_name = "name:endmarkdown"
 
-    def parse(self, parser):
+    @property
+    def settings(self):
+        # looked up on first use rather than in parse(), which is skipped for templates loaded from the bytecode cache
         if self._settings is None:
             self._settings = self.environment.globals.get("config").settings_for_tag("markdown")
+        return self._settings
+
+    def parse(self, parser):
         lineno = next(parser.stream).lineno
         body = parser.parse_statements(
             [self._end_name],
@@ -38,25 +46,10 @@ class MarkdownExtension(Extension):
         return self._render_markdown(block)
 
     def _strip_whitespace(self, block):
-        lines = block.split('\n')
-        whitespace = ''
-        output = ''
-
-        if (len(lines) > 1):
-            for char in lines[1]:
-                if (char == ' ' or char == '\t'):
-                    whitespace += char
-                else:
-                    break
-
-        for line in lines:
-            output += line.replace(whitespace, '', 1) + '\r\n'
-
-        return output.strip()
+        return strip_whitespace(block)
 
     def _render_markdown(self, block):
-        body = markdown.markdown(block, extensions=self._settings.get("settings", {}).get("extensions", []))
-        return body
+        return render_markdown(block, self.settings)
 
 
 class MarkdownInlineExtension(MarkdownExtension):
@@ -67,12 +60,230 @@ class MarkdownInlineExtension(MarkdownExtension):
         self._end_name = "name:endmdinline"
 
     def _render_markdown(self, block):
-        body = super(MarkdownInlineExtension, self)._render_markdown(block)
-        if body.startswith("<p>"):
-            body = body[3:]
-        if body.endswith("</p>"):
-            body = body[:-4]
-        return body
+        return render_inline_markdown(block, self.settings)
+
+
+def strip_whitespace(block):
+    lines = block.split('\n')
+    whitespace = ''
+    output = ''
+
+    if (len(lines) > 1):
+        for char in lines[1]:
+            if (char == ' ' or char == '\t'):
+                whitespace += char
+            else:
+                break
+
+    for line in lines:
+        output += line.replace(whitespace, '', 1) + '\r\n'
+
+    return output.strip()
+
+
+class MarkdownPool(object):
+    """
+    Reusable Markdown converters, kept per configuration of extensions.
+
+    Creating a Markdown instance loads and sets up each of its extensions, which costs far more than converting a
+    typical block, so converters are reset and reused rather than created for every block.  A converter is only
+    used by one caller at a time, so the pool is safe to use from several threads, and each process has its own.
+    """
+    def __init__(self):
+        self._idle = {}
+        self.created = 0
+
+    def convert(self, text, extensions=None, extension_configs=None):
+        extensions = list(extensions or [])
+        extension_configs = extension_configs or {}
+        key = (tuple(extensions), json.dumps(extension_configs, sort_keys=True))
+        idle = self._idle.setdefault(key, [])
+        try:
+            converter = idle.pop()
+        except IndexError:
+            converter = markdown.Markdown(extensions=extensions, extension_configs=extension_configs)
+            self.created += 1
+        try:
+            return converter.convert(text)
+        finally:
+            converter.reset()
+            idle.append(converter)
+
+
+_pool = MarkdownPool()
+
+
+class MarkdownCache(object):
+    """
+    Content-addressed cache of rendered markdown, keyed by the block and the extension configuration it was rendered
+    with, so that blocks which are unchanged since the last build are not converted again.
+
+    Recently used results are kept in memory.  Every result is also written to the build directory, so that it
+    survives from one build to the next, and is shared by worker processes; that tier is trimmed back to its size
+    limit, least recently used first, at the end of each build in which anything was written to it.
+    """
+    def __init__(self):
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # results written to disk (here, or by worker processes) since the cache was last trimmed
+        self.written = 0
+
+    def render(self, block, extensions, extension_configs, renderer):
+        key = self._key(block, extensions, extension_configs)
+        with self._lock:
+            html = self._memory.get(key)
+            if html is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return html
+
+        path = None
+        directory = self.directory()
+        if directory is not None:
+            path = os.path.join(directory, key[:2], key)
+            html = self._read(path)
+            if html is not None:
+                self.disk_hits += 1
+                self._remember(key, html)
+                return html
+
+        self.misses += 1
+        html = renderer()
+        self._remember(key, html)
+        if path is not None:
+            self._write(path, html)
+        return html
+
+    def directory(self):
+        if context.config is None:
+            return None
+        return os.path.join(context.config.build_dir(), "cache", "markdown")
+
+    def stats(self):
+        return {
+            "memory_hits" : self.memory_hits,
+            "disk_hits" : self.disk_hits,
+            "misses" : self.misses
+        }
+
+    def trim(self):
+        """
+        Remove the least recently used results from disk until the cache is within its size limit.  If nothing has
+        been written since it was last trimmed, it cannot have grown, so the directory is not looked at
+        """
+        if self.written == 0:
+            return
+        self.written = 0
+        directory = self.directory()
+        if directory is None or not os.path.exists(directory):
+            return
+        limit = context.config.markdown_cache().get("disk_size", 67108864)
+        entries = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for fn in filenames:
+                path = os.path.join(dirpath, fn)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, path))
+                total += st.st_size
+        if total <= limit:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= limit:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def _key(self, block, extensions, extension_configs):
+        h = hashlib.sha1()
+        h.update(json.dumps([markdown.__version__, extensions, extension_configs], sort_keys=True).encode("utf-8"))
+        h.update(b"\0")
+        h.update(block.encode("utf-8"))
+        return h.hexdigest()
+
+    def _remember(self, key, html):
+        size = 4096
+        if context.config is not None:
+            size = context.config.markdown_cache().get("memory_entries", size)
+        with self._lock:
+            self._memory[key] = html
+            self._memory.move_to_end(key)
+            while len(self._memory) > size:
+                self._memory.popitem(last=False)
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as f:
+                html = f.read().decode("utf-8")
+            # the modification time records when the result was last used, for trimming
+            os.utime(path)
+            return html
+        except OSError:
+            return None
+
+    def _write(self, path, html):
+        # the cache is only an optimisation, so failing to write to it is not an error
+        directory = os.path.dirname(path)
+        tmp = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, "wb") as f:
+                f.write(html.encode("utf-8"))
+            os.replace(tmp, path)
+            self.written += 1
+        except OSError:
+            if tmp is not None and os.path.exists(tmp):
+                os.unlink(tmp)
+
+
+cache = MarkdownCache()
+
+
+def convert(text, extensions=None, extension_configs=None):
+    """Convert markdown text to HTML, as markdown.markdown() would, with a pooled converter"""
+    return _pool.convert(text, extensions, extension_configs)
+
+
+def render_markdown(block, settings):
+    cfg = settings.get("settings", {})
+    extensions = cfg.get("extensions", [])
+    extension_configs = cfg.get("extension_configs")
+    with trace.span("markdown", "markdown"):
+        body = cache.render(block, extensions, extension_configs,
+                            lambda: convert(block, extensions, extension_configs))
+    return body
+
+
+def render_inline_markdown(block, settings):
+    body = render_markdown(block, settings)
+    if body.startswith("<p>"):
+        body = body[3:]
+    if body.endswith("</p>"):
+        body = body[:-4]
+    return body
+
+
+def markdown_block(text, tag="markdown"):
+    """Render text exactly as a {% markdown %} block would, without going through Jinja"""
+    settings = context.config.settings_for_tag(tag)
+    return render_markdown(strip_whitespace(text), settings)
+
+
+def inline_markdown_block(text, tag="mdinline"):
+    """Render text exactly as a {% mdinline %} block would, without going through Jinja"""
+    settings = context.config.settings_for_tag(tag)
+    return render_inline_markdown(strip_whitespace(text), settings)
 
 """
 class MarkdownRenderer(Renderer):
@@ -81,7 +292,7 @@ class MarkdownRenderer(Renderer):
         self._settings = context.config.renderer_settings(cfg_id)
 
     def render(self, text):
-        body = markdown.markdown(text, extensions=self._settings.get("extensions", []))
+        body = convert(text, self._settings.get("extensions", []))
         return body
 
 
@@ -0,0 +1,385 @@
+import os, re, json, asyncio, mimetypes, threading, traceback, email.utils
+from urllib.parse import unquote, urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from compost.context import context
+from compost import watcher
+
+EVENTS_PATH = "/__compost/events"
+LIVERELOAD_PATH = "/__compost/livereload.js"
+
+LIVERELOAD_JS = b"""(function() {
+    var source = new EventSource("/__compost/events");
+    source.addEventListener("reload", function() { window.location.reload(); });
+})();
+"""
+LIVERELOAD_TAG = b'<script src="/__compost/livereload.js"></script>'
+
+# precompressed variants of a file which may be served in its place, in order of preference
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+KEEPALIVE_INTERVAL = 15
+MAX_HEADERS = 100
+
+REASONS = {
+    200 : "OK",
+    206 : "Partial Content",
+    304 : "Not Modified",
+    400 : "Bad Request",
+    404 : "Not Found",
+    405 : "Method Not Allowed",
+    416 : "Range Not Satisfiable",
+    500 : "Internal Server Error"
+}
+
+UNSATISFIABLE = "unsatisfiable"
+BAD_REQUEST = "bad request"
+
+
+def serve(session, host="127.0.0.1", port=8000, live_reload=True):
+    server = Server(session, live_reload)
+    try:
+        asyncio.run(server.run(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+class Server(object):
+    """
+    HTTP server for the output directory, which runs on a single asyncio event loop.
+
+    Rather than building the whole site up front, pages whose inputs have changed are rendered by the build
+    session the first time they are requested.  The session (and the global context it uses) is not thread safe,
+    so building and rendering are done one at a time on a single worker thread, leaving the event loop free to
+    serve other requests meanwhile.  Requests for files wait for any build in progress to finish, as it may be
+    removing or replacing the file.
+    """
+    def __init__(self, session, live_reload=True):
+        self.session = session
+        self.live_reload = live_reload
+        self.out_dir = os.path.abspath(context.config.out_dir())
+        self._loop = None
+        self._builder = ThreadPoolExecutor(max_workers=1)
+        self._rendering = {}
+        self._listeners = set()
+        self._building = 0
+        self._idle = None
+
+    async def run(self, host, port):
+        self._loop = asyncio.get_running_loop()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+        print("Checking for changes since the last build")
+        await self._refresh(None)
+
+        thread = threading.Thread(target=watcher.watch, args=(context.config.src_dir(), self._changed), daemon=True)
+        thread.start()
+
+        server = await asyncio.start_server(self._handle, host, port)
+        print("Serving {x} at http://{y}:{z}/".format(x=self.out_dir, y=host, z=port))
+        async with server:
+            await server.serve_forever()
+
+    ###############################################
+    ## building
+
+    def _changed(self, report):
+        # called by the watcher, on its own thread
+        self._loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._refresh(report)))
+
+    async def _refresh(self, report):
+        # builds queue up on the worker thread, so requests wait until the last of them is done
+        self._building += 1
+        self._idle.clear()
+        try:
+            changed = await self._loop.run_in_executor(self._builder, self.session.build, report, False)
+        except Exception as e:
+            print(e)
+            traceback.print_exc()
+            return
+        finally:
+            self._building -= 1
+            if self._building == 0:
+                self._idle.set()
+        if changed is None or len(changed) > 0:
+            self._notify(changed)
+
+    async def _render(self, page):
+        # concurrent requests for the same stale page share one render
+        future = self._rendering.get(page)
+        if future is None:
+            future = self._loop.run_in_executor(self._builder, self.session.render, page)
+            self._rendering[page] = future
+            future.add_done_callback(lambda f: self._rendering.pop(page, None))
+        # a client going away must not cancel a render that others may be waiting for
+        await asyncio.shield(future)
+
+    ###############################################
+    ## live reload
+
+    def _notify(self, changed):
+        data = json.dumps(sorted(changed) if changed is not None else None)
+        message = "event: reload\ndata: {x}\n\n".format(x=data).encode("utf-8")
+        for queue in self._listeners:
+            queue.put_nowait(message)
+
+    async def _events(self, writer):
+        writer.write(_head(200, [
+            ("Content-Type", "text/event-stream"),
+            ("Cache-Control", "no-cache"),
+            ("Connection", "close")
+        ]))
+        queue = asyncio.Queue()
+        self._listeners.add(queue)
+        try:
+            writer.write(b": connected\n\n")
+            await writer.drain()
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    # also how we find out that the client has gone away
+                    message = b": keepalive\n\n"
+                writer.write(message)
+                await writer.drain()
+        finally:
+            self._listeners.discard(queue)
+
+    ###############################################
+    ## HTTP
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                if request is BAD_REQUEST:
+                    writer.write(_head(400, [("Content-Length", "0"), ("Connection", "close")]))
+                    break
+                method, target, version, headers = request
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+
+                path = unquote(urlsplit(target).path)
+                if path == EVENTS_PATH:
+                    await self._events(writer)
+                    break
+                status = await self._respond(writer, method, path, headers, keep_alive)
+                print('"{m} {t}" {s}'.format(m=method, t=target, s=status))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, method, path, headers, keep_alive):
+        extra = [] if keep_alive else [("Connection", "close")]
+
+        if method not in ["GET", "HEAD"]:
+            return _send(writer, method, 405, b"Method Not Allowed", extra + [("Allow", "GET, HEAD")])
+
+        if path == LIVERELOAD_PATH:
+            return _send(writer, method, 200, LIVERELOAD_JS, extra + [("Content-Type", "application/javascript")])
+
+        await self._idle.wait()
+        page = _page_for_path(path, self.out_dir)
+        if page is None:
+            return _send(writer, method, 404, b"Not Found", extra)
+
+        try:
+            if page in self.session.stale:
+                await self._render(page)
+        except Exception as e:
+            traceback.print_exc()
+            return _send(writer, method, 500, str(e).encode("utf-8"), extra)
+
+        filepath = os.path.join(self.out_dir, page)
+        if not os.path.isfile(filepath):
+            return _send(writer, method, 404, b"Not Found", extra)
+        return await self._send_file(writer, method, filepath, headers, extra)
+
+    async def _send_file(self, writer, method, path, headers, extra):
+        ctype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        inject = self.live_reload and ctype == "text/html"
+
+        # a precompressed variant is only used if it is at least as new as the file it is a variant of
+        encoding = None
+        served = path
+        if not inject:
+            accepted = _accepted_encodings(headers.get("accept-encoding", ""))
+            mtime = os.stat(path).st_mtime_ns
+            for enc, suffix in ENCODINGS:
+                if enc in accepted and os.path.isfile(path + suffix) and os.stat(path + suffix).st_mtime_ns >= mtime:
+                    encoding = enc
+                    served = path + suffix
+                    break
+
+        st = os.stat(served)
+        variant = "-" + encoding if encoding is not None else "-lr" if inject else ""
+        etag = '"{m:x}-{s:x}{v}"'.format(m=st.st_mtime_ns, s=st.st_size, v=variant)
+
+        if ctype.startswith("text/") or ctype == "application/javascript":
+            ctype += "; charset=utf-8"
+        fields = extra + [
+            ("Content-Type", ctype),
+            ("ETag", etag),
+            ("Last-Modified", email.utils.formatdate(st.st_mtime, usegmt=True)),
+            ("Cache-Control", "no-cache")
+        ]
+        if not inject:
+            fields.append(("Accept-Ranges", "bytes"))
+            fields.append(("Vary", "Accept-Encoding"))
+        if encoding is not None:
+            fields.append(("Content-Encoding", encoding))
+
+        if _etag_matches(headers.get("if-none-match"), etag):
+            writer.write(_head(304, fields))
+            return 304
+
+        if inject:
+            # the page is changed on the way out, so it is always sent whole
+            with open(served, "rb") as f:
+                body = f.read()
+            return _send(writer, method, 200, _inject_livereload(body), fields)
+
+        start, count, status = 0, st.st_size, 200
+        if "range" in headers and headers.get("if-range", etag) == etag:
+            byte_range = _parse_range(headers["range"], st.st_size)
+            if byte_range is UNSATISFIABLE:
+                return _send(writer, method, 416, b"", fields + [("Content-Range", "bytes */{x}".format(x=st.st_size))])
+            if byte_range is not None:
+                start, end = byte_range
+                count = end - start + 1
+                status = 206
+                fields.append(("Content-Range", "bytes {x}-{y}/{z}".format(x=start, y=end, z=st.st_size)))
+
+        writer.write(_head(status, fields + [("Content-Length", str(count))]))
+        if method == "HEAD" or count == 0:
+            return status
+        await writer.drain()
+        with open(served, "rb") as f:
+            await self._loop.sendfile(writer.transport, f, start, count)
+        return status
+
+
+async def _read_request(reader):
+    """Read the request line and headers.  None if the client has gone away, BAD_REQUEST if it is malformed"""
+    try:
+        line = await reader.readline()
+    except (asyncio.LimitOverrunError, ValueError):
+        return BAD_REQUEST
+    if not line:
+        return None
+    bits = line.decode("latin-1").split()
+    if len(bits) != 3 or not bits[2].startswith("HTTP/"):
+        return BAD_REQUEST
+    method, target, version = bits
+
+    headers = {}
+    while True:
+        try:
+            line = await reader.readline()
+        except (asyncio.LimitOverrunError, ValueError):
+            return BAD_REQUEST
+        if not line:
+            return None
+        line = line.decode("latin-1").rstrip("\r\n")
+        if line == "":
+            break
+        if len(headers) >= MAX_HEADERS or ":" not in line:
+            return BAD_REQUEST
+        name, value = line.split(":", 1)
+        headers[name.strip().lower()] = value.strip()
+
+    return method, target, version, headers
+
+
+def _page_for_path(path, out_dir):
+    """The path of the file requested, relative to the output directory, or None if it is outside it"""
+    rel = os.path.normpath(path.lstrip("/"))
+    if rel == ".":
+        rel = ""
+    if rel.startswith("..") or os.path.isabs(rel):
+        return None
+    if path.endswith("/") or rel == "" or os.path.isdir(os.path.join(out_dir, rel)):
+        rel = os.path.join(rel, "index.html")
+    return rel
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for part in header.split(","):
+        bits = part.strip().split(";")
+        name = bits[0].strip().lower()
+        q = 1.0
+        for param in bits[1:]:
+            param = param.strip()
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if name and q > 0:
+            accepted.add(name)
+    return accepted
+
+
+def _etag_matches(header, etag):
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _parse_range(header, size):
+    """
+    The (start, end) of a single byte range, inclusive.  None if the header is not one we understand (e.g. it asks
+    for several ranges), in which case the whole file is sent, or UNSATISFIABLE if none of the range is in the file
+    """
+    m = re.match(r"^bytes=(\d*)-(\d*)$", header.strip())
+    if m is None or (m.group(1) == "" and m.group(2) == ""):
+        return None
+    if m.group(1) == "":
+        length = int(m.group(2))
+        if length == 0 or size == 0:
+            return UNSATISFIABLE
+        return max(size - length, 0), size - 1
+    start = int(m.group(1))
+    end = int(m.group(2)) if m.group(2) != "" else size - 1
+    if start >= size:
+        return UNSATISFIABLE
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _inject_livereload(body):
+    idx = body.lower().rfind(b"</body>")
+    if idx == -1:
+        return body + LIVERELOAD_TAG
+    return body[:idx] + LIVERELOAD_TAG + body[idx:]
+
+
+def _head(status, fields):
+    lines = ["HTTP/1.1 {x} {y}".format(x=status, y=REASONS.get(status, ""))]
+    lines += ["{x}: {y}".format(x=k, y=v) for k, v in fields]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def _send(writer, method, status, body, fields):
+    writer.write(_head(status, fields + [("Content-Length", str(len(body)))]))
+    if method != "HEAD":
+        writer.write(body)
+    return status
@@ -0,0 +1,127 @@
+import os, json, time, codecs, threading, functools
+from contextlib import contextmanager
+from compost import plugin
+
+# the active tracer, if the build is being traced.  When it is None all the tracing calls do nothing.
+_tracer = None
+
+
+class Tracer(object):
+    """
+    Records nested timing spans as Chrome trace "complete" events, which can be opened in chrome://tracing or
+    in Perfetto.  Timestamps come from the system-wide monotonic clock, so that events recorded in worker
+    processes line up with those from the main process.
+    """
+    def __init__(self):
+        self.events = []
+
+    def record(self, name, cat, start, end, args=None):
+        event = {
+            "name" : name,
+            "cat" : cat,
+            "ph" : "X",
+            "ts" : start * 1e6,
+            "dur" : (end - start) * 1e6,
+            "pid" : os.getpid(),
+            "tid" : threading.get_ident()
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def take(self):
+        """Remove and return the events recorded so far"""
+        events = self.events
+        self.events = []
+        return events
+
+
+def start():
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop():
+    global _tracer
+    tracer = _tracer
+    _tracer = None
+    return tracer
+
+
+def active():
+    return _tracer
+
+
+@contextmanager
+def span(name, cat="build", **args):
+    if _tracer is None:
+        yield
+        return
+    tracer = _tracer
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.record(name, cat, start, time.perf_counter(), args)
+
+
+def traced(name, fn, cat="util"):
+    """Wrap a function (e.g. a template global) so that every call to it is recorded as a span"""
+    @functools.wraps(fn)
+    def traced_fn(*args, **kwargs):
+        tracer = _tracer
+        if tracer is None:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            tracer.record(name, cat, start, time.perf_counter())
+    return plugin.copy_jinja_markers(fn, traced_fn)
+
+
+def write(events, path):
+    pids = sorted(set([e["pid"] for e in events]))
+    meta = []
+    for i, pid in enumerate(pids):
+        meta.append({
+            "name" : "process_name",
+            "ph" : "M",
+            "pid" : pid,
+            "args" : {"name" : "compost" if i == 0 else "compost worker " + str(i)}
+        })
+    with codecs.open(path, "w", "utf-8") as f:
+        f.write(json.dumps({"traceEvents" : meta + events, "displayTimeUnit" : "ms"}))
+
+
+def summary(events, top=10):
+    """Text summary of the build stages, and the slowest pages and template functions"""
+    lines = []
+
+    stages = sorted([e for e in events if e["cat"] == "build"], key=lambda e: e["ts"])
+    if len(stages) > 0:
+        lines.append("Build stages:")
+        for e in stages:
+            lines.append("  {t:>10.1f} ms  {n}".format(t=e["dur"] / 1000, n=e["name"]))
+
+    pages = sorted([e for e in events if e["cat"] == "page"], key=lambda e: e["dur"], reverse=True)
+    if len(pages) > 0:
+        lines.append("Slowest {x} pages:".format(x=min(top, len(pages))))
+        for e in pages[:top]:
+            lines.append("  {t:>10.1f} ms  {n}".format(t=e["dur"] / 1000, n=e["name"]))
+
+    functions = {}
+    for e in events:
+        if e["cat"] not in ["util", "markdown"]:
+            continue
+        stats = functions.setdefault(e["name"], {"calls" : 0, "total" : 0.0})
+        stats["calls"] += 1
+        stats["total"] += e["dur"]
+    if len(functions) > 0:
+        ranked = sorted(functions.items(), key=lambda kv: kv[1]["total"], reverse=True)
+        lines.append("Slowest {x} functions (total time):".format(x=min(top, len(ranked))))
+        for name, stats in ranked[:top]:
+            lines.append("  {t:>10.1f} ms  {c:>7} calls  {n}".format(t=stats["total"] / 1000, c=stats["calls"], n=name))
+
+    return "\n".join(lines)
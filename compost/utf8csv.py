@@ -1,40 +1,51 @@
-import csv, codecs
+import csv, itertools
 
-class UTF8Recoder:
+BOM = "\ufeff"
+
+
+def open_csv(path):
     """
-    Iterator that reads an encoded stream and reencodes the input to UTF-8
+    Open a UTF-8 CSV file for reading.  The utf-8-sig codec removes a byte order mark from the start of the file,
+    if it has one, once, so the lines can go straight to the C csv reader
     """
-    def __init__(self, f, encoding):
-        self.reader = f
+    return open(path, "r", encoding="utf-8-sig")
 
-    def __iter__(self):
-        return self
 
-    def __next__(self):
-        return self.next()
+def stream_rows(path, dialect=csv.excel, **kwds):
+    """Yield the rows of a CSV file one at a time, the headers first, without holding the whole file in memory"""
+    with open_csv(path) as f:
+        for row in csv.reader(f, dialect=dialect, **kwds):
+            yield row
 
-    def next(self):
-        val = self.reader.__next__()
-        raw = val.encode("utf-8")
-        if raw.startswith(codecs.BOM_UTF8):
-            raw = raw.replace(codecs.BOM_UTF8, '', 1)
-        return raw.decode("utf-8")
 
 class UnicodeReader:
     """
-    A CSV reader which will iterate over lines in the CSV file "f",
-    which is encoded in the given encoding.
+    A CSV reader which will iterate over lines in the CSV file "f".
+
+    f should be opened with open_csv(); if it was not, a byte order mark at the start of the first row is removed
+    here.  Iterating over the reader gives the rows straight from the C csv reader once the first has been read.
     """
 
     def __init__(self, f, dialect=csv.excel, encoding="utf-8", **kwds):
-        f = UTF8Recoder(f, encoding)
         self.reader = csv.reader(f, dialect=dialect, **kwds)
+        self._first = True
 
     def __next__(self):
         return self.next()
 
     def next(self):
-        return self.reader.__next__()
+        row = self.reader.__next__()
+        if self._first:
+            self._first = False
+            if len(row) > 0 and row[0].startswith(BOM):
+                row[0] = row[0][len(BOM):]
+        return row
 
     def __iter__(self):
-        return self
\ No newline at end of file
+        if not self._first:
+            return self.reader
+        try:
+            first = self.next()
+        except StopIteration:
+            return iter(())
+        return itertools.chain((first,), self.reader)
@@ -2,8 +2,9 @@ import os, json
 
 from compost.context import context
 from compost import exceptions
+from compost import deferred
+from compost.fragments import FragmentWriter
 from datetime import datetime
-import markdown
 
 
 def is_markdown(func):
@@ -55,21 +56,24 @@ def now(format):
 
 
 def toc(id="main"):
-    tocs = context.recall("tocs", {})
-    toc = tocs.get(id)
+    # the headers aren't all known until the whole page has been rendered, so the toc is filled in afterwards
+    return deferred.defer(lambda: _render_toc(id))
+
+
+def _render_toc(id):
+    # delay the import, as the renderers depend on the models, which depend on this module
+    from compost.renderers import md
 
-    # toc = context.recall("toc")
-    if toc is None:
-        return '{% autoescape off %}{{ toc("' + id + '") }}{% endautoescape %}'
+    tocs = context.recall("tocs", {})
+    toc = tocs.get(id, {})
 
     numbers = list(toc.keys())
     numbers.sort(key=lambda s: [int(u) for u in s.split('.') if u.strip() != ""])
-    frag = "{% markdown %}\n"
+    frag = FragmentWriter("\n")
     for n in numbers:
         indent = len(n.split(".")) - 1
-        frag += "\t" * indent + "* [" + n + ". " + toc[n] + "](#" + n + ")\n"
-    frag += "{% endmarkdown %}"
-    return frag
+        frag.append("\t" * indent + "* [" + n + ". " + toc[n] + "](#" + n + ")\n")
+    return md.markdown_block(frag.getvalue())
 
 
 @is_inline_markdown
@@ -77,9 +81,9 @@ def ref(reference):
     """Insert a link to a reference in some unspecified references section"""
     settings = context.config.util_properties("ref")
     records = context.data.get(settings.get("source", "references")).shape("dict")
-    for entry in records:
-        if entry.get("ID") == reference:
-            return "[[" + reference + "](#" + _anchor_name(reference) + ")]"
+    if reference in records.index("ID", unique=True):
+        return "[[" + reference + "](#" + _anchor_name(reference) + ")]"
+    raise exceptions.InconsistentStructureException("Unable to find reference " + reference)
 
 
 def header(name, level=1, toc="main"):
@@ -140,26 +144,37 @@ def json_schema_definitions(data_handle):
     _recurse_properties(rows, schema_doc.get("patternProperties", {}), "")
 
     rows.sort(key=lambda x: x[0])
-    frag =  "| Field | Type | Description |\n"
-    frag += "| ----- | ---- | ----------- |\n"
+    frag = FragmentWriter("| Field | Type | Description |\n", "| ----- | ---- | ----------- |\n")
     for row in rows:
         desc = row[2]
         desc = desc.replace("\n", "<br>")
-        frag += "| " + row[0] + " | " + row[1] + " | " + desc + " |\n"
-    return frag
+        frag.append("| " + row[0] + " | " + row[1] + " | " + desc + " |\n")
+    return frag.getvalue()
 
 
-@is_inline_markdown
 def section_link(header, toc="main"):
-    tocs = context.recall("tocs", {})
-    tocinst = tocs.get(toc, {})
+    # the header may come later in the page than the link, so the link is filled in once the page is rendered
+    return deferred.defer(lambda: _render_section_link(header, toc))
+
+
+def _render_section_link(header, toc):
+    from compost.renderers import md
+
+    # by the time links are resolved all the headers are known, so each toc is indexed by header once per page
+    indexes = context.recall("section_indexes", {})
+    if toc not in indexes:
+        tocinst = context.recall("tocs", {}).get(toc, {})
+        index = {}
+        for k, v in tocinst.items():
+            if v not in index:
+                index[v] = k
+        indexes[toc] = index
+        context.remember("section_indexes", indexes)
 
-    # toc = context.recall("toc")
-    for k, v in tocinst.items():
-        if v == header:
-            return "[" + header + "](#" + k + ")"
-    return '{% autoescape off %}{{ section_link("' + header + '", "' + toc + '") }}{% endautoescape %}'
-    # raise exceptions.InconsistentStructureException("Unable to find header " + header)
+    number = indexes[toc].get(header)
+    if number is not None:
+        return md.inline_markdown_block("[" + header + "](#" + number + ")")
+    raise exceptions.InconsistentStructureException("Unable to find header " + header)
 
 
 @is_markdown
@@ -180,110 +195,78 @@ def sections(source, header_field, header_level, order, list_fields, intro):
     rows = context.data.get(source).shape("table")
     headers = rows.next()
 
-    hindex = 0
-    for i in range(len(headers)):
-        h = headers[i]
-        if header_field == h:
-            hindex = i
-
-    oindex = []
-    for o in order:
-        for i in range(len(headers)):
-            if o == headers[i]:
-                oindex.append(i)
-                break
+    hindex = rows.column(header_field)
+    if hindex is None:
+        hindex = 0
+
+    oindex = [rows.column(o) for o in order if rows.column(o) is not None]
 
-    frag = ""
+    frag = FragmentWriter()
     for row in rows:
-        frag += "#" * header_level + " " + row[hindex] + "\n\n"
+        frag.append("#" * header_level + " " + row[hindex] + "\n\n")
         for o in oindex:
             content = row[o]
             if content == "":
                 continue
             if headers[o] in intros:
-                frag += intros[headers[o]] + "\n\n"
+                frag.append(intros[headers[o]] + "\n\n")
             if headers[o] in list_fields:
-                thelist = ""
                 bits = [c.strip() for c in content.split(",")]
                 for b in bits:
-                    thelist += " * " + b + "\n"
-                content = thelist
-            frag += content + "\n\n"
+                    frag.append(" * " + b + "\n")
+                frag.append("\n\n")
+            else:
+                frag.append(content + "\n\n")
 
-    return frag
+    return frag.getvalue()
 
 
 def dl(source, term, definition, link=None, size=None, offset=0, filter_field=None, filters=None):
-    rows = context.data.get(source).shape("table")
-    frag = "<dl>"
-    offset = int(offset)
-    if size is not None:
-        size = int(size)
-    if filters is not None:
-        if not isinstance(filters, list):
-            filters = [filters]
-
-    headers = rows.next()
-
-    filter_idx = -1
-    if filter_field is not None:
-        for i in range(len(headers)):
-            if headers[i] == filter_field:
-                filter_idx = i
-
-    n = 0
-    for row in rows:
-        if filter_field is not None:
-            val = row[filter_idx]
-            if val not in filters:
-                continue
-
-        if size is not None and n >= size + offset:
-            break
-        n += 1
-        if n < offset + 1:
-            continue
+    from compost.renderers import md
+    frag = FragmentWriter("<dl>")
+    records = _select_records(source, filter_field, filters, offset, size)
 
+    for record in records:
         dt = None
         dd = None
         a = ""
-        for i in range(len(row)):
-            col = row[i]
-            name = headers[i]
-            if name == term:
-                a = '<a name="' + _anchor_name(col) + '"></a>'
-            if name == link:
+        if term in record:
+            col = record[term]
+            a = '<a name="' + _anchor_name(col) + '"></a>'
+            if term == link:
                 col = "[" + col + "](" + col + ")"
-            if name == term:
-                dt = col
-                continue
-            if name == definition:
-                dd = col
-                continue
-        dt = markdown.markdown(dt)[3:-4]    # removes the <p> and </p> markdown inserts
-        dd = markdown.markdown(dd)[3:-4]    # removes the <p> and </p> markdown inserts
-        frag += "<dt>" + a + dt + "</dt><dd>" + dd + "</dd>"
+            dt = col
+        if definition in record and definition != term:
+            col = record[definition]
+            if definition == link:
+                col = "[" + col + "](" + col + ")"
+            dd = col
+        dt = md.convert(dt)[3:-4]    # removes the <p> and </p> markdown inserts
+        dd = md.convert(dd)[3:-4]    # removes the <p> and </p> markdown inserts
+        frag.append("<dt>" + a + dt + "</dt><dd>" + dd + "</dd>")
 
-    frag += "</dl>"
-    return frag
+    frag.append("</dl>")
+    return frag.getvalue()
 
 
 @is_markdown
 def table(source, anchor=None, anchor_prefix=""):
-    rows = context.data.get(source).shape("table")
-    headers = rows.next()
-    frag = "| " + " | ".join(headers) + " |\n"
-    frag += "| " + "--- |" * len(headers) + "\n"
+    rows = context.data.get(source).shape("table").stream()
+    headers = next(rows)
+    frag = FragmentWriter("| " + " | ".join(headers) + " |\n")
+    frag.append("| " + "--- |" * len(headers) + "\n")
     for row in rows:
         linified_row = [cell.replace("\n", "<br>") for cell in row]
         if anchor is not None:
             v = linified_row[anchor]
             linified_row[anchor] = '<a name="' + anchor_prefix + _anchor_name(v) + '">' + v + '</a>'
-        frag += "| " + " | ".join(linified_row) + " |\n"
-    return frag
+        frag.append("| " + " | ".join(linified_row) + " |\n")
+    return frag.getvalue()
 
 
 def json_extract(source, keys=None, exclude=None, selector=None, listobj_match=None, unwrap_single_entry_list=False, insert=None):
+    from compost.datasources import jsonsources
+
     if keys is not None and not isinstance(keys, list):
         keys = [keys]
     include = keys
@@ -296,15 +279,30 @@ def json_extract(source, keys=None, exclude=None, selector=None, listobj_match=N
 
     bd = context.config.src_dir()
     path = os.path.join(bd, source)
-    with open(path, "r", encoding="utf-8") as f:
-        js = json.loads(f.read())
+    context.add_dependency(path)
+
+    # the document is shared with the data sources, and the output for the same arguments is the same on every page
+    js = jsonsources.load_document(path)
+    args = json.dumps([include, exclude, selector, listobj_match, unwrap_single_entry_list, insert], sort_keys=True)
+    return jsonsources.memoised(js, ("json_extract", args),
+                                lambda: _json_extract(js, include, exclude, selector, listobj_match,
+                                                      unwrap_single_entry_list, insert))
+
+
+def _json_extract(js, include, exclude, selector, listobj_match, unwrap_single_entry_list, insert):
+    from compost.datasources import jsonsources
 
     if selector is not None:
-        js = js[selector]
+        # a plain key, as before, or else a JSON Pointer or dotted path
+        if isinstance(js, dict) and selector in js:
+            js = js[selector]
+        else:
+            js = jsonsources.select(js, selector)
 
+    # the document must not be changed, so anything we remove from or add to is a copy
     show = {}
     if include is None:
-        show = js
+        show = dict(js) if isinstance(js, dict) else js
     else:
         for key in include:
             if key in js:
@@ -326,7 +324,9 @@ def json_extract(source, keys=None, exclude=None, selector=None, listobj_match=N
     if isinstance(show, list) and len(show) == 1 and unwrap_single_entry_list:
         show = show[0]
 
-    show.update(insert)
+    if len(insert) > 0:
+        show = dict(show)
+        show.update(insert)
 
     out = json.dumps(show, indent=2, sort_keys=True)
     return out
@@ -334,10 +334,8 @@ def json_extract(source, keys=None, exclude=None, selector=None, listobj_match=N
 
 def define(source, id):
     rows = context.data.get(source).shape("table")
-    headers = rows.next()
-    for row in rows:
-        if row[0] == id:
-            return id + '<sup>[<a href="#' + _anchor_name(id) + '">def</a>]</sup>'
+    if id in rows.index(0, unique=True):
+        return id + '<sup>[<a href="#' + _anchor_name(id) + '">def</a>]</sup>'
     raise exceptions.InconsistentStructureException("Unable to find definition for " + id)
 
 
@@ -366,16 +364,10 @@ def requirements(reqs, hierarchy, groups, match, output):
         group = groups[i]
         m = match[i]
         match_row = None
-        for row in hei:
-            broke = False
-            if row[0] == group:
-                for j in range(len(row) - 1, -1, -1):
-                    if row[j] == m:
-                        match_row = row
-                        broke = True
-                        break
-                if broke:
-                    break
+        for row in hei.index(0).get(group, ()):
+            if m in row:
+                match_row = row
+                break
 
         if match_row is not None:
             lookups = []
@@ -389,21 +381,13 @@ def requirements(reqs, hierarchy, groups, match, output):
             lookup[group] = lookups
 
     idx = {}
-    for i in range(len(headers)):
-        h = headers[i]
-        for group in groups:
-            if h == group:
-                idx[group] = i
-                break
-        for o in output:
-            if "+" in o:
-                o = o.split("+")
-            if not isinstance(o, list):
-                o = [o]
-            for bit in o:
-                if h == bit:
-                    idx[bit] = i
-                    break
+    for group in groups:
+        if requirements.column(group) is not None:
+            idx[group] = requirements.column(group)
+    for o in output:
+        for bit in o.split("+"):
+            if requirements.column(bit) is not None:
+                idx[bit] = requirements.column(bit)
 
     rs = []
     for r in requirements:
@@ -435,16 +419,16 @@ def requirements(reqs, hierarchy, groups, match, output):
             if v != "":
                 sections[o].append(v)
 
-    frag = ""
+    frag = FragmentWriter()
     for key in output:
         reqs = sections[key]
         if len(reqs) == 0:
             continue
-        frag += "**" + key + "**\n\n"
+        frag.append("**" + key + "**\n\n")
         for req in reqs:
-            frag += " * " + req.replace("\n", "<br>") + "\n"
-        frag += "\n"
-    return frag
+            frag.append(" * " + req.replace("\n", "<br>") + "\n")
+        frag.append("\n")
+    return frag.getvalue()
 
 
 def requirements_hierarchy(source, key):
@@ -465,18 +449,17 @@ def requirements_hierarchy(source, key):
             c = c[cell]
         c = h
 
-    def _recurse_heirarchy(node, depth):
-        frag = ""
+    def _recurse_heirarchy(frag, node, depth):
         for k, v in node.items():
             if k == "*":
                 k = "All"
-            frag += "\t" * (depth - 1) + "* " + k.replace("*", "\*") + "\n"
+            frag.append("\t" * (depth - 1) + "* " + k.replace("*", "\*") + "\n")
             if len(v.keys()) != 0:
-                frag += _recurse_heirarchy(v, depth + 1)
-        return frag
+                _recurse_heirarchy(frag, v, depth + 1)
 
-    frag = _recurse_heirarchy(h, 1)
-    return frag
+    frag = FragmentWriter()
+    _recurse_heirarchy(frag, h, 1)
+    return frag.getvalue()
 
 
 @is_markdown
@@ -498,16 +481,9 @@ def requirements_table_2(source, vectors, reqs, definitions=None):
     headers = reader.next()
 
     idx = {}
-    for i in range(len(headers)):
-        h = headers[i]
-        for v in vectors:
-            if h == v:
-                idx[v] = i
-                break
-        for r in reqs:
-            if h == r:
-                idx[r] = i
-                break
+    for name in vectors + reqs:
+        if reader.column(name) is not None:
+            idx[name] = reader.column(name)
 
     vector_sections = []
     expanded_requirements = {}
@@ -527,37 +503,35 @@ def requirements_table_2(source, vectors, reqs, definitions=None):
             if val != "" and val not in expanded_requirements[id][r]:
                 expanded_requirements[id][r].append(val)
 
-    frag = ""
+    frag = FragmentWriter()
     for i in range(len(vector_sections)):
         vs = vector_sections[i]
         ctx = expanded_requirements[i]
 
-        frag += "**Request Conditions**:\n\n"
+        frag.append("**Request Conditions**:\n\n")
         for j in range(len(vs)):
             vname = vs[j]
             vtype = vectors[j]
             if vname == "*":
                 vname = "All"
-            frag += "* **" + vtype + "**: " + vname + "\n"
-        frag += "\n"
+            frag.append("* **" + vtype + "**: " + vname + "\n")
+        frag.append("\n")
 
         for r in reqs:
             vals = ctx[r]
             if len(vals) == 0:
                 continue
-            cell = ""
+            frag.append("**" + r + "**\n\n")
             for v in vals:
                 deftext = ""
                 if r in defs:
                     deftext = " - " + defs[r][v]
-                cell += "* " + v + deftext + "\n"
+                frag.append("* " + v + deftext + "\n")
+            frag.append("\n")
 
-            frag += "**" + r + "**\n\n"
-            frag += cell + "\n"
+        frag.append("<hr>")
 
-        frag += "<hr>"
-
-    return frag
+    return frag.getvalue()
 
 
 def content_disposition(reqs, hierarchy, groups, match):
@@ -570,17 +544,10 @@ def content_disposition(reqs, hierarchy, groups, match):
         group = groups[i]
         m = match[i]
         match_row = None
-        hei.reset()
-        for row in hei:
-            broke = False
-            if row[0] == group:
-                for j in range(len(row) - 1, -1, -1):
-                    if row[j] == m:
-                        match_row = row
-                        broke = True
-                        break
-                if broke:
-                    break
+        for row in hei.index(0).get(group, ()):
+            if m in row:
+                match_row = row
+                break
 
         if match_row is not None:
             lookups = []
@@ -595,21 +562,13 @@ def content_disposition(reqs, hierarchy, groups, match):
 
     output = ["Disposition Type", "Param"]
     idx = {}
-    for i in range(len(headers)):
-        h = headers[i]
-        for group in groups:
-            if h == group:
-                idx[group] = i
-                break
-        for o in output:
-            if "+" in o:
-                o = o.split("+")
-            if not isinstance(o, list):
-                o = [o]
-            for bit in o:
-                if h == bit:
-                    idx[bit] = i
-                    break
+    for group in groups:
+        if requirements.column(group) is not None:
+            idx[group] = requirements.column(group)
+    for o in output:
+        for bit in o.split("+"):
+            if requirements.column(bit) is not None:
+                idx[bit] = requirements.column(bit)
 
     rs = []
     for r in requirements:
@@ -657,7 +616,7 @@ def openapi_list_descriptions(source, field, keys,
     for bit in bits:
         api = api.get(bit)
 
-    frag = ""
+    frag = FragmentWriter()
 
     if not isinstance(keys, list):
         keys = [keys]
@@ -666,20 +625,18 @@ def openapi_list_descriptions(source, field, keys,
 
         additional = []
         if expand is not None:
-            expand.reset()
-            for e in expand:
-                if e.get(expand_on) == key:
-                    v = e.get(expand_field)
-                    if expand_anchor:
-                        ank = expand_anchor_prefix + _anchor_name(v)
-                        v = '<a href="#' + ank + '">' + v + '</a>'
-                    additional.append(v)
+            for e in expand.index(expand_on).get(key, ()):
+                v = e.get(expand_field)
+                if expand_anchor:
+                    ank = expand_anchor_prefix + _anchor_name(v)
+                    v = '<a href="#' + ank + '">' + v + '</a>'
+                additional.append(v)
             if len(additional) > 0:
                 desc += expand_prefix + ", ".join(additional) + expand_suffix
 
-        frag += " * " + desc + "\n"
+        frag.append(" * " + desc + "\n")
 
-    return frag
+    return frag.getvalue()
 
 
 def openapi_paths(source, path_order=None, method_order=None, header_depth=1, omit=None, in_brief=None):
@@ -693,7 +650,7 @@ def openapi_paths(source, path_order=None, method_order=None, header_depth=1, om
     path_names = paths.keys()
     if path_order is not None:
         path_names = ["/" + po for po in path_order]
-    frag = ""
+    frag = FragmentWriter()
     for pn in path_names:
         path_info = paths.get(pn)
         if path_info is None:
@@ -702,9 +659,9 @@ def openapi_paths(source, path_order=None, method_order=None, header_depth=1, om
             method_info = path_info.get(method)
             if method_info is None:
                 continue
-            frag += _render_method_info(header_depth, pn, method, method_info, omit, in_brief)
+            frag.append(_render_method_info(header_depth, pn, method, method_info, omit, in_brief))
 
-    return frag
+    return frag.getvalue()
 
 
 def _render_method_info(header_depth, path_name, method, method_info, omit=None, in_brief=None):
@@ -766,10 +723,11 @@ def _render_method_info(header_depth, path_name, method, method_info, omit=None,
 
 @is_markdown
 def table_rows_as_paras(source, links=None, bold=None, anchor=None):
-    reader = context.data.get(source).shape("table")
-    paras = []
-    headers = reader.next()
+    reader = context.data.get(source).shape("table").stream()
+    frag = FragmentWriter()
+    headers = next(reader)
 
+    first = True
     for row in reader:
         para = ""
         for i in range(len(row)):
@@ -786,9 +744,13 @@ def table_rows_as_paras(source, links=None, bold=None, anchor=None):
                 col = "**" + col + "**"
 
             para += a + col + " "
-        paras.append(para)
 
-    return "\n\n".join(paras)
+        if not first:
+            frag.append("\n\n")
+        frag.append(para)
+        first = False
+
+    return frag.getvalue()
 
 
 @is_inline_markdown
@@ -876,58 +838,39 @@ def fig(target, alt=None):
 
 
 def ul(source, field, link=None, size=None, offset=0, filter_field=None, filters=None):
+    from compost.renderers import md
 
-    frag = "<ul>"
-    offset = int(offset)
-    if size is not None:
-        size = int(size)
-    if filters is not None:
-        if not isinstance(filters, list):
-            filters = [filters]
-
-    reader = context.data.get(source).shape("table")
-    headers = reader.next()
-
-    filter_idx = -1
-    if filter_field is not None:
-        for i in range(len(headers)):
-            if headers[i] == filter_field:
-                filter_idx = i
-
-    n = 0
-    for row in reader:
-        if filter_field is not None:
-            val = row[filter_idx]
-            if val not in filters:
-                continue
-
-        if size is not None and n >= size + offset:
-            break
-        n += 1
-        if n < offset + 1:
-            continue
+    frag = FragmentWriter("<ul>")
+    records = _select_records(source, filter_field, filters, offset, size)
 
+    for record in records:
         li = None
         a = ""
-        for i in range(len(row)):
-            col = row[i]
-            name = headers[i]
-            if name == field:
-                a = '<a name="' + _anchor_name(col) + '"></a>'
-            if name == link:
+        if field in record:
+            col = record[field]
+            a = '<a name="' + _anchor_name(col) + '"></a>'
+            if field == link:
                 col = "[" + col + "](" + col + ")"
-            if name == field:
-                li = col
-                continue
-        li = markdown.markdown(li)[3:-4]    # removes the <p> and </p> markdown inserts
-        frag += "<li>" + a + li + "</li>"
+            li = col
+        li = md.convert(li)[3:-4]    # removes the <p> and </p> markdown inserts
+        frag.append("<li>" + a + li + "</li>")
 
-    frag += "</ul>"
-    return frag
+    frag.append("</ul>")
+    return frag.getvalue()
 
 ###############################################
 # shared (internal) utilities
 
+def _select_records(source, filter_field, filters, offset, size):
+    """The records of the source whose filter_field is one of the filters, from offset, at most size of them"""
+    where = None
+    if filter_field is not None:
+        if filters is not None and not isinstance(filters, list):
+            filters = [filters]
+        where = {filter_field : {"in" : filters}}
+    return context.data.get(source).shape("dict").query(where=where, offset=offset, limit=size)
+
+
 def _anchor_name(v):
     v = v.lower().strip()
     return v.replace(" ", "_")
@@ -1,18 +1,35 @@
-import os, time
+import os, sys, time, select, struct, ctypes, ctypes.util
 from compost.context import context
 
-def watch(dir, callback, frequency=2):
+def watch(dir, callback, frequency=2, debounce=0.2, backend="auto", max_latency=2):
+    """
+    Watch dir for changes, and call callback with a report of the new, removed and modified files.
+
+    On Linux this uses inotify, so that changes are noticed as soon as they happen; a burst of events (e.g. an
+    editor saving several files, or a checkout) is coalesced into a single report once there have been no further
+    events for `debounce` seconds, or once changes have been coming in for `max_latency` seconds, so that a
+    steady stream of events (e.g. a file being written to continually) still produces reports.  Elsewhere, or if
+    inotify is unavailable, the tree is polled every `frequency` seconds.
+    """
+    if backend in ["auto", "inotify"]:
+        notifier = Inotify.create()
+        if notifier is not None:
+            try:
+                return watch_inotify(dir, callback, notifier, debounce, max_latency)
+            except InotifyLimitException as e:
+                print(e)
+                print("Falling back to polling for changes")
+            finally:
+                notifier.close()
+    return watch_polling(dir, callback, frequency)
+
+
+def watch_polling(dir, callback, frequency=2):
     tree = {}
 
     while True:
         # first read the tree
-        newtree = {}
-        for dirpath, dirnames, filenames in os.walk(dir):
-            if len(filenames) > 0:
-                for f in filenames:
-                    filepath = os.path.join(dirpath, f)
-                    mod = os.stat(filepath).st_mtime
-                    newtree[filepath] = mod
+        newtree = _read_tree(dir)
 
         report = {
             "new" : [],
@@ -39,3 +56,181 @@ def watch(dir, callback, frequency=2):
 
         time.sleep(frequency)
 
+
+def _read_tree(dir):
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(dir):
+        if len(filenames) > 0:
+            for f in filenames:
+                filepath = os.path.join(dirpath, f)
+                try:
+                    tree[filepath] = os.stat(filepath).st_mtime
+                except OSError:
+                    # removed between listing the directory and looking at the file
+                    pass
+    return tree
+
+
+###############################################
+## inotify
+###############################################
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+             IN_DELETE_SELF | IN_MOVE_SELF
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyLimitException(Exception):
+    pass
+
+
+class Inotify(object):
+    """Minimal ctypes binding to the Linux inotify API"""
+    def __init__(self, libc, fd):
+        self._libc = libc
+        self.fd = fd
+
+    @classmethod
+    def create(cls):
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            init = libc.inotify_init1
+        except (OSError, AttributeError):
+            return None
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_add_watch.restype = ctypes.c_int
+        fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        return cls(libc, fd)
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == 28:   # ENOSPC: the user's limit on the number of watches has been reached
+                raise InotifyLimitException("Unable to watch {x}: inotify watch limit reached "
+                                            "(see /proc/sys/fs/inotify/max_user_watches)".format(x=path))
+            return None
+        return wd
+
+    def wait(self, timeout=None):
+        """Wait up to timeout seconds (forever if None) for events to be available"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        return len(readable) > 0
+
+    def read(self):
+        """Read all the available events, as (wd, mask, name) tuples"""
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(buf):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(buf, offset)
+                offset += EVENT_HEADER.size
+                name = buf[offset:offset + length].rstrip(b"\0")
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def watch_inotify(dir, callback, notifier, debounce=0.2, max_latency=2):
+    watches = {}
+    known = set()
+
+    def add_tree(root, touched):
+        # watch a directory and everything beneath it, noting any files already in there (which may have
+        # been created before the watch was in place)
+        for dirpath, dirnames, filenames in os.walk(root):
+            wd = notifier.add_watch(dirpath)
+            if wd is not None:
+                watches[wd] = dirpath
+            for f in filenames:
+                touched.add(os.path.join(dirpath, f))
+
+    initial = set()
+    add_tree(dir, initial)
+    known.update([p for p in initial if os.path.isfile(p)])
+
+    # as with polling, everything that is there to begin with is reported as new
+    if callback is not None and len(known) > 0:
+        callback({"new" : sorted(known), "removed" : [], "modified" : []})
+
+    while True:
+        notifier.wait()
+
+        # gather events until there has been a quiet period, so a burst of changes produces one report, but
+        # report anyway once the first change has waited max_latency seconds
+        deadline = time.monotonic() + max_latency
+        touched = set()
+        rescan = False
+        while True:
+            for wd, mask, name in notifier.read():
+                if mask & IN_Q_OVERFLOW:
+                    rescan = True
+                    continue
+                if mask & IN_IGNORED:
+                    watches.pop(wd, None)
+                    continue
+                parent = watches.get(wd)
+                if parent is None:
+                    continue
+                path = os.path.join(parent, name) if name else parent
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        add_tree(path, touched)
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        prefix = path + os.sep
+                        touched.update([k for k in known if k.startswith(prefix)])
+                elif name:
+                    touched.add(path)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not notifier.wait(min(debounce, remaining)):
+                break
+
+        if rescan:
+            # the kernel dropped events, so fall back to looking at everything
+            touched.update(known)
+            add_tree(dir, touched)
+
+        report = {
+            "new" : [],
+            "removed" : [],
+            "modified" : []
+        }
+        for path in sorted(touched):
+            exists = os.path.isfile(path)
+            if exists and path in known:
+                report["modified"].append(path)
+            elif exists:
+                report["new"].append(path)
+                known.add(path)
+            elif path in known:
+                report["removed"].append(path)
+                known.discard(path)
+
+        if callback is not None:
+            if len(report["new"]) > 0 or len(report["removed"]) > 0 or len(report["modified"]) > 0:
+                callback(report)
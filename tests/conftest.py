@@ -0,0 +1,89 @@
+import os, json, codecs
+import pytest
+from compost import core
+from compost.renderers import md
+from compost.context import context
+
+
+class Site(object):
+    """A compost site in a temporary directory, which can be written to and built"""
+    def __init__(self, base):
+        self.base = base
+        self.src = os.path.join(base, "source")
+        self.out = os.path.join(base, "output")
+        self.build_dir = os.path.join(base, "build")
+        self.config_file = os.path.join(base, "config.json")
+        for d in ["assets", "content/pages", "content/fragments", "data", "templates"]:
+            os.makedirs(os.path.join(self.src, d), exist_ok=True)
+        self.configure()
+
+    def configure(self, **settings):
+        config = {"src_dir" : "source", "out_dir" : "output", "build_dir" : "build"}
+        config.update(settings)
+        self.write_file(self.config_file, json.dumps(config, indent=2))
+
+    def write(self, path, text):
+        """Write a file in the source directory"""
+        self.write_file(os.path.join(self.src, path), text)
+
+    def write_file(self, path, text):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with codecs.open(path, "w", "utf-8") as f:
+            f.write(text)
+
+    def load_config(self):
+        context.config = core.load_config(self.config_file)
+        return context.config
+
+    def load_data(self):
+        """Load the config and list the data sources, as a build does, and return them"""
+        self.load_config()
+        core._load_data()
+        return context.data
+
+    def build(self, full=False, jobs=1, **kwargs):
+        self.load_config()
+        core.build(full, jobs, **kwargs)
+
+    def output(self, page):
+        with codecs.open(os.path.join(self.out, page), "r", "utf-8") as f:
+            return f.read()
+
+    def outputs(self):
+        """Everything in the output directory, by path relative to it"""
+        found = {}
+        for dirpath, dirnames, filenames in os.walk(self.out):
+            for fn in filenames:
+                path = os.path.join(dirpath, fn)
+                with open(path, "rb") as f:
+                    found[os.path.relpath(path, self.out)] = f.read()
+        return found
+
+    def report(self):
+        with codecs.open(os.path.join(self.build_dir, "report.json"), "r", "utf-8") as f:
+            return json.loads(f.read())
+
+
+@pytest.fixture
+def site(tmp_path):
+    # rendered markdown is kept in memory between builds, so start each test without any
+    md.cache = md.MarkdownCache()
+    yield Site(str(tmp_path))
+    # the context is global, so leave nothing behind for the next test
+    context.config = None
+    context.data = None
+    context.end_page()
+
+
+@pytest.fixture
+def small_site(site):
+    """A site with pages which use a template, a fragment, a data file and markdown, and an asset"""
+    site.write("templates/base.html", "<html>{% block content %}{% endblock %}</html>")
+    site.write("content/pages/a.html", '{% extends "base.html" %}{% block content %}{% include "fragments/one.md" %}'
+                                       '{{ table("people", 0, "p-") }}{% endblock %}')
+    site.write("content/pages/b.html", '{% extends "base.html" %}{% block content %}B{% endblock %}')
+    site.write("content/pages/c.md", "# C\n\nSome *text*")
+    site.write("content/fragments/one.md", "*one*")
+    site.write("data/people.csv", "Name,Team\nAnn,Dev\nBob,Test\n")
+    site.write("assets/style.css", "body {}")
+    return site
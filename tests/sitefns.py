@@ -0,0 +1,10 @@
+"""Template functions for the tests to configure as utils"""
+try:
+    from jinja2 import pass_context as contextfunction
+except ImportError:
+    from jinja2 import contextfunction
+
+
+@contextfunction
+def template_name(ctx):
+    return ctx.name
@@ -0,0 +1,69 @@
+import os
+from compost.jinja2_extensions import AtomicFileSystemBytecodeCache
+
+
+class One(object):
+    pass
+
+
+class Two(object):
+    pass
+
+
+def test_bytecode_keyed_by_extensions(tmp_path):
+    none = AtomicFileSystemBytecodeCache(str(tmp_path))
+    both = AtomicFileSystemBytecodeCache(str(tmp_path), [One, Two])
+    assert both.get_cache_key("page.html") != none.get_cache_key("page.html")
+    assert both.get_cache_key("page.html") == AtomicFileSystemBytecodeCache(str(tmp_path), [Two, One]).get_cache_key(
+        "page.html")
+    assert both.get_cache_key("page.html") != both.get_cache_key("other.html")
+
+
+def test_clean_build_keeps_content_keyed_caches(small_site):
+    small_site.build()
+    cache = os.path.join(small_site.build_dir, "cache")
+    assert "markdown" in os.listdir(cache) and "templates" in os.listdir(cache)
+    markdown = os.listdir(os.path.join(cache, "markdown"))
+
+    small_site.build(full=True)
+    assert os.listdir(os.path.join(cache, "markdown")) == markdown
+    # the compiled templates were cleaned away, then compiled again
+    assert len(os.listdir(os.path.join(cache, "templates"))) > 0
+
+
+def test_full_build_removes_compiled_templates(small_site):
+    small_site.build()
+    stale = os.path.join(small_site.build_dir, "cache", "templates", "stale")
+    with open(stale, "w") as f:
+        f.write("bytecode from another environment")
+    small_site.build(full=True)
+    assert not os.path.exists(stale)
+
+
+def test_markdown_cache_trimmed_only_after_writes(small_site, monkeypatch):
+    from compost.renderers import md
+    small_site.configure(markdown_cache={"disk_size" : 0})
+    small_site.build()
+    # the build wrote its results and then trimmed them all away, as none fit
+    assert cached_markdown(small_site) == []
+
+    walked = []
+    real_walk = os.walk
+    monkeypatch.setattr(os, "walk", lambda d, *a: walked.append(d) or real_walk(d, *a))
+    md.cache.written = 0
+    md.cache.trim()
+    assert walked == []
+    md.cache.written = 1
+    md.cache.trim()
+    assert walked == [os.path.join(small_site.build_dir, "cache", "markdown")]
+    assert md.cache.written == 0
+
+
+def test_parallel_writes_trimmed(small_site):
+    small_site.configure(markdown_cache={"disk_size" : 0})
+    small_site.build(jobs=2)
+    assert cached_markdown(small_site) == []
+
+
+def cached_markdown(site):
+    return [f for d, dirnames, filenames in os.walk(os.path.join(site.build_dir, "cache", "markdown")) for f in filenames]
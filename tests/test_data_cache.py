@@ -0,0 +1,91 @@
+import os
+from compost import models
+
+
+def parser(calls):
+    def parse(path):
+        calls.append(path)
+        with open(path) as f:
+            return {"lines" : f.read().splitlines()}
+    return parse
+
+
+def cache_files(site):
+    return [os.path.join(d, f) for d, dirnames, filenames in os.walk(os.path.join(site.build_dir, "cache", "data"))
+            for f in filenames]
+
+
+def test_parsed_once_in_memory(site):
+    site.load_config()
+    site.write("data/a.txt", "one\ntwo\n")
+    path = os.path.join(site.src, "data/a.txt")
+    calls = []
+    cache = models.DataCache()
+    assert cache.load(path, "test/1", parser(calls)) == {"lines" : ["one", "two"]}
+    assert cache.load(path, "test/1", parser(calls)) is cache.load(path, "test/1", parser(calls))
+    assert len(calls) == 1
+    assert cache.stats() == {"hits" : 2, "disk_hits" : 0, "misses" : 1}
+
+
+def test_round_trip_through_disk(site):
+    site.load_config()
+    site.write("data/a.txt", "one\ntwo\n")
+    path = os.path.join(site.src, "data/a.txt")
+    models.DataCache().load(path, "test/1", parser([]))
+    assert len(cache_files(site)) == 1
+
+    calls = []
+    cache = models.DataCache()
+    assert cache.load(path, "test/1", parser(calls)) == {"lines" : ["one", "two"]}
+    assert calls == []
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_changed_file_parsed_again(site):
+    site.load_config()
+    site.write("data/a.txt", "one\n")
+    path = os.path.join(site.src, "data/a.txt")
+    cache = models.DataCache()
+    cache.load(path, "test/1", parser([]))
+    site.write("data/a.txt", "one\nthree\n")
+    assert cache.load(path, "test/1", parser([])) == {"lines" : ["one", "three"]}
+
+    # and a later build does not get the old parse from disk either
+    calls = []
+    assert models.DataCache().load(path, "test/1", parser(calls)) == {"lines" : ["one", "three"]}
+    assert calls == []
+
+
+def test_new_parser_version_parsed_again(site):
+    site.load_config()
+    site.write("data/a.txt", "one\n")
+    path = os.path.join(site.src, "data/a.txt")
+    models.DataCache().load(path, "test/1", parser([]))
+    calls = []
+    cache = models.DataCache()
+    cache.load(path, "test/2", parser(calls))
+    assert calls == [path]
+    assert cache.stats()["misses"] == 1
+
+
+def test_damaged_cache_file_is_a_miss(site):
+    site.load_config()
+    site.write("data/a.txt", "one\n")
+    path = os.path.join(site.src, "data/a.txt")
+    models.DataCache().load(path, "test/1", parser([]))
+    cache_file = cache_files(site)[0]
+    with open(cache_file, "rb") as f:
+        key = f.readline()
+    with open(cache_file, "wb") as f:
+        f.write(key + b"not a pickle")
+    calls = []
+    assert models.DataCache().load(path, "test/1", parser(calls)) == {"lines" : ["one"]}
+    assert calls == [path]
+
+
+def test_disk_tier_can_be_turned_off(site):
+    site.configure(data_cache={"disk" : False})
+    site.load_config()
+    site.write("data/a.txt", "one\n")
+    models.DataCache().load(os.path.join(site.src, "data/a.txt"), "test/1", parser([]))
+    assert cache_files(site) == []
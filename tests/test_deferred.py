@@ -0,0 +1,49 @@
+import pytest
+from compost import deferred, exceptions
+from compost.context import context
+
+
+@pytest.fixture
+def page():
+    yield context.start_page("pages/index.html")
+    context.end_page()
+
+
+def test_placeholders_resolved_in_one_pass(page):
+    one = deferred.defer(lambda: "one")
+    two = deferred.defer(lambda: "two")
+    assert deferred.resolve("[" + one + "][" + two + "]") == "[one][two]"
+
+
+def test_resolver_called_once_per_page(page):
+    calls = []
+    def resolver():
+        calls.append(1)
+        return "x"
+    token = deferred.defer(resolver)
+    assert deferred.resolve(token + token + token) == "xxx"
+    assert len(calls) == 1
+
+
+def test_resolver_sees_state_from_after_the_placeholder(page):
+    token = deferred.defer(lambda: context.recall("later"))
+    context.remember("later", "set afterwards")
+    assert deferred.resolve(token) == "set afterwards"
+
+
+def test_resolve_without_placeholders(page):
+    assert deferred.resolve("no placeholders") == "no placeholders"
+
+
+def test_defer_without_a_page():
+    with pytest.raises(exceptions.RenderException):
+        deferred.defer(lambda: "x")
+
+
+def test_section_link_before_its_header(site):
+    site.write("content/pages/index.html",
+               "{{ section_link('Later') }}\n{{ header('First') }}\n{{ header('Later') }}")
+    site.build()
+    output = site.output("index.html")
+    assert deferred.TOKEN_PREFIX not in output
+    assert 'href="#2"' in output
@@ -0,0 +1,48 @@
+import os
+from compost import core, deps
+
+
+def test_dependencies_recorded(small_site):
+    small_site.build()
+    graph = deps.DependencyGraph.load(small_site.build_dir)
+    assert graph.deps("a.html") == ["content/fragments/one.md", "content/pages/a.html", "data/people.csv",
+                                    "templates/base.html"]
+    assert graph.deps("b.html") == ["content/pages/b.html", "templates/base.html"]
+    assert graph.deps("c.md") == ["content/pages/c.md"]
+    assert graph.rdeps("templates/base.html") == ["a.html", "b.html"]
+
+
+def test_data_and_fragment_changes_render_dependent_pages(small_site):
+    small_site.build()
+    small_site.write("data/people.csv", "Name,Team\nAnn,Dev\n")
+    small_site.build()
+    assert sorted(small_site.report()["pages"].keys()) == ["a.html"]
+    small_site.write("content/fragments/one.md", "*one more*")
+    small_site.build()
+    assert sorted(small_site.report()["pages"].keys()) == ["a.html"]
+
+
+def test_removed_page_forgotten(small_site):
+    small_site.build()
+    os.unlink(os.path.join(small_site.src, "content/pages/b.html"))
+    small_site.build()
+    graph = deps.DependencyGraph.load(small_site.build_dir)
+    assert sorted(graph.pages()) == ["a.html", "c.md"]
+
+
+def test_missing_or_corrupt_graph_is_empty(tmp_path):
+    assert list(deps.DependencyGraph.load(str(tmp_path)).pages()) == []
+    with open(str(tmp_path / deps.DEPS_FILE), "w") as f:
+        f.write("not json")
+    assert list(deps.DependencyGraph.load(str(tmp_path)).pages()) == []
+
+
+def test_deps_and_rdeps_commands(small_site, capsys):
+    small_site.build()
+    capsys.readouterr()
+    core.show_deps("content/pages/b.html")
+    assert capsys.readouterr().out.split() == ["content/pages/b.html", "templates/base.html"]
+    core.show_rdeps("data/people.csv")
+    assert capsys.readouterr().out.split() == ["a.html"]
+    core.show_deps("missing.html")
+    assert "No dependency information" in capsys.readouterr().out
@@ -0,0 +1,90 @@
+import os
+from compost import manifest
+
+
+def rendered(site):
+    return sorted(site.report()["pages"].keys())
+
+
+def test_first_build_renders_everything(small_site):
+    small_site.build()
+    assert rendered(small_site) == ["a.html", "b.html", "c.md"]
+    assert sorted(small_site.outputs().keys()) == ["a.html", "assets/style.css", "b.html", "c.md"]
+
+
+def test_nothing_changed(small_site):
+    small_site.build()
+    small_site.build()
+    assert rendered(small_site) == []
+
+
+def test_only_changed_pages_rendered(small_site):
+    small_site.build()
+    small_site.write("content/pages/b.html", '{% extends "base.html" %}{% block content %}Bee{% endblock %}')
+    small_site.build()
+    assert rendered(small_site) == ["b.html"]
+    assert small_site.output("b.html") == "<html>Bee</html>"
+
+
+def test_template_change_renders_its_pages(small_site):
+    small_site.build()
+    small_site.write("templates/base.html", "<html><body>{% block content %}{% endblock %}</body></html>")
+    small_site.build()
+    assert rendered(small_site) == ["a.html", "b.html"]
+
+
+def test_removed_page_and_asset(small_site):
+    small_site.build()
+    os.unlink(os.path.join(small_site.src, "content/pages/b.html"))
+    os.unlink(os.path.join(small_site.src, "assets/style.css"))
+    small_site.build()
+    assert sorted(small_site.outputs().keys()) == ["a.html", "c.md"]
+
+
+def test_corrupt_manifest_rebuilds_everything(small_site):
+    small_site.build()
+    with open(os.path.join(small_site.build_dir, manifest.MANIFEST_FILE), "w") as f:
+        f.write("{")
+    small_site.build()
+    assert rendered(small_site) == ["a.html", "b.html", "c.md"]
+
+
+def test_config_change_rebuilds_everything(small_site):
+    small_site.build()
+    small_site.configure(base_url="http://example.org/")
+    small_site.build()
+    assert rendered(small_site) == ["a.html", "b.html", "c.md"]
+
+
+def test_full_build(small_site):
+    small_site.build()
+    small_site.build(full=True)
+    assert rendered(small_site) == ["a.html", "b.html", "c.md"]
+
+
+def test_incremental_output_matches_full_build(small_site):
+    small_site.build()
+    small_site.write("content/fragments/one.md", "*one and a bit*")
+    small_site.build()
+    small_site.write("data/people.csv", "Name,Team\nAnn,Dev\nBob,Test\nCat,Ops\n")
+    small_site.write("content/pages/d.html", '{% extends "base.html" %}{% block content %}D{% endblock %}')
+    small_site.build()
+    os.unlink(os.path.join(small_site.src, "content/pages/c.md"))
+    small_site.build()
+    incremental = small_site.outputs()
+
+    small_site.build(full=True)
+    assert small_site.outputs() == incremental
+    assert sorted(incremental.keys()) == ["a.html", "assets/style.css", "b.html", "d.html"]
+
+
+def test_unchanged_files_not_rehashed(tmp_path):
+    path = str(tmp_path / "f.txt")
+    with open(path, "w") as f:
+        f.write("text")
+    first = manifest.fingerprint(path)
+    trusted = dict(first, sha1="not read again")
+    assert manifest.fingerprint(path, trusted) is trusted
+    with open(path, "w") as f:
+        f.write("more text")
+    assert manifest.fingerprint(path, trusted)["sha1"] != "not read again"
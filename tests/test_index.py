@@ -0,0 +1,74 @@
+import pytest
+from compost import models, utils, exceptions
+from compost.datasources.tabular import Table, RowView
+
+CSV = "Term,Kind\nalpha,a\nbeta,b\ngamma,a\nalpha,c\n"
+
+
+def test_table_index():
+    table = Table.from_rows([["Term", "Kind"], ["alpha", "a"], ["beta"], ["gamma", "a"], ["alpha", "c"]])
+    assert table.index(0, unique=True)["alpha"] == ("alpha", "a")
+    assert table.index(0)["alpha"] == (("alpha", "a"), ("alpha", "c"))
+    # short rows have no value to index by
+    assert sorted(table.index(1).keys()) == ["a", "c"]
+    assert table.index(1) is table.index(1)
+
+
+def test_table_source_index(site):
+    site.write("data/terms.csv", CSV)
+    table = site.load_data().get("terms").shape("table")
+    assert table.index("Kind")["a"] == (("alpha", "a"), ("gamma", "a"))
+    assert table.index(0, unique=True)["alpha"] == ("alpha", "a")
+    assert table.index("Missing") == {}
+
+
+def test_dict_source_index_gives_records(site):
+    site.write("data/terms.csv", CSV)
+    records = site.load_data().get("terms").shape("dict")
+    unique = records.index("Term", unique=True)
+    assert isinstance(unique["beta"], RowView)
+    assert dict(unique["alpha"]) == {"Term" : "alpha", "Kind" : "a"}
+    assert "delta" not in unique
+    assert [r["Term"] for r in records.index("Kind")["a"]] == ["alpha", "gamma"]
+    # the filter does not apply to the index
+    assert len(records.filter({"Kind" : "b"}).index("Term")) == 3
+
+
+def test_generic_index():
+    class ListSource(models.DataSource):
+        def __init__(self, records):
+            super(ListSource, self).__init__({}, None)
+            self.records = records
+
+        def __iter__(self):
+            return iter(self.records)
+
+    source = ListSource([{"id" : 1, "x" : "a"}, {"id" : 2, "x" : "a"}, {"x" : "b"}])
+    assert source.index("x")["a"] == ({"id" : 1, "x" : "a"}, {"id" : 2, "x" : "a"})
+    assert sorted(source.index("id", unique=True).keys()) == [1, 2]
+    assert source.index("x") is source.index("x")
+
+
+def test_keyed_lookups(site):
+    site.write("data/glossary.csv", CSV)
+    site.write("data/tables/references.csv", "ID,Title\nRFC1,One\n")
+    site.load_data()
+    assert utils.define("glossary", "beta").startswith("beta<sup>")
+    assert "[[RFC1](#rfc1)]" in utils.ref("RFC1")
+    with pytest.raises(exceptions.InconsistentStructureException):
+        utils.define("glossary", "delta")
+    with pytest.raises(exceptions.InconsistentStructureException):
+        utils.ref("RFC2")
+
+
+def test_json_source_index_built_once(site, monkeypatch):
+    site.write("data/api.json", '[{"id" : "a", "n" : 1}, {"id" : "b", "n" : 2}, {"id" : "a", "n" : 3}]')
+    data = site.load_data()
+    built = []
+    build_index = models.build_index
+    monkeypatch.setattr(models, "build_index", lambda *args: built.append(args[1:]) or build_index(*args))
+    for i in range(3):
+        index = data.get("api").shape("dict").index("id")
+    assert index["a"] == ({"id" : "a", "n" : 1}, {"id" : "a", "n" : 3})
+    assert data.get("api").filter({"id" : "b"}).index("id", unique=True)["a"] == {"id" : "a", "n" : 1}
+    assert built == [("id", False), ("id", True)]
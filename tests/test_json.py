@@ -0,0 +1,60 @@
+import copy, json
+import pytest
+from compost import utils
+from compost.datasources import jsonsources
+
+DOCUMENT = {
+    "info" : {"title" : "API", "version" : "1"},
+    "paths" : {"/pets" : {"get" : {"summary" : "List"}}},
+    "odd~key" : {"a.b" : 1},
+    "servers" : [{"url" : "one"}, {"url" : "two", "tags" : ["x", "y"]}]
+}
+
+
+def test_json_pointer():
+    assert jsonsources.select(DOCUMENT, "/paths/~1pets/get") == {"summary" : "List"}
+    assert jsonsources.select(DOCUMENT, "/odd~0key/a.b") == 1
+    assert jsonsources.select(DOCUMENT, "/servers/1/tags/0") == "x"
+    assert jsonsources.select(DOCUMENT, "") is DOCUMENT
+
+
+def test_dotted_path():
+    assert jsonsources.select(DOCUMENT, "info.title") == "API"
+    assert jsonsources.select(DOCUMENT, "servers.1.url") == "two"
+    assert jsonsources.select(DOCUMENT, "servers.0") == {"url" : "one"}
+
+
+@pytest.mark.parametrize("path", ["/missing", "info.missing", "servers.2", "servers.x", "/info/title/more",
+                                  "/paths/~1dogs"])
+def test_missing_path(path):
+    with pytest.raises(KeyError):
+        jsonsources.select(DOCUMENT, path)
+
+
+def test_memoised_per_document():
+    calls = []
+    document = {"a" : 1}
+    fn = lambda: calls.append(1) or len(calls)
+    assert jsonsources.memoised(document, "k", fn) == 1
+    assert jsonsources.memoised(document, "k", fn) == 1
+    assert jsonsources.memoised(document, "other", fn) == 2
+    # an equal document which is another object (e.g. the file was parsed again) starts afresh
+    assert jsonsources.memoised({"a" : 1}, "k", fn) == 3
+
+
+def test_json_extract_does_not_change_the_document(site):
+    site.write("data/api.json", json.dumps(DOCUMENT))
+    data = site.load_data()
+    document = data.get("api").shape("dict").select("")
+    before = copy.deepcopy(document)
+
+    out = utils.json_extract("data/api.json", selector="info", exclude="version", insert={"x" : 1})
+    assert json.loads(out) == {"title" : "API", "x" : 1}
+    out = utils.json_extract("data/api.json", keys=["servers"], insert={"y" : 2})
+    assert json.loads(out) == {"servers" : DOCUMENT["servers"], "y" : 2}
+    out = utils.json_extract("data/api.json", selector="/servers", listobj_match={"url" : "two"},
+                             unwrap_single_entry_list=True)
+    assert json.loads(out) == DOCUMENT["servers"][1]
+
+    assert document == before
+    assert data.get("api").shape("dict").select("") is document
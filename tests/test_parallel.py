@@ -0,0 +1,37 @@
+import os, codecs
+from compost import core
+
+
+def deps_json(site):
+    with codecs.open(os.path.join(site.build_dir, "deps.json"), "r", "utf-8") as f:
+        return f.read()
+
+
+def test_parallel_output_matches_serial(small_site):
+    small_site.write("content/pages/d.html", "{{ toc() }}<h1>{{ header('D') }}</h1>")
+    small_site.build(full=True, jobs=1)
+    serial, serial_deps = small_site.outputs(), deps_json(small_site)
+
+    small_site.build(full=True, jobs=3)
+    assert small_site.outputs() == serial
+    assert deps_json(small_site) == serial_deps
+    assert sorted(small_site.report()["pages"].keys()) == ["a.html", "b.html", "c.md", "d.html"]
+
+
+def test_session_renders_in_process_after_a_parallel_build(small_site):
+    small_site.load_config()
+    session = core.BuildSession(small_site.config_file, jobs=2)
+    session.build()
+    # the cold build was shared out between workers
+    assert session.env is None
+    parallel = small_site.outputs()
+    small_site.build(full=True, jobs=1)
+    assert small_site.outputs() == parallel
+
+    small_site.write("content/pages/b.html", '{% extends "base.html" %}{% block content %}Bee{% endblock %}')
+    session.build({"modified" : [os.path.join(small_site.src, "content/pages/b.html")]})
+    assert session.env is not None
+    assert small_site.output("b.html") == "<html>Bee</html>"
+    env = session.env
+    session.build({"modified" : [os.path.join(small_site.src, "content/pages/b.html")]})
+    assert session.env is env
@@ -0,0 +1,97 @@
+import importlib.metadata
+import pytest
+from compost import plugin
+
+GEOJSON = {
+    "plugins" : {
+        "data" : {
+            "geojson" : {
+                "file_suffixes" : ["geojson"],
+                "shapes" : {"dict" : "compost.datasources.jsonsources.DictJSONDataSource"},
+                "default" : "dict"
+            }
+        }
+    },
+    "utils" : {"template_name" : {"function" : "sitefns.template_name"}}
+}
+
+
+class EntryPoint(object):
+    """Stands in for an installed package's entry point, which provides cfg"""
+    def __init__(self, name, cfg):
+        self.name = name
+        self.value = "fakepackage:" + name
+        self.cfg = cfg
+
+    def load(self):
+        return self.cfg
+
+
+class EntryPoints(list):
+    def select(self, group):
+        return EntryPoints([ep for ep in self if group == plugin.ENTRY_POINT_GROUP])
+
+
+@pytest.fixture
+def installed(monkeypatch):
+    """Install the given entry points, in place of the real ones, for the rest of the test"""
+    def install(**cfgs):
+        eps = EntryPoints([EntryPoint(name, cfg) for name, cfg in cfgs.items()])
+        monkeypatch.setattr(importlib.metadata, "entry_points", lambda: eps)
+        monkeypatch.setattr(plugin, "_discovered", None)
+    return install
+
+
+def test_entry_point_plugin_found(site, installed):
+    installed(geojson=GEOJSON)
+    site.write("data/places.geojson", '{"type" : "FeatureCollection"}')
+    site.write("content/pages/index.html", "{{ data.get('places').select('type') }} {{ template_name() }}")
+    site.build()
+    assert site.output("index.html") == "FeatureCollection pages/index.html"
+    assert site.load_config().registry.data_plugin("geojson")["default"] == "dict"
+
+
+def test_entry_point_function(site, installed):
+    installed(geojson=lambda: GEOJSON)
+    assert site.load_config().registry.data_plugin("geojson") is not None
+
+
+def test_entry_point_may_not_replace_builtin(site, installed):
+    installed(tables={"utils" : {"table" : {"function" : "sitefns.template_name"}}})
+    with pytest.raises(plugin.PluginException, match="util table"):
+        site.load_config()
+
+    installed(csv={"plugins" : {"data" : {"csv" : {"file_suffixes" : ["csv"]}}}})
+    with pytest.raises(plugin.PluginException, match="data plugin csv"):
+        site.load_config()
+
+    installed(tsv={"plugins" : {"data" : {"tsv" : {"file_suffixes" : ["tsv", "csv"]}}}})
+    with pytest.raises(plugin.PluginException, match="file suffix csv"):
+        site.load_config()
+
+    installed(md={"plugins" : {"renderer" : {"markdown2" : {"jinja2_tag" : "markdown"}}}})
+    with pytest.raises(plugin.PluginException, match="tag markdown"):
+        site.load_config()
+
+
+def test_entry_points_may_not_replace_each_other(site, installed):
+    installed(geojson=GEOJSON, other=GEOJSON)
+    with pytest.raises(plugin.PluginException, match="Plugin other"):
+        site.load_config()
+
+
+def test_local_config_overrides_entry_point(site, installed):
+    installed(geojson=GEOJSON)
+    site.configure(plugins={"data" : {"geojson" : {"default" : "stream"}}})
+    assert site.load_config().registry.data_plugin("geojson")["default"] == "stream"
+
+
+def test_registry_first_claim_wins():
+    registry = plugin.PluginRegistry({"plugins" : {"data" : {
+        "a" : {"file_suffixes" : ["x"], "default" : "a"},
+        "b" : {"file_suffixes" : ["x", "y"], "default" : "b"}
+    }}})
+    assert registry.data_plugin("x")["default"] == "a"
+    assert registry.data_plugin("y")["default"] == "b"
+    assert registry.data_plugin("z") is None
+    assert registry.load_class("compost.plugin.PluginRegistry") is plugin.PluginRegistry
@@ -0,0 +1,74 @@
+import pytest
+from compost import query, exceptions
+
+RECORDS = [
+    {"Name" : "Ann", "Team" : "Dev", "Year" : "2012"},
+    {"Name" : "Bob", "Team" : "Test", "Year" : "2009"},
+    {"Name" : "Cat", "Team" : "Dev", "Year" : "2015"},
+    {"Name" : "Dan", "Team" : "Ops", "Year" : ""},
+    {"Name" : "Eve", "Team" : "Dev", "Year" : "2009"}
+]
+
+
+def names(records):
+    return [r["Name"] for r in records]
+
+
+def test_equality_and_operators():
+    assert names(query.plan(where={"Team" : "Dev"}).execute(RECORDS)) == ["Ann", "Cat", "Eve"]
+    assert names(query.plan(where={"Year" : {"gte" : 2010}}).execute(RECORDS)) == ["Ann", "Cat"]
+    assert names(query.plan(where={"Team" : {"in" : ["Ops", "Test"]}}).execute(RECORDS)) == ["Bob", "Dan"]
+    assert names(query.plan(where={"Name" : {"regex" : "^[AE]"}}).execute(RECORDS)) == ["Ann", "Eve"]
+
+
+def test_sort_on_every_field():
+    plan = query.plan(order_by=["Team", "-Year"])
+    assert names(plan.execute(RECORDS)) == ["Cat", "Ann", "Eve", "Dan", "Bob"]
+
+
+def test_sort_direction_other_than_desc_is_ascending():
+    assert query.plan(order_by={"Year" : "up"}).order_by == (("Year", False),)
+    assert query.plan(order_by={"Year" : "desc"}).order_by == (("Year", True),)
+
+
+def test_empty_values_sort_as_zero():
+    assert names(query.plan(order_by="Year").execute(RECORDS))[0] == "Dan"
+
+
+def test_offset_limit_and_fields():
+    plan = query.plan(order_by="Name", offset=1, limit=2, fields=["Name"])
+    assert plan.execute(RECORDS) == ({"Name" : "Bob"}, {"Name" : "Cat"})
+
+
+def test_plans_are_reused():
+    assert query.plan(where={"Team" : "Dev"}, order_by="Name") is query.plan(where={"Team" : "Dev"}, order_by="Name")
+
+
+def test_lookup_replaces_equality_scan():
+    asked = []
+    def lookup(field, value):
+        asked.append((field, value))
+        return [r for r in RECORDS if r[field] == value]
+    plan = query.plan(where={"Team" : "Dev", "Year" : {"lt" : 2013}})
+    assert names(plan.execute(RECORDS, lookup)) == ["Ann", "Eve"]
+    assert asked == [("Team", "Dev")]
+
+
+def test_invalid_queries():
+    with pytest.raises(exceptions.QueryException):
+        query.plan(where=["Team"])
+    with pytest.raises(exceptions.QueryException):
+        query.plan(where={"Team" : {"in" : "Dev"}})
+    with pytest.raises(exceptions.QueryException):
+        query.plan(where={"Name" : {"regex" : "("}})
+
+
+def test_source_sort_uses_its_first_field(site):
+    site.write("data/people.csv", "Name,Team,Year\n" + "\n".join(
+        [",".join([r["Name"], r["Team"], r["Year"]]) for r in RECORDS]) + "\n")
+    site.write("content/pages/index.html",
+               '{% for p in data.get("people").shape("dict").sort({"Year" : "down", "Name" : "desc"}) %}'
+               '{{ p.Name }} {% endfor %}')
+    site.build()
+    # the same order as sorting by Year alone, ascending
+    assert site.output("index.html") == "Dan Bob Eve Ann Cat "
@@ -0,0 +1,80 @@
+import json
+import pytest
+from compost.datasources import jsonsources
+
+RECORDS = [
+    {"id" : 1, "title" : "One", "tags" : ["a", "b"]},
+    {"id" : 22, "title" : "Two, with \"quotes\" and ] brackets", "tags" : []},
+    12345678,
+    1.5e10,
+    "a string",
+    None,
+    True,
+    {"id" : 3, "nested" : {"deep" : [1, [2, [3]]]}, "text" : "x" * 200}
+]
+
+
+def write(tmp_path, name, text):
+    path = str(tmp_path / name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 65536])
+def test_array(tmp_path, chunk_size):
+    path = write(tmp_path, "records.json", json.dumps(RECORDS, indent=2))
+    assert list(jsonsources.stream_records(path, chunk_size)) == RECORDS
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 65536])
+def test_json_lines(tmp_path, chunk_size):
+    path = write(tmp_path, "records.jsonl", "\n".join([json.dumps(r) for r in RECORDS]) + "\n")
+    assert list(jsonsources.stream_records(path, chunk_size, lines=True)) == RECORDS
+
+
+def test_byte_order_mark_and_whitespace(tmp_path):
+    path = write(tmp_path, "records.json", "\ufeff \n [ 1 ,\n 2 ] \n")
+    assert list(jsonsources.stream_records(path, 2)) == [1, 2]
+
+
+def test_empty(tmp_path):
+    assert list(jsonsources.stream_records(write(tmp_path, "a.json", "[]"))) == []
+    assert list(jsonsources.stream_records(write(tmp_path, "b.json", ""))) == []
+
+
+def test_truncated_file(tmp_path):
+    path = write(tmp_path, "records.json", '[{"id" : 1}, {"id" : ')
+    records = jsonsources.stream_records(path, 4)
+    assert next(records) == {"id" : 1}
+    with pytest.raises(ValueError):
+        next(records)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 65536])
+def test_json_lines_of_arrays(tmp_path, chunk_size):
+    path = write(tmp_path, "records.jsonl", "[1, 2]\n[3, 4]\n")
+    assert list(jsonsources.stream_records(path, chunk_size, lines=True)) == [[1, 2], [3, 4]]
+
+
+@pytest.mark.parametrize("text", ["[1,,2]", "[1 2 3]", "[,1]", "[1,]", "[1, 2] x", "[1, 2]\n[3, 4]", "[1, 2"])
+def test_invalid_arrays(tmp_path, text):
+    path = write(tmp_path, "records.json", text)
+    for chunk_size in [1, 65536]:
+        with pytest.raises(ValueError):
+            list(jsonsources.stream_records(path, chunk_size))
+
+
+def test_stream_source_of_json_lines_arrays(site):
+    site.write("data/pairs.jsonl", "[1, 2]\n[3, 4]\n")
+    assert list(site.load_data().get("pairs")) == [[1, 2], [3, 4]]
+
+
+def test_stream_source(site):
+    site.write("data/items.jsonl", "\n".join([json.dumps({"id" : i, "kind" : "odd" if i % 2 else "even"})
+                                             for i in range(10)]))
+    source = site.load_data().get("items")
+    assert [r["id"] for r in source] == list(range(10))
+    assert [r["id"] for r in source.filter({"kind" : "odd"})] == [1, 3, 5, 7, 9]
+    assert [r["id"] for r in source.sort({"id" : "desc"})][:2] == [9, 7]
+    assert [r["id"] for r in source.query(where={"id" : {"lt" : 3}}, order_by="-id")] == [2, 1, 0]
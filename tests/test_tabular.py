@@ -0,0 +1,90 @@
+import pickle
+import pytest
+from compost.datasources.tabular import Table, RowView
+
+
+def test_cells_shared_and_headers_indexed():
+    table = Table.from_rows(iter([["Name", "Team"], ["Ann", "Dev"], ["Bob", "Dev"]]))
+    assert table.rows == (("Name", "Team"), ("Ann", "Dev"), ("Bob", "Dev"))
+    assert table.rows[1][1] is table.rows[2][1]
+    assert table.column("Team") == 1
+    assert table.column("Missing") is None
+    assert len(table) == 3
+
+
+def test_repeated_header_last_column_wins():
+    table = Table.from_rows([["A", "B", "A"], ["1", "2", "3"]])
+    assert table.column("A") == 2
+    assert dict(table.records()[0]) == {"A" : "3", "B" : "2"}
+
+
+def test_empty_table():
+    table = Table.from_rows([])
+    assert table.headers == ()
+    assert len(table.records()) == 0
+
+
+def test_row_view_is_a_read_only_mapping():
+    table = Table.from_rows([["Name", "Team", "Note"], ["Ann", "Dev"]])
+    row = table.records()[0]
+    assert row["Name"] == "Ann"
+    assert row.get("Note") is None
+    assert "Note" not in row and "Team" in row
+    assert len(row) == 2
+    assert list(row) == ["Name", "Team"]
+    assert dict(row) == {"Name" : "Ann", "Team" : "Dev"}
+    assert repr(row) == repr({"Name" : "Ann", "Team" : "Dev"})
+    with pytest.raises(KeyError):
+        row["Note"]
+    with pytest.raises(TypeError):
+        row["Name"] = "Bob"
+
+
+def test_records_view():
+    records = Table.from_rows([["N"], ["1"], ["2"], ["3"]]).records()
+    assert len(records) == 3
+    assert records[-1]["N"] == "3"
+    assert [r["N"] for r in records[1:]] == ["2", "3"]
+    assert isinstance(records[0], RowView)
+    with pytest.raises(IndexError):
+        records[3]
+
+
+def test_pickled_table_keeps_shared_cells():
+    table = Table.from_rows([["Name", "Team"], ["Ann", "Dev"], ["Bob", "Dev"]])
+    table.index(1)
+    copy = pickle.loads(pickle.dumps(table))
+    assert copy.rows == table.rows
+    assert copy.rows[1][1] is copy.rows[2][1]
+    assert copy.column("Team") == 1
+
+
+def test_csv_sources_use_the_table(site):
+    site.write("data/people.csv", "\ufeffName,Team\nAnn,Dev\nBob,Test\n")
+    data = site.load_data()
+    table = data.get("people").shape("table")
+    assert table.headers() == ("Name", "Team")
+    assert list(table) == [("Name", "Team"), ("Ann", "Dev"), ("Bob", "Test")]
+    records = list(data.get("people").shape("dict"))
+    assert all([isinstance(r, RowView) for r in records])
+    assert [dict(r) for r in records] == [{"Name" : "Ann", "Team" : "Dev"}, {"Name" : "Bob", "Team" : "Test"}]
+
+
+def test_table_parses_the_file_once(site):
+    site.write("data/people.csv", "Name,Team\nAnn,Dev\n")
+    for page in ["a", "b", "c"]:
+        site.write("content/pages/" + page + ".html", '{{ table("people") }}')
+    site.build()
+    assert site.report()["data_cache"]["misses"] == 1
+    site.build(full=True)
+    assert site.report()["data_cache"]["disk_hits"] == 1
+    assert site.report()["data_cache"]["misses"] == 0
+
+
+def test_large_files_streamed(site):
+    site.configure(data_cache={"stream_size" : 10})
+    site.write("data/people.csv", "Name,Team\nAnn,Dev\n")
+    site.write("content/pages/a.html", '{{ table("people") }}')
+    site.build()
+    assert site.report()["data_cache"] == {"hits" : 0, "disk_hits" : 0, "misses" : 0}
+    assert "<td>Ann</td>" in site.output("a.html")
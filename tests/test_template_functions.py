@@ -0,0 +1,43 @@
+import json
+import pytest
+from compost import plugin, trace, profiler
+
+
+@pytest.fixture
+def context_site(site):
+    site.configure(utils={"template_name" : {"function" : "sitefns.template_name"}})
+    site.write("content/pages/index.html", "{{ template_name() }}")
+    return site
+
+
+def test_context_function(context_site):
+    context_site.build()
+    assert context_site.output("index.html") == "pages/index.html"
+
+
+def test_context_function_traced(context_site, tmp_path):
+    context_site.build(trace_file=str(tmp_path / "trace.json"))
+    assert context_site.output("index.html") == "pages/index.html"
+
+
+def test_context_function_profiled(context_site, tmp_path):
+    context_site.build(profile_file=str(tmp_path / "profile.json"))
+    assert context_site.output("index.html") == "pages/index.html"
+    with open(str(tmp_path / "profile.json")) as f:
+        profile = json.loads(f.read())
+    # the context is not written out, so every page's calls share one signature
+    assert list(profile["functions"]["template_name"]["signatures"].keys()) == ["(<Context>)"]
+
+
+def test_signatures_describe_plain_values_only():
+    sig = profiler._signature(("tables/x", 3, ["a", None], {"k" : object()}), {"flag" : True})
+    assert sig == "('tables/x', 3, ['a', None], {'k': <object>}, flag=True)"
+
+
+def test_lazy_function_imports_on_first_call():
+    fn = plugin.LazyFunction("sitefns.template_name")
+    assert fn._fn is None
+    wrapped = trace.traced("template_name", profiler.profiled("template_name", fn))
+    # the Jinja marker is found, which means importing the function
+    assert getattr(wrapped, "contextfunction", None) or getattr(wrapped, "jinja_pass_arg", None)
+    assert fn._fn is not None
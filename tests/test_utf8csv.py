@@ -0,0 +1,44 @@
+from compost import utf8csv
+
+ROWS = [["Name", "Café"], ["Ann", "é"]]
+
+
+def write(tmp_path, text):
+    path = str(tmp_path / "people.csv")
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+    return path
+
+
+def test_byte_order_mark_removed(tmp_path):
+    path = write(tmp_path, "\ufeffName,Café\r\nAnn,é\r\n")
+    with utf8csv.open_csv(path) as f:
+        assert list(utf8csv.UnicodeReader(f)) == ROWS
+    assert list(utf8csv.stream_rows(path)) == ROWS
+
+
+def test_byte_order_mark_removed_from_a_plain_file(tmp_path):
+    path = write(tmp_path, "\ufeffName,Café\nAnn,é\n")
+    with open(path, "r", encoding="utf-8") as f:
+        reader = utf8csv.UnicodeReader(f)
+        assert next(reader) == ROWS[0]
+        assert list(reader) == ROWS[1:]
+
+
+def test_without_byte_order_mark(tmp_path):
+    path = write(tmp_path, "Name,Café\nAnn,é\n")
+    assert list(utf8csv.stream_rows(path)) == ROWS
+    with utf8csv.open_csv(path) as f:
+        assert list(utf8csv.UnicodeReader(f)) == ROWS
+
+
+def test_empty_file(tmp_path):
+    with utf8csv.open_csv(write(tmp_path, "")) as f:
+        assert list(utf8csv.UnicodeReader(f)) == []
+
+
+def test_table_of_a_file_with_byte_order_mark(site):
+    site.write("data/people.csv", "\ufeffName,Team\nAnn,Dev\n")
+    site.write("content/pages/a.html", '{{ table("people") }}')
+    site.build()
+    assert "<th>Name</th>" in site.output("a.html")
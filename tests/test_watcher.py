@@ -0,0 +1,105 @@
+import os, time, threading
+import pytest
+from compost import watcher
+
+
+class Stop(Exception):
+    pass
+
+
+class BusyNotifier(object):
+    """A notifier over a file which is written to continually, so there is never a quiet period"""
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def add_watch(self, path, mask=watcher.WATCH_MASK):
+        return 1
+
+    def wait(self, timeout=None):
+        time.sleep(min(timeout or 0.01, 0.01))
+        return True
+
+    def read(self):
+        return [(1, watcher.IN_MODIFY, os.path.basename(self.path))]
+
+    def close(self):
+        pass
+
+
+class LimitedNotifier(BusyNotifier):
+    def add_watch(self, path, mask=watcher.WATCH_MASK):
+        raise watcher.InotifyLimitException("limit reached")
+
+
+def test_continual_changes_reported_after_max_latency(tmp_path):
+    path = str(tmp_path / "log.txt")
+    with open(path, "w") as f:
+        f.write("x")
+    reports = []
+    def callback(report):
+        reports.append((time.monotonic(), report))
+        if len(reports) == 2:
+            raise Stop()
+
+    start = time.monotonic()
+    with pytest.raises(Stop):
+        watcher.watch_inotify(str(tmp_path), callback, BusyNotifier(path), debounce=0.2, max_latency=0.3)
+    assert reports[0][1]["new"] == [path]
+    assert reports[1][1]["modified"] == [path]
+    assert reports[1][0] - start < 2
+
+
+def test_falls_back_to_polling_at_watch_limit(tmp_path, monkeypatch):
+    polled = []
+    monkeypatch.setattr(watcher.Inotify, "create", classmethod(lambda cls: LimitedNotifier("x")))
+    monkeypatch.setattr(watcher, "watch_polling", lambda dir, callback, frequency: polled.append(dir))
+    watcher.watch(str(tmp_path), None)
+    assert polled == [str(tmp_path)]
+
+
+def test_polling_reports_new_files(tmp_path, monkeypatch):
+    (tmp_path / "a.txt").write_text("a")
+    reports = []
+    def callback(report):
+        reports.append(report)
+        raise Stop()
+    with pytest.raises(Stop):
+        watcher.watch(str(tmp_path), callback, backend="polling")
+    assert reports == [{"new" : [str(tmp_path / "a.txt")], "removed" : [], "modified" : []}]
+
+
+def test_inotify_coalesces_a_burst(tmp_path):
+    notifier = watcher.Inotify.create()
+    if notifier is None:
+        pytest.skip("inotify is not available")
+    notifier.close()
+
+    reports = []
+    started = threading.Event()
+    def callback(report):
+        reports.append(report)
+        if len(reports) == 1:
+            started.set()
+        else:
+            raise Stop()
+
+    (tmp_path / "existing.txt").write_text("a")
+    thread = threading.Thread(target=lambda: _run(watcher.watch, str(tmp_path), callback), daemon=True)
+    thread.start()
+    assert started.wait(5)
+    (tmp_path / "existing.txt").write_text("b")
+    os.makedirs(str(tmp_path / "sub"))
+    (tmp_path / "sub" / "new.txt").write_text("c")
+    thread.join(5)
+
+    assert reports[0]["new"] == [str(tmp_path / "existing.txt")]
+    assert reports[1]["modified"] == [str(tmp_path / "existing.txt")]
+    assert reports[1]["new"] == [str(tmp_path / "sub" / "new.txt")]
+
+
+def _run(fn, *args):
+    try:
+        fn(*args)
+    except Stop:
+        pass